@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the package processing path of UpdateTitleEditor.
+
+Generates synthetic flat packages (see pkgfixtures.py) in several sizes and
+shapes, then times each phase in a fresh process and records wall time,
+peak RSS and the bytes written to disk. Results are saved as JSON and can
+be compared against an earlier run:
+
+    python3 Benchmarks/bench_package.py --sizes 1,64 --output new.json
+    python3 Benchmarks/bench_package.py --compare old.json new.json
+
+With AutoPkg installed (autopkglib importable) the real processor is timed
+(unpack_flat_pkg, find_app, genPatchVersion, cleanup). Everywhere else the
+same phases are timed on TitleEditorLib: the xar expansion stands in for
+pkgutil, and the Payload is both streamed and fully unpacked for
+comparison.
+"""
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import plistlib
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "Processor"))
+
+import pkgfixtures  # noqa: E402
+from TitleEditorLib.metadata_cache import AppMetadata  # noqa: E402
+from TitleEditorLib.patch import build_patch  # noqa: E402
+from TitleEditorLib.payload import (  # noqa: E402
+    S_IFDIR,
+    S_IFMT,
+    find_apps,
+    iter_cpio,
+    open_payload,
+)
+from TitleEditorLib.pkginfo import find_package_apps  # noqa: E402
+from TitleEditorLib.xar import XarArchive  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def io_written():
+    """Bytes this process caused to be written to storage (Linux only)"""
+    try:
+        with open("/proc/self/io") as fp:
+            for line in fp:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def tree_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class Timer:
+    """Collects one record per phase"""
+
+    def __init__(self):
+        self.phases = []
+
+    def run(self, phase, func, *args, scratch=None):
+        written = io_written()
+        start = time.perf_counter()
+        result = func(*args)
+        seconds = time.perf_counter() - start
+        after = io_written()
+        self.phases.append({
+            "phase": phase,
+            "seconds": seconds,
+            "peak_rss": peak_rss(),
+            "io_write_bytes": after - written if written is not None
+            else None,
+            "disk_bytes": tree_size(scratch) if scratch else 0,
+        })
+        return result
+
+
+# Library phases
+
+def expand_xar(pkg_path, destination):
+    """Writes every member of the package to disk, like pkgutil --expand"""
+    archive = XarArchive(pkg_path)
+    for name in archive.names():
+        path = os.path.join(destination, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fp:
+            stream = archive.open(name)
+            shutil.copyfileobj(stream, fp, MB)
+
+
+def payloads(destination):
+    if os.path.isfile(os.path.join(destination, "Payload")):
+        return [os.path.join(destination, "Payload")]
+    return sorted(glob.glob(os.path.join(destination, "*.pkg", "Payload")))
+
+
+def stream_payloads(destination):
+    for payload in payloads(destination):
+        with open(payload, "rb") as fp:
+            pattern, matches = find_apps(fp)
+        if matches:
+            return matches[0]
+    return None
+
+
+def unpack_payloads(destination):
+    """Unpacks the Payloads to disk and globs for the App, like the
+    processor did before the Payload was streamed"""
+    target = os.path.join(destination, "UnpackedPayload")
+    for payload in payloads(destination):
+        with open(payload, "rb") as fp:
+            for entry, member in iter_cpio(open_payload(fp)):
+                path = os.path.join(target, entry.name)
+                if (entry.mode & S_IFMT) == S_IFDIR:
+                    os.makedirs(path, exist_ok=True)
+                    continue
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as out:
+                    out.write(member.read())
+        matches = glob.glob(os.path.join(target, "Applications", "*.app")) \
+            or glob.glob(os.path.join(target, "*.app"))
+        if matches:
+            return matches[0]
+    return None
+
+
+def gen_patch_version(app):
+    app = AppMetadata(app.path, plistlib.loads(app.info_plist), app.mtime)
+    return build_patch("1", app, app.info_plist["CFBundleShortVersionString"])
+
+
+def library_case(pkg_path, scratch):
+    timer = Timer()
+    expanded = os.path.join(scratch, "UnpackedPackage")
+    timer.run("package_info", find_package_apps, pkg_path)
+    timer.run("unpack_flat_pkg", expand_xar, pkg_path, expanded,
+              scratch=scratch)
+    app = timer.run("find_app", stream_payloads, expanded, scratch=scratch)
+    timer.run("find_app_unpacked", unpack_payloads, expanded,
+              scratch=scratch)
+    timer.run("genPatchVersion", gen_patch_version, app)
+    timer.run("cleanup", shutil.rmtree, scratch)
+    return timer.phases
+
+
+# Processor phases
+
+def processor_case(pkg_path, scratch):
+    from UpdateTitleEditor import UpdateTitleEditor
+
+    timer = Timer()
+    processor = UpdateTitleEditor()
+    processor.env = {"RECIPE_CACHE_DIR": scratch, "scratch_dir": scratch,
+                     "pkg_path": pkg_path, "title_id": "1",
+                     "version": "1.2.3"}
+    for phase in ("unpack_flat_pkg", "find_app", "cleanup"):
+        method = getattr(processor, phase)
+        setattr(processor, phase,
+                lambda method=method, phase=phase: timer.run(
+                    phase, method, scratch=scratch))
+    app = processor.unpack()
+    timer.run("genPatchVersion", processor.genPatchVersion,
+              processor.read_app(app))
+    processor.cleanup()
+    return timer.phases
+
+
+def run_case(mode, pkg_path, scratch, queue):
+    try:
+        case = processor_case if mode == "processor" else library_case
+        queue.put(case(pkg_path, scratch))
+    except Exception as err:  # reported by the parent
+        queue.put(err)
+
+
+def have_autopkglib():
+    try:
+        import autopkglib  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def benchmark(args):
+    mode = "processor" if have_autopkglib() and not args.library \
+        else "library"
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_package.")
+    os.makedirs(workdir, exist_ok=True)
+    results = []
+    for size in args.sizes:
+        for shape in args.shapes:
+            pkg_path = os.path.join(workdir, "%s-%dMB.pkg" % (shape, size))
+            if not os.path.exists(pkg_path):
+                pkgfixtures.make_package(pkg_path, shape, size * MB)
+            for repeat in range(args.repeat):
+                scratch = tempfile.mkdtemp(dir=workdir)
+                queue = multiprocessing.Queue()
+                worker = multiprocessing.Process(
+                    target=run_case, args=(mode, pkg_path, scratch, queue))
+                worker.start()
+                phases = queue.get()
+                worker.join()
+                shutil.rmtree(scratch, ignore_errors=True)
+                if isinstance(phases, Exception):
+                    raise phases
+                for phase in phases:
+                    phase.update(mode=mode, shape=shape, size_mb=size,
+                                 repeat=repeat,
+                                 pkg_bytes=os.path.getsize(pkg_path))
+                    results.append(phase)
+                    print("%-9s %-12s %5dMB  %-18s %8.3fs  rss %6.1fMB  "
+                          "disk %8.1fMB" % (
+                              mode, shape, size, phase["phase"],
+                              phase["seconds"], phase["peak_rss"] / MB,
+                              phase["disk_bytes"] / MB))
+    if not args.workdir:
+        shutil.rmtree(workdir)
+    return {"meta": meta(), "results": results}
+
+
+def meta():
+    try:
+        revision = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "revision": revision, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def medians(data):
+    """{(mode, shape, size_mb, phase): median seconds}"""
+    grouped = {}
+    for result in data["results"]:
+        key = (result["mode"], result["shape"], result["size_mb"],
+               result["phase"])
+        grouped.setdefault(key, []).append(result["seconds"])
+    return {key: sorted(values)[len(values) // 2]
+            for key, values in grouped.items()}
+
+
+def compare(old_path, new_path, threshold):
+    with open(old_path) as fp:
+        old = medians(json.load(fp))
+    with open(new_path) as fp:
+        new = medians(json.load(fp))
+    regressions = 0
+    for key in sorted(set(old) & set(new)):
+        ratio = new[key] / old[key] if old[key] else float("inf")
+        slower = ratio > threshold and new[key] - old[key] > 0.05
+        regressions += slower
+        print("%-9s %-12s %5dMB  %-18s %8.3fs -> %8.3fs  x%.2f%s" % (
+            key + (old[key], new[key], ratio, "  REGRESSION" if slower
+                   else "")))
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="1,16,128",
+                        type=lambda value: [int(v) for v in value.split(",")],
+                        help="package sizes in MB (default %(default)s)")
+    parser.add_argument("--shapes", default=",".join(pkgfixtures.SHAPES),
+                        type=lambda value: value.split(","),
+                        help="default %(default)s")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workdir", help="keep the generated packages here")
+    parser.add_argument("--library", action="store_true",
+                        help="time TitleEditorLib even if AutoPkg is there")
+    parser.add_argument("--output", help="write the results to this JSON")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two result files instead")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="slowdown counted as regression by --compare")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(*args.compare, args.threshold)
+    data = benchmark(args)
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(data, fp, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
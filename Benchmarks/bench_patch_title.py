@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Benchmarks reading the latest version of a Jamf Pro patch software title.
+
+Generates synthetic title documents with many versions, each with its
+killapps, components and criteria like the ones Jamf Pro serves, and
+times reading the first software_version two ways:
+
+- tree: the whole document is parsed with ET.fromstring() and searched,
+  as JamfPatchTitleVersioner did before
+- stream: JamfPatchLib's read_latest_version(), which stops at the first
+  version
+
+Both are timed on the document in memory and served by a local HTTP
+server, where the stream also stops downloading. Peak memory is measured
+with tracemalloc. Results can be saved as JSON:
+
+    python3 Benchmarks/bench_patch_title.py --versions 100,1000,10000
+"""
+
+import argparse
+import http.server
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.request
+import xml.etree.ElementTree as ET
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "Processor"))
+
+from JamfPatchLib.client import endpoint_url, title_fetcher  # noqa: E402
+from JamfPatchLib.title_cache import (  # noqa: E402
+    fetch_latest_version,
+    parse_latest_version,
+    title_url,
+)
+
+MB = 1024 * 1024
+
+VERSION = """<version>
+<software_version>{version}</software_version>
+<absolute_order_id>{order}</absolute_order_id>
+<killapps><killapp><kill_app_name>Sample.app</kill_app_name>
+<kill_app_bundle_id>com.example.sample</kill_app_bundle_id></killapp>
+</killapps>
+<components><component><name>Sample</name><version>{version}</version>
+<criteria><size>2</size>
+<criterion><name>Application Bundle ID</name><priority>0</priority>
+<and_or>and</and_or><search_type>is</search_type>
+<value>com.example.sample</value></criterion>
+<criterion><name>Application Version</name><priority>1</priority>
+<and_or>and</and_or><search_type>is</search_type>
+<value>{version}</value></criterion>
+</criteria></component></components>
+<package/>
+</version>
+"""
+
+
+def make_title(versions):
+    """Returns a patch software title document with versions, newest
+    first"""
+    parts = ["<?xml version=\"1.0\" encoding=\"UTF-8\"?>"
+             "<patch_software_title><id>1</id><name>Sample</name>"
+             "<name_id>0A1</name_id><source_id>1</source_id>"
+             "<notifications><web_notification>false</web_notification>"
+             "<email_notification>false</email_notification>"
+             "</notifications><category><id>-1</id><name>No category "
+             "assigned</name></category><site><id>-1</id><name>None</name>"
+             "</site><versions>"]
+    for order in range(versions):
+        number = versions - order
+        parts.append(VERSION.format(
+            version="%d.%d.%d" % (number // 100, number // 10 % 10,
+                                  number % 10), order=order))
+    parts.append("</versions></patch_software_title>")
+    return "".join(parts).encode()
+
+
+def tree_latest_version(data):
+    return ET.fromstring(data).find("versions/version/software_version").text
+
+
+def http_tree_latest_version(url):
+    with urllib.request.urlopen(url) as response:
+        return tree_latest_version(response.read())
+
+
+class TitleServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    document = b""
+    sent = 0
+
+
+class TitleHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        document = self.server.document
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(document)))
+        self.end_headers()
+        try:
+            for offset in range(0, len(document), 64 * 1024):
+                self.wfile.write(document[offset:offset + 64 * 1024])
+                self.server.sent += min(64 * 1024, len(document) - offset)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def measure(func, *args):
+    """Returns (result, seconds, peak bytes allocated)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def benchmark(args):
+    server = TitleServer(("127.0.0.1", 0), TitleHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = "http://127.0.0.1:%d" % server.server_address[1]
+    url = title_url(endpoint_url(base_url), 1)
+    fetch = title_fetcher(base_url, "token")
+    cases = [
+        ("tree", lambda data: tree_latest_version(data)),
+        ("stream", lambda data: parse_latest_version(data)),
+        ("http_tree", lambda data: http_tree_latest_version(url)),
+        ("http_stream", lambda data: fetch_latest_version(
+            fetch, 1)[0]["version"]),
+    ]
+    results = []
+    try:
+        for versions in args.versions:
+            document = make_title(versions)
+            server.document = document
+            expected = tree_latest_version(document)
+            for case, func in cases:
+                runs = []
+                for _ in range(args.repeat):
+                    server.sent = 0
+                    result, seconds, peak = measure(func, document)
+                    if result != expected:
+                        raise SystemExit("%s returned %r instead of %r"
+                                         % (case, result, expected))
+                    runs.append((seconds, peak, server.sent))
+                seconds, peak, sent = sorted(runs)[len(runs) // 2]
+                results.append({"case": case, "versions": versions,
+                                "document_bytes": len(document),
+                                "seconds": seconds, "peak_bytes": peak,
+                                "sent_bytes": sent if case.startswith(
+                                    "http") else None})
+                print("%-12s %6d versions  %7.2fMB  %8.4fs  peak %8.2fMB%s" % (
+                    case, versions, len(document) / MB, seconds, peak / MB,
+                    "  sent %.2fMB" % (sent / MB)
+                    if case.startswith("http") else ""))
+    finally:
+        server.shutdown()
+    return {"meta": {"python": platform.python_version(),
+                     "platform": platform.platform(),
+                     "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--versions", default="100,1000,10000",
+                        type=lambda value: [int(v) for v in value.split(",")],
+                        help="versions per title (default %(default)s)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write the results to this JSON")
+    args = parser.parse_args(argv)
+
+    data = benchmark(args)
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(data, fp, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the predicate evaluation of SleepIf.
+
+Times the import of SleepIfLib.predicate and of Foundation in fresh
+interpreters, then the evaluation of predicates like the ones in recipes
+against an AutoPkg-sized environment:
+
+- python: SleepIfLib's evaluator, compiled once and cached
+- python_uncached: parsed again for every evaluation
+- nspredicate: NSPredicate.predicateWithFormat_() and evaluateWithObject_()
+  on every call, as SleepIf did before (only where PyObjC is installed)
+
+Results can be saved as JSON:
+
+    python3 Benchmarks/bench_predicate.py --evaluations 10000
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROCESSOR_DIR = os.path.join(os.path.dirname(HERE), "Processor")
+sys.path.insert(0, PROCESSOR_DIR)
+
+from SleepIfLib.predicate import compile_predicate  # noqa: E402
+
+PREDICATES = [
+    "download_changed == TRUE",
+    "version != '1.2.3'",
+    "NAME BEGINSWITH[c] 'fire' AND version LIKE '12*'",
+    "(pkg_uploaded == TRUE OR patch_changed == YES) AND NOT NAME IN "
+    "{'Zoom', 'Slack', 'Teams'}",
+]
+
+IMPORT_SNIPPET = """
+import sys, time
+sys.path.insert(0, %r)
+start = time.perf_counter()
+try:
+    import %s
+except ImportError:
+    print("null")
+else:
+    print(time.perf_counter() - start)
+"""
+
+
+def make_env():
+    """An environment like AutoPkg's at the end of a recipe"""
+    env = {"NAME": "Firefox", "version": "128.0.3", "download_changed": True,
+           "pkg_uploaded": False, "patch_changed": True,
+           "RECIPE_CACHE_DIR": "/Users/autopkg/Library/AutoPkg/Cache/x"}
+    for index in range(150):
+        env["KEY_%d" % index] = "value %d" % index
+    return env
+
+
+def import_seconds(module, repeat):
+    """Median seconds to import module in a fresh interpreter, None if it
+    isn't installed"""
+    times = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, "-c", IMPORT_SNIPPET % (PROCESSOR_DIR, module)])
+        value = json.loads(output)
+        if value is None:
+            return None
+        times.append(value)
+    return sorted(times)[len(times) // 2]
+
+
+def have_foundation():
+    try:
+        from Foundation import NSPredicate  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def evaluate_cases(foundation):
+    cases = {
+        "python": lambda predicate, env: compile_predicate(predicate)(env),
+        "python_uncached": lambda predicate, env:
+            compile_predicate.__wrapped__(predicate)(env),
+    }
+    if foundation:
+        from Foundation import NSPredicate
+
+        cases["nspredicate"] = lambda predicate, env: \
+            NSPredicate.predicateWithFormat_(predicate) \
+            .evaluateWithObject_(env)
+    return cases
+
+
+def benchmark(args):
+    results = []
+    for module in ("SleepIfLib.predicate", "Foundation"):
+        seconds = import_seconds(module, args.repeat)
+        results.append({"case": "import", "module": module,
+                        "seconds": seconds})
+        print("import %-22s %s" % (module, "not installed" if seconds is None
+                                   else "%8.2fms" % (seconds * 1000)))
+    env = make_env()
+    cases = evaluate_cases(have_foundation())
+    for predicate in PREDICATES:
+        expected = None
+        for case, func in cases.items():
+            result = bool(func(predicate, env))
+            if expected is None:
+                expected = result
+            elif result != expected:
+                raise SystemExit("%s evaluates %r as %r instead of %r"
+                                 % (case, predicate, result, expected))
+            start = time.perf_counter()
+            for _ in range(args.evaluations):
+                func(predicate, env)
+            seconds = (time.perf_counter() - start) / args.evaluations
+            results.append({"case": case, "predicate": predicate,
+                            "seconds": seconds})
+            print("%-16s %9.2fus  %s" % (case, seconds * 1e6, predicate))
+    return {"meta": {"python": platform.python_version(),
+                     "platform": platform.platform(),
+                     "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--evaluations", type=int, default=10000,
+                        help="evaluations per predicate (default "
+                        "%(default)s)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="interpreters started per import")
+    parser.add_argument("--output", help="write the results to this JSON")
+    args = parser.parse_args(argv)
+
+    data = benchmark(args)
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(data, fp, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
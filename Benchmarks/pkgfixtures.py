@@ -0,0 +1,273 @@
+"""
+Writes synthetic flat packages for the benchmarks, on any platform.
+
+The packages are built the way pkgbuild/productbuild lay them out: a xar
+archive holding PackageInfo, Bom and a gzip (or pbzx) compressed cpio
+Payload, or a Distribution with one or more component *.pkg directories.
+The xar archives carry no checksum (cksum_alg none).
+"""
+
+import gzip
+import io
+import lzma
+import os
+import plistlib
+import shutil
+import struct
+import tempfile
+import zlib
+from xml.sax.saxutils import quoteattr
+
+MTIME = 1700000000
+CHUNK = 1024 * 1024
+
+SHAPES = ("flat", "binary-plist", "root-app", "nested", "pbzx")
+
+
+# cpio (odc)
+
+def cpio_header(name, mode, size, mtime=MTIME):
+    name = name.encode() + b"\0"
+    return b"070707" + b"%06o%06o%06o%06o%06o%06o%06o%011o%06o%011o" % (
+        0, 0, mode, 0, 0, 1, 0, mtime, len(name), size) + name
+
+
+def write_cpio(fp, entries):
+    """entries: (name, mode, size, chunk_iterable) tuples"""
+    for name, mode, size, chunks in entries:
+        fp.write(cpio_header(name, mode, size))
+        for chunk in chunks:
+            fp.write(chunk)
+    fp.write(cpio_header("TRAILER!!!", 0, 0, 0))
+
+
+def filler(size):
+    """Incompressible data, so the Payload is about as big as size"""
+    while size > 0:
+        yield os.urandom(min(size, CHUNK))
+        size -= CHUNK
+
+
+# Payload
+
+def info_plist(bundle_id, version, binary=False):
+    return plistlib.dumps({
+        "CFBundleIdentifier": bundle_id,
+        "CFBundleName": bundle_id.rsplit(".", 1)[-1],
+        "CFBundleShortVersionString": version,
+        "CFBundleVersion": version.replace(".", ""),
+        "LSMinimumSystemVersion": "12.0",
+    }, fmt=plistlib.FMT_BINARY if binary else plistlib.FMT_XML)
+
+
+def app_tree(app_path, bundle_id, version, binary_size, binary_plist):
+    """Returns (path, mode, size, chunks) for a minimal App-Bundle"""
+    plist = info_plist(bundle_id, version, binary_plist)
+    executable = app_path + "/Contents/MacOS/" + \
+        os.path.basename(app_path)[:-4]
+    return [
+        ("./" + app_path, 0o40755, 0, []),
+        ("./" + app_path + "/Contents", 0o40755, 0, []),
+        ("./" + app_path + "/Contents/MacOS", 0o40755, 0, []),
+        ("./" + executable, 0o100755, binary_size, filler(binary_size)),
+        ("./" + app_path + "/Contents/Info.plist", 0o100644, len(plist),
+         [plist]),
+    ]
+
+
+def pbzx_compress(src, dst, chunk_size=16 * CHUNK):
+    # bit 24 of the flags says that chunks follow
+    dst.write(b"pbzx" + struct.pack(">Q", 0x01000000))
+    chunk = src.read(chunk_size)
+    while chunk:
+        following = src.read(chunk_size)
+        data = lzma.compress(chunk, format=lzma.FORMAT_XZ, preset=0)
+        dst.write(struct.pack(">QQ", 0x01000000 if following else 0,
+                              len(data)) + data)
+        chunk = following
+
+
+def write_payload(path, entries, compression="gzip"):
+    if compression == "pbzx":
+        with tempfile.TemporaryFile() as raw:
+            write_cpio(raw, entries)
+            raw.seek(0)
+            with open(path, "wb") as fp:
+                pbzx_compress(raw, fp)
+    else:
+        with open(path, "wb") as raw, \
+                gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=1,
+                              mtime=0) as fp:
+            write_cpio(fp, entries)
+
+
+# Bom
+
+def bom(entries):
+    """entries: (path, mode, size) starting with '.'"""
+    blocks = [b""]
+
+    def add(data):
+        blocks.append(data)
+        return len(blocks) - 1
+
+    ids = {}
+    leaves = []
+    for file_id, (path, mode, size) in enumerate(entries, 1):
+        ids[path] = file_id
+        parent = ids.get(path.rsplit("/", 1)[0], 0) if path != "." else 0
+        ftype = 2 if mode & 0o40000 else 1
+        info2 = add(struct.pack(">BBHHIIIIBII", ftype, 1, 0xf, mode & 0xffff,
+                                0, 0, MTIME, size, 1, 0, 0))
+        info1 = add(struct.pack(">II", file_id, info2))
+        name = add(struct.pack(">I", parent) +
+                   path.rsplit("/", 1)[-1].encode() + b"\0")
+        leaves.append((info1, name))
+    leaf = add(struct.pack(">HHII", 1, len(leaves), 0, 0) +
+               b"".join(struct.pack(">II", *entry) for entry in leaves))
+    tree = add(b"tree" + struct.pack(">IIII", 1, leaf, 4096, len(leaves)) +
+               b"\0")
+
+    body = io.BytesIO()
+    body.write(b"\0" * 512)
+    index = []
+    for data in blocks:
+        index.append((body.tell() if data else 0, len(data)))
+        body.write(data)
+    index_offset = body.tell()
+    body.write(struct.pack(">I", len(index)) +
+               b"".join(struct.pack(">II", *entry) for entry in index))
+    vars_offset = body.tell()
+    variables = struct.pack(">IIB", 1, tree, 5) + b"Paths"
+    body.write(variables)
+    data = bytearray(body.getvalue())
+    data[:32] = b"BOMStore" + struct.pack(
+        ">6I", 1, len(blocks), index_offset, len(index) * 8 + 4, vars_offset,
+        len(variables))
+    return bytes(data)
+
+
+def package_info(identifier, version, bundles):
+    bundle_xml = "".join(
+        '<bundle id=%s CFBundleShortVersionString=%s CFBundleVersion=%s '
+        'path=%s/>' % (quoteattr(bundle_id), quoteattr(vers),
+                       quoteattr(vers.replace(".", "")),
+                       quoteattr("./" + path))
+        for bundle_id, vers, path in bundles)
+    return ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<pkg-info format-version="2" identifier=%s version=%s '
+            'install-location="/" auth="root"><payload numberOfFiles="5" '
+            'installKBytes="1"/>%s</pkg-info>'
+            % (quoteattr(identifier), quoteattr(version),
+               bundle_xml)).encode()
+
+
+# xar
+
+def write_xar(path, members):
+    """members: list of (name, bytes or file path); file paths are stored
+    as they are (Payloads are compressed already), bytes are zlib encoded"""
+    heap = []
+    offset = 0
+    files = {}
+    for name, data in members:
+        if isinstance(data, bytes):
+            encoded = zlib.compress(data)
+            entry = (offset, len(encoded), len(data), "application/x-gzip",
+                     encoded)
+        else:
+            size = os.path.getsize(data)
+            entry = (offset, size, size, "application/octet-stream", data)
+        offset += entry[1]
+        heap.append(entry[4])
+        node = files
+        parts = name.split("/")
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = entry
+
+    counter = [0]
+
+    def toc_xml(node):
+        xml = ""
+        for name, value in node.items():
+            counter[0] += 1
+            if isinstance(value, dict):
+                xml += ('<file id="%d"><name>%s</name><type>directory</type>'
+                        '%s</file>' % (counter[0], name, toc_xml(value)))
+            else:
+                xml += ('<file id="%d"><name>%s</name><type>file</type><data>'
+                        '<offset>%d</offset><length>%d</length>'
+                        '<size>%d</size><encoding style="%s"/></data></file>'
+                        % (counter[0], name, value[0], value[1], value[2],
+                           value[3]))
+        return xml
+
+    toc = ('<?xml version="1.0" encoding="UTF-8"?><xar><toc>%s</toc></xar>'
+           % toc_xml(files)).encode()
+    compressed = zlib.compress(toc)
+    with open(path, "wb") as fp:
+        fp.write(struct.pack(">4sHHQQI", b"xar!", 28, 1, len(compressed),
+                             len(toc), 0))
+        fp.write(compressed)
+        for data in heap:
+            if isinstance(data, bytes):
+                fp.write(data)
+            else:
+                with open(data, "rb") as src:
+                    shutil.copyfileobj(src, fp, CHUNK)
+
+
+# Packages
+
+def component(workdir, prefix, app_path, bundle_id, version, size,
+              binary_plist=False, compression="gzip"):
+    """Returns the xar members of one component package"""
+    entries = [(".", 0o40755, 0, [])]
+    if app_path.startswith("Applications/"):
+        entries.append(("./Applications", 0o40755, 0, []))
+    entries += app_tree(app_path, bundle_id, version, size, binary_plist)
+    payload = os.path.join(workdir, prefix.replace("/", "_") + "Payload")
+    write_payload(payload, entries, compression)
+    bom_data = bom([(name[2:] and "./" + name[2:] or ".", mode, size)
+                    for name, mode, size, _ in entries])
+    info = package_info(bundle_id + ".pkg", version,
+                        [(bundle_id, version, app_path)])
+    return [(prefix + "PackageInfo", info), (prefix + "Bom", bom_data),
+            (prefix + "Payload", payload)]
+
+
+def make_package(path, shape="flat", size=CHUNK, version="1.2.3",
+                 components=8):
+    """Writes a synthetic package of about size bytes and returns path"""
+    if shape not in SHAPES:
+        raise ValueError("Unknown shape %s" % shape)
+    workdir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        if shape == "nested":
+            # The App is in the last of several equally sized components
+            members = [("Distribution",
+                        b'<?xml version="1.0" encoding="utf-8"?>'
+                        b'<installer-gui-script minSpecVersion="2">'
+                        b'<allowed-os-versions><os-version min="12.0"/>'
+                        b'</allowed-os-versions></installer-gui-script>')]
+            for index in range(components):
+                last = index == components - 1
+                app = "Applications/Sample.app" if last else \
+                    "Library/Sample%d.app" % index
+                members += component(workdir, "Sample%d.pkg/" % index, app,
+                                     "com.example.sample%s"
+                                     % ("" if last else index), version,
+                                     size // components)
+        else:
+            app = "Sample.app" if shape == "root-app" \
+                else "Applications/Sample.app"
+            members = component(workdir, "", app, "com.example.sample",
+                                version, size,
+                                binary_plist=shape == "binary-plist",
+                                compression="pbzx" if shape == "pbzx"
+                                else "gzip")
+        write_xar(path, members)
+    finally:
+        shutil.rmtree(workdir)
+    return path
@@ -1,71 +1,287 @@
 #!/usr/local/autopkg/python
 
+import os
+import sys
+import threading
 import requests
-import json
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
 from autopkglib import Processor, ProcessorError
 
+# to use a base module in AutoPkg we need to add this path to the sys.path.
+# this violates flake8 E402 (PEP8 imports) but is unavoidable, so the following
+# imports require noqa comments for E402
+sys.path.insert(0, os.path.dirname(__file__))
+
+from JamfPatchLib.json_stream import JSONStreamError, iter_json_array  # noqa: E402
+from SharedLib.paths import jamf_patch_cache_root  # noqa: E402
+from SharedLib.token_cache import TokenCache  # noqa: E402
+
 __all__ = ["JamfClearPatchNotifications"]
 
+DEFAULT_WORKERS = 8
+TIMEOUT = 60
+READ_CHUNK = 64 * 1024
+
+# Sessions outlive a recipe, so the recipes of one autopkg run share their
+# keep-alive connections
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(jamf_url, pool_size=DEFAULT_WORKERS):
+    """Returns the pooled requests.Session for jamf_url"""
+    with _sessions_lock:
+        session = _sessions.get(jamf_url)
+        if session is None or session.pool_size < pool_size:
+            session = requests.Session()
+            session.pool_size = pool_size
+            session.mount("https://", HTTPAdapter(pool_maxsize=pool_size))
+            session.mount("http://", HTTPAdapter(pool_maxsize=pool_size))
+            _sessions[jamf_url] = session
+        return session
+
+
+def pair_key(patch_name, version):
+    return (str(patch_name), str(version))
+
+
+def notification_key(item):
+    """Returns (softwareTitleName, latestVersion) of a PATCH_UPDATE
+    notification, None for other types"""
+    if not isinstance(item, dict) or item.get("type") != "PATCH_UPDATE":
+        return None
+    params = item.get("params") or {}
+    return pair_key(params.get("softwareTitleName"), params.get("latestVersion"))
+
+
+def find_notifications(items, pairs):
+    """Returns {pair: id} of the PATCH_UPDATE notifications of pairs, and
+    stops consuming items once all were found"""
+    wanted = set(pairs)
+    found = {}
+    for item in items:
+        key = notification_key(item)
+        if key in wanted and key not in found:
+            found[key] = str(item["id"])
+            if len(found) == len(wanted):
+                break
+    return found
+
+
 class JamfClearPatchNotifications(Processor):
     """Clear notifications for patch policies in Jamf Pro."""
 
     input_variables = {
         "patch_name": {
-            "required": True,
-            "description": "The title of the patch to clear notifications for.",
+            "required": False,
+            "description": "The title of the patch to clear notifications for. "
+            "Required unless patches is set.",
         },
         "version": {
-            "required": True,
-            "description": "The patch version to clear notifications for.",
+            "required": False,
+            "description": "The patch version to clear notifications for. "
+            "Required unless patches is set.",
+        },
+        "patches": {
+            "required": False,
+            "description": "List of {patch_name, version} dictionaries (or "
+            "[patch_name, version] pairs) to clear in one run instead of "
+            "patch_name and version. Pairs without a notification are reported, "
+            "not failed.",
+        },
+        "clear_workers": {
+            "required": False,
+            "description": "Notifications dismissed at the same time with patches.",
+            "default": str(DEFAULT_WORKERS),
+        },
+    }
+    output_variables = {
+        "cleared_notifications": {
+            "description": "List of the patch_name/version pairs cleared.",
+        },
+        "missing_notifications": {
+            "description": "List of the patch_name/version pairs without a "
+            "notification.",
+        },
+        "failed_notifications": {
+            "description": "List of the patch_name/version pairs that could not "
+            "be cleared, with the error.",
         },
     }
-    output_variables = {}
 
-    def main(self):
-        # Get the version and title from the input variables
-        patch_name = self.env.get("patch_name")
-        version = self.env.get("version")
+    def patch_pairs(self):
+        """Returns the (patch_name, version) pairs to clear"""
+        patches = self.env.get("patches")
+        if not patches:
+            patch_name = self.env.get("patch_name")
+            version = self.env.get("version")
+            if not patch_name or not version:
+                raise ProcessorError("patch_name and version, or patches, are required")
+            return [pair_key(patch_name, version)]
+        pairs = []
+        for patch in patches:
+            try:
+                if isinstance(patch, dict):
+                    pairs.append(pair_key(patch["patch_name"], patch["version"]))
+                else:
+                    patch_name, version = patch
+                    pairs.append(pair_key(patch_name, version))
+            except (KeyError, TypeError, ValueError):
+                raise ProcessorError(f"Patch without patch_name/version: {patch!r}")
+        return list(dict.fromkeys(pairs))
 
-        # Build the URL for the Jamf Pro API
-        jamf_url = self.env.get("JSS_URL")
-        auth_url = jamf_url + "/api/v1/auth/token"
-        not_url = jamf_url + "/api/v1/notifications"
+    def token_cache(self):
+        return TokenCache(
+            os.path.join(jamf_patch_cache_root(self.env), "tokens.json")
+        )
 
-        username = self.env.get("API_USERNAME")
-        password = self.env.get("API_PASSWORD")
+    def get_token(self, fresh=False):
+        """Returns a bearer token, reused from earlier runs until shortly
+        before it expires unless fresh is set"""
+        cache = self.token_cache()
+        if not fresh:
+            token = cache.get(self.jamf_url, self.username)
+            if token:
+                self.output("Using cached auth token", 2)
+                return token
 
-        # Make a PUT request to the Jamf Pro API to clear notifications for the patch policy
         headers = {"Content-Type": "application/json"}
-        tokenreq = requests.post(auth_url, auth=(username,password), headers=headers)
-        token = tokenreq.json()["token"]
+        try:
+            tokenreq = self.session.post(
+                self.jamf_url + "/api/v1/auth/token",
+                auth=(self.username, self.password),
+                headers=headers,
+                timeout=TIMEOUT,
+            )
+        except requests.RequestException as err:
+            raise ProcessorError(f"Error getting auth token: {err}")
 
-        # Check if the request was successful
+        # Check if the request was successful before reading the token
         if tokenreq.status_code != 200:
             raise ProcessorError(f"Error getting auth token: {tokenreq.status_code}")
+        try:
+            body = tokenreq.json()
+            token = body["token"]
+        except (ValueError, KeyError, TypeError):
+            raise ProcessorError("Error getting auth token: no token in the response")
+        cache.put(self.jamf_url, self.username, token, body.get("expires"))
+        return token
 
-        headers = {"accept": "application/json", "Authorization": "Bearer {}".format(token)}
-        get_not_response = requests.get(not_url, headers=headers)
-
-        data = json.loads(get_not_response.text)
-        for item in data:
-            if item["type"] == "PATCH_UPDATE":
-                if item["params"]["softwareTitleName"] == patch_name and item["params"]["latestVersion"] == version:
-                    notification_id = item["id"]
-                    self.output(notification_id)
-                    break
-        
-        dheaders = {"Authorization": "Bearer {}".format(token)}
-        dismiss_url = not_url + "/PATCH_UPDATE/" +notification_id
-        self.output(dismiss_url)
-        dismiss_response = requests.delete(
-            url=dismiss_url,
-            headers=dheaders)
+    def api_request(self, method, url, headers=None, stream=False):
+        """
+        Sends a request with the bearer token. A 401 means the cached token
+        was revoked: it is dropped and the request sent once more with a new
+        one. Concurrent requests share that new token.
+        """
+        for attempt in range(2):
+            token = self.token
+            request_headers = dict(headers or {})
+            request_headers["Authorization"] = "Bearer {}".format(token)
+            response = self.session.request(
+                method, url, headers=request_headers, timeout=TIMEOUT, stream=stream
+            )
+            if response.status_code != 401 or attempt:
+                return response
+            response.close()
+            with self.token_lock:
+                if self.token == token:
+                    self.output("Auth token rejected, getting a new one", 2)
+                    self.token_cache().invalidate(self.jamf_url, self.username)
+                    self.token = self.get_token(fresh=True)
+        return response
 
+    def dismiss(self, not_url, notification_id):
+        """Dismisses one notification, returns None or the error"""
+        dismiss_url = not_url + "/PATCH_UPDATE/" + notification_id
+        try:
+            dismiss_response = self.api_request("DELETE", dismiss_url)
+        except (requests.RequestException, ProcessorError) as err:
+            return str(err)
         if dismiss_response.status_code not in (200, 201, 204):
-            raise ProcessorError(f"Error dismissing notification: {dismiss_response.status_code}")
+            return f"Error dismissing notification: {dismiss_response.status_code}"
+        return None
+
+    def main(self):
+        # Get the versions and titles from the input variables
+        pairs = self.patch_pairs()
+        workers = max(1, int(self.env.get("clear_workers", DEFAULT_WORKERS)))
+
+        # Build the URL for the Jamf Pro API
+        self.jamf_url = self.env.get("JSS_URL")
+        not_url = self.jamf_url + "/api/v1/notifications"
+
+        self.username = self.env.get("API_USERNAME")
+        self.password = self.env.get("API_PASSWORD")
+        if not self.username or not self.password:
+            raise ProcessorError("API_USERNAME and API_PASSWORD are required")
+
+        # One pooled keep-alive session for the token, list and deletes
+        self.session = get_session(self.jamf_url, workers)
+        self.token = self.get_token()
+        self.token_lock = threading.Lock()
+
+        # The list is fetched once, whatever the number of pairs, and read
+        # only until the notifications of all pairs were seen
+        headers = {"accept": "application/json"}
+        try:
+            with self.api_request("GET", not_url, headers, stream=True) as get_not_response:
+                if get_not_response.status_code != 200:
+                    raise ProcessorError(
+                        f"Error getting notifications: {get_not_response.status_code}"
+                    )
+                notifications = find_notifications(
+                    iter_json_array(get_not_response.iter_content(READ_CHUNK)), pairs
+                )
+        except requests.RequestException as err:
+            raise ProcessorError(f"Error getting notifications: {err}")
+        except JSONStreamError as err:
+            raise ProcessorError(f"Error reading notifications: {err}")
+
+        found = [(pair, notifications[pair]) for pair in pairs if pair in notifications]
+        missing = [pair for pair in pairs if pair not in notifications]
+        with ThreadPoolExecutor(min(workers, max(1, len(found)))) as pool:
+            errors = list(
+                pool.map(lambda item: self.dismiss(not_url, item[1]), found)
+            )
+
+        cleared = []
+        failed = []
+        for ((patch_name, version), notification_id), error in zip(found, errors):
+            if error is None:
+                cleared.append({"patch_name": patch_name, "version": version})
+                self.output(
+                    f"Successfully cleared notification {notification_id} for "
+                    f"{patch_name} version {version}"
+                )
+            else:
+                failed.append({"patch_name": patch_name, "version": version, "error": error})
+                self.output(f"Could not clear {patch_name} version {version}: {error}")
+        for patch_name, version in missing:
+            self.output(f"No notification for {patch_name} version {version}")
+
+        self.env["cleared_notifications"] = cleared
+        self.env["missing_notifications"] = [
+            {"patch_name": patch_name, "version": version} for patch_name, version in missing
+        ]
+        self.env["failed_notifications"] = failed
+        if len(pairs) > 1:
+            self.output(
+                f"Cleared {len(cleared)}, missing {len(missing)}, failed {len(failed)} "
+                f"of {len(pairs)} notifications"
+            )
+
+        if failed:
+            raise ProcessorError(
+                "Error dismissing notifications: "
+                + "; ".join(f"{f['patch_name']} {f['version']}: {f['error']}" for f in failed)
+            )
+        if missing and not self.env.get("patches"):
+            patch_name, version = missing[0]
+            raise ProcessorError(f"No notification found for {patch_name} version {version}")
 
-        self.output(f"Successfully cleared notification for {patch_name} version {version}")
 
 if __name__ == "__main__":
     processor = JamfClearPatchNotifications()
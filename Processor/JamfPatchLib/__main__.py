@@ -0,0 +1,106 @@
+"""
+Command line tools for the patch title caches used by
+JamfPatchTitleVersioner. Run from the Processor directory, e.g.:
+
+    python3 -m JamfPatchLib versions "Mozilla Firefox" "Zoom Client"
+    python3 -m JamfPatchLib versions --names titles.txt -o versions.plist
+"""
+
+import argparse
+import json
+import os
+import plistlib
+import sys
+
+from JamfPatchLib.auth import AuthError, get_token
+from JamfPatchLib.bulk import DEFAULT_WORKERS, latest_versions, write_versions
+from JamfPatchLib.client import list_patch_titles, title_fetcher
+from JamfPatchLib.title_cache import (INDEX_TTL, PatchTitleIndex,
+                                      VersionCache, server_key)
+from SharedLib.paths import autopkg_settings, jamf_patch_cache_root
+
+
+def read_names(path):
+    """Reads a JSON or plist list of names, or one name per line"""
+    try:
+        with open(path, "rb") as fp:
+            data = fp.read()
+        if data.lstrip().startswith(b"["):
+            return [str(name) for name in json.loads(data)]
+        if data.lstrip().startswith(b"<?xml"):
+            return [str(name) for name in plistlib.loads(data)]
+    except (OSError, ValueError, plistlib.InvalidFileException) as err:
+        sys.exit("Can't read %s: %s" % (path, err))
+    return [line.strip() for line in data.decode().splitlines()
+            if line.strip() and not line.startswith("#")]
+
+
+def versions_command(args):
+    settings = autopkg_settings()
+    names = list(args.titles)
+    if args.names:
+        names += read_names(args.names)
+    if not names:
+        sys.exit("No patch software titles given")
+    jamf_url = settings.get("JSS_URL")
+    if not jamf_url:
+        sys.exit("JSS_URL not set in AutoPkg preferences or environment")
+    try:
+        token = get_token(jamf_url, settings.get("API_USERNAME"),
+                          settings.get("API_PASSWORD"),
+                          settings.get("CLIENT_ID"),
+                          settings.get("CLIENT_SECRET"))
+    except AuthError as err:
+        sys.exit(str(err))
+    cache_dir = os.path.join(
+        args.cache_dir or jamf_patch_cache_root(settings),
+        server_key(jamf_url))
+    versions, errors = latest_versions(
+        title_fetcher(jamf_url, token), names,
+        PatchTitleIndex(os.path.join(cache_dir, "index.json"),
+                        args.index_ttl),
+        VersionCache(os.path.join(cache_dir, "titles")),
+        lambda: list_patch_titles(jamf_url, token),
+        args.workers, args.max_age)
+    for name, error in sorted(errors.items()):
+        print("%s: %s" % (name, error), file=sys.stderr)
+    if args.output:
+        write_versions(versions, args.output, args.format)
+        print("Wrote %d versions to %s" % (len(versions), args.output))
+    elif args.format == "plist":
+        sys.stdout.write(plistlib.dumps(versions, sort_keys=True).decode())
+    else:
+        print(json.dumps(versions, indent=2, sort_keys=True))
+    return 1 if errors else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python3 -m JamfPatchLib")
+    parser.add_argument("--cache-dir", default=None,
+                        help="defaults to JamfPatch in AutoPkg's CACHE_DIR")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    versions = commands.add_parser("versions", help="latest versions of "
+                                   "patch software titles, by name")
+    versions.add_argument("titles", nargs="*")
+    versions.add_argument("--names", help="file with more names: one per "
+                          "line, or a JSON or plist list")
+    versions.add_argument("-o", "--output", help="write the name -> version "
+                          "map here (.plist for a plist)")
+    versions.add_argument("--format", choices=("json", "plist"), default=None)
+    versions.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                          help="concurrent title requests")
+    versions.add_argument("--index-ttl", type=int, default=INDEX_TTL,
+                          help="seconds the stored title index is used "
+                          "(default %(default)s)")
+    versions.add_argument("--max-age", type=int, default=0,
+                          help="seconds a stored version is used without "
+                          "asking Jamf Pro (default %(default)s)")
+    versions.set_defaults(func=versions_command)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
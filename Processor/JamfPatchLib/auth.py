@@ -0,0 +1,60 @@
+"""
+Jamf Pro API tokens for the command line tools, which run without
+JamfUploaderBase: OAuth client credentials (CLIENT_ID/CLIENT_SECRET) or
+basic auth (API_USERNAME/API_PASSWORD), like the processors.
+"""
+
+import base64
+import json
+import urllib.error
+import urllib.parse
+import urllib.request
+
+TIMEOUT = 60
+
+
+class AuthError(Exception):
+    """Raised when no token could be obtained"""
+
+
+def _post(request, timeout):
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as err:
+        raise AuthError("HTTP %d getting a token from %s"
+                        % (err.code, request.full_url)) from err
+    except (urllib.error.URLError, OSError, ValueError) as err:
+        raise AuthError("Could not get a token from %s: %s"
+                        % (request.full_url, err)) from err
+
+
+def get_token(jamf_url, user=None, password=None, client_id=None,
+              client_secret=None, timeout=TIMEOUT):
+    """Returns a bearer token, preferring the client credentials"""
+    jamf_url = jamf_url.rstrip("/")
+    if client_id and client_secret:
+        data = urllib.parse.urlencode({
+            "grant_type": "client_credentials",
+            "client_id": client_id,
+            "client_secret": client_secret,
+        }).encode()
+        request = urllib.request.Request(
+            jamf_url + "/api/oauth/token", data=data, method="POST",
+            headers={"Content-Type": "application/x-www-form-urlencoded",
+                     "Accept": "application/json"})
+        key = "access_token"
+    elif user and password:
+        credentials = base64.b64encode(
+            ("%s:%s" % (user, password)).encode()).decode()
+        request = urllib.request.Request(
+            jamf_url + "/api/v1/auth/token", data=b"", method="POST",
+            headers={"Authorization": "Basic %s" % credentials,
+                     "Accept": "application/json"})
+        key = "token"
+    else:
+        raise AuthError("Credentials not supplied")
+    token = _post(request, timeout).get(key)
+    if not token:
+        raise AuthError("No token in the answer of %s" % request.full_url)
+    return token
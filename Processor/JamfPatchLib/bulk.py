@@ -0,0 +1,72 @@
+"""
+Latest versions of many patch software titles in one run.
+
+The names are resolved through the title index with at most one listing,
+then the titles are read concurrently, each revalidated against the
+version cache. Titles whose id the server no longer knows are looked up
+again after one refresh of the index. The result is a name -> version map
+that can be written as JSON or plist for the recipes that follow.
+"""
+
+import json
+import os
+import plistlib
+from concurrent.futures import ThreadPoolExecutor
+
+from JamfPatchLib.title_cache import TitleFetchError, latest_version
+
+DEFAULT_WORKERS = 8
+
+
+def latest_versions(fetch, names, index, cache, list_titles,
+                    workers=DEFAULT_WORKERS, max_age=0):
+    """
+    Returns ({name: version}, {name: error message}). fetch is the fetch
+    function of title_cache.latest_version(), list_titles() is called for
+    {name: id} of all titles when the index needs a refresh.
+    """
+    names = list(dict.fromkeys(names))
+    versions = {}
+    errors = {}
+    ids = index.resolve_all(names, list_titles)
+    for attempt in range(2):
+        pending = []
+        for name in names:
+            if name in versions or name in errors:
+                continue
+            if ids.get(name) is None:
+                errors[name] = "No patch software title with this name"
+            else:
+                pending.append(name)
+        with ThreadPoolExecutor(max(1, workers)) as pool:
+            futures = {name: pool.submit(latest_version, fetch, ids[name],
+                                         cache, max_age)
+                       for name in pending}
+        stale = []
+        for name, future in futures.items():
+            try:
+                versions[name] = future.result()[0]
+            except TitleFetchError as err:
+                if err.status == 404 and attempt == 0:
+                    stale.append(name)
+                else:
+                    errors[name] = str(err)
+        if not stale:
+            break
+        ids = index.resolve_all(stale, list_titles, refresh=True)
+    return versions, errors
+
+
+def write_versions(versions, path, fmt=None):
+    """Writes the versions as JSON, or as plist if fmt or the extension of
+    path says so"""
+    if fmt is None:
+        fmt = "plist" if path.endswith(".plist") else "json"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "wb") as fp:
+        if fmt == "plist":
+            plistlib.dump(versions, fp, sort_keys=True)
+        else:
+            fp.write(json.dumps(versions, indent=2, sort_keys=True).encode())
+    os.replace(tmp_path, path)
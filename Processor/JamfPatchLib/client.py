@@ -0,0 +1,62 @@
+"""
+Patch software title requests of the command line tools and SleepIf, which
+run without JamfUploaderBase. The processors that have it send these
+requests through its curl().
+"""
+
+import json
+import urllib.error
+import urllib.request
+
+from JamfPatchLib.title_cache import (TitleFetchError, TitleResponse,
+                                      title_url)
+
+TIMEOUT = 60
+# What JamfUploaderBase.api_endpoints("patch_software_title") returns
+PATCH_SOFTWARE_TITLE_ENDPOINT = "JSSResource/patchsoftwaretitles"
+
+
+def endpoint_url(jamf_url):
+    return "%s/%s" % (jamf_url.rstrip("/"), PATCH_SOFTWARE_TITLE_ENDPOINT)
+
+
+def title_fetcher(jamf_url, token, timeout=TIMEOUT):
+    """Returns the fetch function of title_cache for jamf_url. The body is
+    returned as the open response, so the title is parsed while it is
+    downloaded."""
+
+    def fetch(title_id, headers):
+        request = urllib.request.Request(
+            title_url(endpoint_url(jamf_url), title_id),
+            headers=dict(headers, Authorization="Bearer %s" % token,
+                         Accept="application/xml"))
+        try:
+            response = urllib.request.urlopen(request, timeout=timeout)
+        except urllib.error.HTTPError as err:
+            err.close()
+            return TitleResponse(err.code, dict(err.headers), b"")
+        except (urllib.error.URLError, OSError) as err:
+            raise TitleFetchError("Could not fetch patch software title %s: "
+                                  "%s" % (title_id, err)) from err
+        return TitleResponse(response.status, dict(response.headers),
+                             response)
+
+    return fetch
+
+
+def list_patch_titles(jamf_url, token, timeout=TIMEOUT):
+    """Returns {name: id} of all patch software titles"""
+    request = urllib.request.Request(
+        endpoint_url(jamf_url),
+        headers={"Authorization": "Bearer %s" % token,
+                 "Accept": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            titles = json.load(response)["patch_software_titles"]
+    except urllib.error.HTTPError as err:
+        raise TitleFetchError("HTTP %d listing patch software titles"
+                              % err.code, err.code) from err
+    except (urllib.error.URLError, OSError, ValueError, KeyError) as err:
+        raise TitleFetchError("Could not list patch software titles: %s"
+                              % err) from err
+    return {title["name"]: title["id"] for title in titles}
@@ -0,0 +1,127 @@
+"""
+Incremental decoding of a JSON array read in chunks.
+
+/api/v1/notifications has neither paging nor a filter by type and returns
+all notifications in one array. iter_json_array() yields its elements as
+their bytes arrive, so a caller looking for a few entries can stop reading
+once it has them, and only about one chunk of elements is held in memory.
+
+The complete elements of a chunk are decoded together by one json.loads()
+call, up to the last comma that is followed by the same bracket the first
+of them starts with. Cut at a comma inside a string or a nested value the
+slice can't be valid JSON, so that only fails and the elements are then
+decoded one by one.
+"""
+
+import codecs
+import json
+
+# The consumed part of the buffer is dropped once it is this long
+COMPACT_AT = 64 * 1024
+WHITESPACE = " \t\n\r"
+
+
+class JSONStreamError(ValueError):
+    """Raised when the stream is not a JSON array"""
+
+
+def _last_separator(buffer, start, opener):
+    """Returns the index of the last comma after start that is followed by
+    opener, or by anything for other elements than objects and arrays, or
+    -1"""
+    if opener not in "{[":
+        return buffer.rfind(",", start)
+    end = len(buffer)
+    while True:
+        index = buffer.rfind(opener, start, end)
+        if index <= start:
+            return -1
+        before = index - 1
+        while buffer[before] in WHITESPACE:
+            before -= 1
+        if buffer[before] == ",":
+            return before
+        end = index
+
+
+def iter_json_array(chunks):
+    """Yields the elements of the JSON array whose bytes chunks yields"""
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    pos = 0
+    done = False
+    # Whether decoding several elements at once is worth a try; cleared
+    # when it failed, until more data arrived
+    bulk = True
+    # "[" expected, then a value or "]", then "," or "]", then a value
+    state = "start"
+
+    def more():
+        nonlocal buffer, pos, done, bulk
+        if pos >= COMPACT_AT:
+            buffer, pos = buffer[pos:], 0
+        for chunk in chunks:
+            if chunk:
+                buffer += text.decode(chunk)
+                bulk = True
+                return True
+        if not done:
+            buffer += text.decode(b"", final=True)
+            done = True
+        return False
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in WHITESPACE:
+            pos += 1
+        if pos == len(buffer):
+            if not more():
+                raise JSONStreamError("JSON array ends early")
+            continue
+        char = buffer[pos]
+        if state == "start":
+            if char != "[":
+                raise JSONStreamError("Expected a JSON array")
+            pos += 1
+            state = "first"
+            continue
+        if char == "]" and state in ("first", "next"):
+            return
+        if state == "next":
+            if char != ",":
+                raise JSONStreamError("Expected ',' at %r"
+                                      % buffer[pos:pos + 20])
+            pos += 1
+            state = "value"
+            continue
+        if bulk:
+            cut = _last_separator(buffer, pos, char)
+            elements = None
+            if cut > pos:
+                try:
+                    elements = json.loads("[" + buffer[pos:cut] + "]")
+                except ValueError:
+                    pass
+            if not elements:
+                bulk = False
+                continue
+            pos = cut
+            state = "next"
+            yield from elements
+            continue
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if more():
+                continue
+            raise JSONStreamError("Broken JSON element at %r"
+                                  % buffer[pos:pos + 20])
+        if not done and (end == len(buffer) or
+                         buffer[end] not in WHITESPACE + ",]"):
+            # a number may go on in the next chunk
+            more()
+            continue
+        pos = end
+        state = "next"
+        yield element
@@ -0,0 +1,247 @@
+"""
+Local caches of a Jamf Pro server's patch software titles.
+
+The title index maps the names of the patch software titles to their ids.
+It is filled from one listing call and trusted for ttl seconds; a name
+that is not in it triggers a refresh. The index is refreshed under an
+exclusive lock, so recipes running at the same time wait for one listing
+instead of each making their own.
+
+Of each title only the latest version is kept, with the ETag and
+Last-Modified of the response it came from. The next lookup revalidates it
+with a conditional GET, and a 304 answer costs no download or parse. A
+title is parsed while it is read and dropped as soon as the first version
+is complete; the versions are listed newest first, so the years of history
+after it are never parsed, and not even downloaded when the body comes
+from a stream.
+
+Nothing here speaks HTTP. The requests are made by a fetch function of the
+caller: JamfPatchTitleVersioner sends them through JamfUploaderBase, the
+command line tools through JamfPatchLib.client.
+"""
+
+import fcntl
+import hashlib
+import io
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from contextlib import closing, contextmanager
+
+INDEX_TTL = 60 * 60
+READ_CHUNK = 16 * 1024
+# Path of the latest version below the patch_software_title element
+LATEST_VERSION_PATH = ["versions", "version", "software_version"]
+
+
+# What a fetch function returns: the HTTP status, the response headers as
+# a {name: value} dict and the body, as bytes or a file object
+TitleResponse = namedtuple("TitleResponse", ["status", "headers", "body"])
+
+
+class TitleFetchError(Exception):
+    """Raised when a patch software title can not be read"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def server_key(jamf_url):
+    return hashlib.sha256(jamf_url.rstrip("/").encode()).hexdigest()[:16]
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "w") as fp:
+        json.dump(data, fp)
+    os.replace(tmp_path, path)
+
+
+class PatchTitleIndex:
+    """Locked JSON file of one server's title names and ids"""
+
+    def __init__(self, path, ttl=INDEX_TTL):
+        self.path = path
+        self.ttl = ttl
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _load(self):
+        try:
+            with open(self.path) as fp:
+                data = json.load(fp)
+            return float(data["fetched"]), dict(data["titles"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return 0.0, {}
+
+    def resolve(self, name, list_titles):
+        """
+        Returns the id of the title called name, or None. list_titles() is
+        called for a {name: id} dict of all titles when the index is stale
+        or doesn't know the name.
+        """
+        return self.resolve_all([name], list_titles)[name]
+
+    def resolve_all(self, names, list_titles, refresh=False):
+        """resolve() for many names at once, listing the titles at most
+        once. Returns {name: id or None}."""
+        asked = time.time()
+        with self._locked():
+            fetched, titles = self._load()
+            known = time.time() - fetched < self.ttl and not refresh and \
+                all(name in titles for name in names)
+            # listed by another run while this one waited for the lock
+            if not known and fetched < asked:
+                titles = {str(key): str(value)
+                          for key, value in list_titles().items()}
+                _write_json(self.path, {"fetched": time.time(),
+                                        "titles": titles})
+            return {name: titles.get(name) for name in names}
+
+    def forget(self, name):
+        """Drops a name whose id the server no longer knows; the next
+        resolve() lists the titles again"""
+        with self._locked():
+            _, titles = self._load()
+            titles.pop(name, None)
+            _write_json(self.path, {"fetched": 0, "titles": titles})
+
+
+class VersionCache:
+    """One small JSON file per title id with its latest version, the
+    validators of the response and when it was checked"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, title_id):
+        return os.path.join(self.directory, "%s.json" % title_id)
+
+    def get(self, title_id):
+        try:
+            with open(self._path(title_id)) as fp:
+                entry = json.load(fp)
+            return entry if entry.get("version") else None
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def put(self, title_id, entry):
+        _write_json(self._path(title_id), entry)
+
+
+def title_url(endpoint_url, title_id):
+    """URL of a title below the URL of the patch_software_title endpoint"""
+    return "%s/id/%s" % (endpoint_url.rstrip("/"), title_id)
+
+
+def conditional_headers(cached):
+    """The request headers that revalidate a cached entry"""
+    headers = {}
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+    return headers
+
+
+def read_latest_version(fp, chunk_size=READ_CHUNK):
+    """
+    Returns the software_version of the first version in a patch software
+    title document read from fp, and stops reading there. None if the
+    title lists no versions.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    path = []
+    try:
+        while True:
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                parser.close()
+                return None
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if event == "start":
+                    path.append(element.tag)
+                    continue
+                if path[1:] == LATEST_VERSION_PATH:
+                    return (element.text or "").strip() or None
+                path.pop()
+                # only the elements on the path are kept
+                element.clear()
+    except ET.ParseError as err:
+        raise TitleFetchError("Could not parse patch software title: %s"
+                              % err) from err
+
+
+def parse_latest_version(data):
+    """read_latest_version() of a document in memory"""
+    return read_latest_version(io.BytesIO(data))
+
+
+def fetch_latest_version(fetch, title_id, cached=None):
+    """
+    Reads the latest version of a title. fetch(title_id, headers) sends
+    the GET with the extra headers and returns a TitleResponse. With a
+    cached entry the request is conditional, and a 304 answer returns the
+    cached entry. Returns (entry, changed); entry holds version, etag,
+    last_modified and checked.
+    """
+    response = fetch(title_id, conditional_headers(cached))
+    body = response.body
+    if not hasattr(body, "read"):
+        body = io.BytesIO(body.encode() if isinstance(body, str)
+                          else body or b"")
+    # closing drops the connection of a stream with the rest unread
+    with closing(body):
+        if response.status == 304 and cached:
+            return dict(cached, checked=time.time()), False
+        if response.status != 200:
+            raise TitleFetchError("HTTP %s fetching patch software title %s"
+                                  % (response.status, title_id),
+                                  response.status)
+        try:
+            version = read_latest_version(body)
+        except OSError as err:
+            raise TitleFetchError("Could not fetch patch software title %s: "
+                                  "%s" % (title_id, err)) from err
+    headers = {name.lower(): value
+               for name, value in (response.headers or {}).items()}
+    entry = {
+        "version": version,
+        "etag": headers.get("etag"),
+        "last_modified": headers.get("last-modified"),
+        "checked": time.time(),
+    }
+    return entry, entry["version"] != (cached or {}).get("version")
+
+
+def latest_version(fetch, title_id, cache, max_age=0):
+    """
+    Returns (version, source) of a title, source being "stored" when the
+    cached version was younger than max_age seconds, "unchanged" when Jamf
+    Pro answered 304 and "fetched" otherwise. Raises TitleFetchError, with
+    status 404 for an id the server doesn't know.
+    """
+    cached = cache.get(title_id)
+    if cached and time.time() - cached.get("checked", 0) < max_age:
+        return cached["version"], "stored"
+    entry, changed = fetch_latest_version(fetch, title_id, cached)
+    if not entry["version"]:
+        raise TitleFetchError("Patch software title %s lists no versions"
+                              % title_id)
+    cache.put(title_id, entry)
+    return entry["version"], "unchanged" if cached and not changed \
+        else "fetched"
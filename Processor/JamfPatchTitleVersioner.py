@@ -6,11 +6,10 @@ JamfPatchTitleVersioner processor for finding the latest software version number
     and modified for modern Jamf Pro auth by Drew Barnes
 """
 
+import json
 import os.path
 import sys
 
-import xml.etree.ElementTree as ET
-
 from time import sleep
 from autopkglib import ProcessorError  # pylint: disable=import-error
 
@@ -20,8 +19,38 @@ from autopkglib import ProcessorError  # pylint: disable=import-error
 sys.path.insert(0, os.path.dirname(__file__))
 
 from JamfUploaderLib.JamfUploaderBase import JamfUploaderBase  # noqa: E402
+from JamfPatchLib.bulk import (  # noqa: E402
+    DEFAULT_WORKERS,
+    latest_versions,
+    write_versions,
+)
+from SharedLib.paths import jamf_patch_cache_root  # noqa: E402
+from JamfPatchLib.title_cache import (  # noqa: E402
+    INDEX_TTL,
+    PatchTitleIndex,
+    TitleFetchError,
+    TitleResponse,
+    VersionCache,
+    latest_version,
+    server_key,
+    title_url,
+)
+
+__all__ = ["JamfPatchTitleVersioner"]
 
-__all__ = ["JamfPatchUploader"]
+
+def response_headers(r):
+    """The headers of a curl() response as a dict. JamfUploaderBase keeps
+    the lines curl dumped, of every response when it followed redirects."""
+    headers = getattr(r, "headers", None) or []
+    if isinstance(headers, dict):
+        return dict(headers)
+    fields = {}
+    for line in headers:
+        name, colon, value = line.partition(":")
+        if colon:
+            fields[name.strip()] = value.strip()
+    return fields
 
 
 class JamfPatchTitleVersioner(JamfUploaderBase):
@@ -57,53 +86,188 @@ class JamfPatchTitleVersioner(JamfUploaderBase):
             "the com.github.autopkg preference file.",
         },
         "patch_softwaretitle": {
-            "required": True,
+            "required": False,
             "description": (
                 "Name of the patch software title (e.g. 'Mozilla Firefox') used in Jamf. "
+                "Required unless patch_softwaretitles is set."
             ),
             "default": "",
         },
+        "patch_softwaretitles": {
+            "required": False,
+            "description": (
+                "List of patch software title names to look up in one run instead "
+                "of patch_softwaretitle. The titles are fetched concurrently and "
+                "their latest versions returned in latest_patch_versions."
+            ),
+        },
+        "patch_title_workers": {
+            "required": False,
+            "description": "Concurrent requests with patch_softwaretitles.",
+            "default": str(DEFAULT_WORKERS),
+        },
+        "patch_versions_file": {
+            "required": False,
+            "description": (
+                "With patch_softwaretitles, also write the name -> version map to "
+                "this file, as plist if it ends in .plist and as JSON otherwise."
+            ),
+        },
+        "patch_title_index_ttl": {
+            "required": False,
+            "description": (
+                "Seconds the locally stored index of patch title names and ids "
+                "is trusted before the titles are listed again. A name missing "
+                "from the index lists them at once. 0 looks the name up on "
+                "every run."
+            ),
+            "default": str(INDEX_TTL),
+        },
+        "patch_title_cache_ttl": {
+            "required": False,
+            "description": (
+                "Seconds the locally stored latest version of the title is used "
+                "without asking Jamf Pro. With 0 it is revalidated with a "
+                "conditional request on every run."
+            ),
+            "default": "0",
+        },
     }
 
     output_variables = {
         "latest_patch_version": {
             "description": "The latest version number of the software reported by the Patch Title."
         },
+        "latest_patch_versions": {
+            "description": "Dictionary of patch software title name -> latest version "
+            "with patch_softwaretitles."
+        },
     }
 
+    def cache_dir(self):
+        """Returns the folder of the caches of this Jamf Pro server"""
+        return os.path.join(
+            jamf_patch_cache_root(self.env), server_key(self.jamf_url)
+        )
+
+    def list_patch_titles(self, token):
+        """Returns {name: id} of all patch software titles"""
+        url = "{}/{}".format(
+            self.jamf_url, self.api_endpoints("patch_software_title")
+        )
+        r = self.curl(request="GET", url=url, token=token, accept_header="json")
+        if r.status_code != 200:
+            raise ProcessorError("ERROR: Could not list patch software titles.")
+
+        # depending on its version JamfUploaderBase returns the JSON parsed
+        output = r.output
+        if isinstance(output, (bytes, str)):
+            try:
+                output = json.loads(output)
+            except ValueError as json_error:
+                raise ProcessorError(
+                    "ERROR: Could not parse patch software titles."
+                ) from json_error
+        return {
+            title["name"]: title["id"]
+            for title in output.get("patch_software_titles", [])
+        }
+
+    def patch_title_fetcher(self, jamf_url, token):
+        """Returns the fetch function of title_cache, which GETs a patch
+        software title through curl() with the extra headers of a
+        conditional request"""
+        endpoint_url = "{}/{}".format(
+            jamf_url, self.api_endpoints("patch_software_title")
+        )
+
+        def fetch(title_id, headers):
+            r = self.curl(
+                request="GET",
+                url=title_url(endpoint_url, title_id),
+                token=token,
+                accept_header="xml",
+                additional_curl_opts=[
+                    opt
+                    for name, value in headers.items()
+                    for opt in ("--header", f"{name}: {value}")
+                ],
+            )
+            return TitleResponse(r.status_code, response_headers(r), r.output)
+
+        return fetch
+
+    def patch_title_id(self, name, token):
+        """Returns the ID of the Patch Title called name from the local index"""
+        ttl = int(self.env.get("patch_title_index_ttl", INDEX_TTL))
+        if ttl <= 0:
+            return self.get_api_obj_id_from_name(
+                self.jamf_url, name, "patch_software_title", token=token,
+            )
+        index = PatchTitleIndex(os.path.join(self.cache_dir(), "index.json"), ttl)
+        return index.resolve(name, lambda: self.list_patch_titles(token))
+
+    def bulk_latest_versions(self, names, token):
+        """Sets latest_patch_versions for all names, fetched concurrently"""
+        self.output(f"Looking up the latest versions of {len(names)} patch software titles")
+        versions, errors = latest_versions(
+            self.patch_title_fetcher(self.jamf_url, token),
+            names,
+            PatchTitleIndex(
+                os.path.join(self.cache_dir(), "index.json"),
+                int(self.env.get("patch_title_index_ttl", INDEX_TTL)),
+            ),
+            VersionCache(os.path.join(self.cache_dir(), "titles")),
+            lambda: self.list_patch_titles(token),
+            int(self.env.get("patch_title_workers", DEFAULT_WORKERS)),
+            int(self.env.get("patch_title_cache_ttl", 0)),
+        )
+        for name, version in sorted(versions.items()):
+            self.output(f"{name}: {version}", 2)
+        self.env["latest_patch_versions"] = versions
+        if self.env.get("patch_versions_file"):
+            write_versions(versions, self.env["patch_versions_file"])
+            self.output(f"Wrote the versions to {self.env['patch_versions_file']}")
+        if errors:
+            raise ProcessorError(
+                "ERROR: Couldn't fetch patch software titles: "
+                + "; ".join(f"'{name}': {error}" for name, error in sorted(errors.items()))
+            )
+
+    def forget_patch_title(self, name):
+        """Drops a name from the index whose ID the server doesn't know"""
+        index = PatchTitleIndex(os.path.join(self.cache_dir(), "index.json"))
+        index.forget(name)
+
     def latest_patch_version(
         self,
         jamf_url,
         patch_softwaretitle_id,
         token="",
     ) -> str:
-        """Returns the newest software version number for the Patch Title ID passed"""
+        """Returns the newest software version number for the Patch Title ID
+        passed, None if there is no Patch Title with that ID"""
+        cache = VersionCache(os.path.join(self.cache_dir(), "titles"))
+        max_age = int(self.env.get("patch_title_cache_ttl", 0))
         self.output("Looking up latest version from patch software title (by ID)...")
-
-        # Get current software title
-        object_type = "patch_software_title"
-        url = "{}/{}/id/{}".format(
-            jamf_url, self.api_endpoints(object_type), patch_softwaretitle_id
-        )
-
-        # "GET" patch title feed.
-        r = self.curl(
-            request="GET", url=url, token=token, accept_header="xml"
-        )
-
-        if r.status_code != 200:
-            raise ProcessorError("ERROR: Could not fetch patch software title.")
-
-        # Parse response as xml
         try:
-            patch_softwaretitle_xml = ET.fromstring(r.output)
-        except ET.ParseError as xml_error:
-            raise ProcessorError from xml_error
-
-        # Get first match of all the versions listed in the
-        # software title to report the 'latest version'.
-        latest_version = patch_softwaretitle_xml.find("versions/version/software_version").text
-        return latest_version
+            version, source = latest_version(
+                self.patch_title_fetcher(jamf_url, token),
+                patch_softwaretitle_id,
+                cache,
+                max_age,
+            )
+        except TitleFetchError as fetch_error:
+            if fetch_error.status == 404:
+                return None
+            raise ProcessorError(
+                f"ERROR: Could not fetch patch software title: {fetch_error}"
+            ) from fetch_error
+        if source == "stored":
+            self.output("Using stored latest version of the patch software title", 2)
+        elif source == "unchanged":
+            self.output("Patch software title unchanged since the last run", 2)
+        return version
 
     def main(self):
         """Do the main thing here"""
@@ -113,10 +277,18 @@ class JamfPatchTitleVersioner(JamfUploaderBase):
         self.client_id = self.env.get("CLIENT_ID")
         self.client_secret = self.env.get("CLIENT_SECRET")
         self.patch_softwaretitle = self.env.get("patch_softwaretitle")
+        patch_softwaretitles = self.env.get("patch_softwaretitles")
+        if isinstance(patch_softwaretitles, str):
+            patch_softwaretitles = [patch_softwaretitles]
 
-        self.output(
-            f"Checking for existing '{self.patch_softwaretitle}' on {self.jamf_url}"
-        )
+        if not patch_softwaretitles and not self.patch_softwaretitle:
+            raise ProcessorError(
+                "ERROR: patch_softwaretitle or patch_softwaretitles is required"
+            )
+        if not patch_softwaretitles:
+            self.output(
+                f"Checking for existing '{self.patch_softwaretitle}' on {self.jamf_url}"
+            )
 
         # get token using oauth or basic auth depending on the credentials given
         if self.jamf_url and self.client_id and self.client_secret:
@@ -128,29 +300,39 @@ class JamfPatchTitleVersioner(JamfUploaderBase):
         else:
             raise ProcessorError("ERROR: Credentials not supplied")
 
-        # Find the ID for the Patch Title
-        obj_type = "patch_software_title"
-        obj_name = self.patch_softwaretitle
-        self.patch_softwaretitle_id = self.get_api_obj_id_from_name(
-            self.jamf_url, obj_name, obj_type, token=token,
-        )
+        if patch_softwaretitles:
+            self.bulk_latest_versions(patch_softwaretitles, token)
+            return
 
-        if not self.patch_softwaretitle_id:
+        # Find the ID for the Patch Title and fetch the latest version it
+        # reports. An ID the server doesn't know any more came from a stale
+        # index, look the name up once more.
+        for attempt in range(2):
+            self.patch_softwaretitle_id = self.patch_title_id(
+                self.patch_softwaretitle, token
+            )
+            if not self.patch_softwaretitle_id:
+                raise ProcessorError(
+                    f"ERROR: Couldn't find patch software title with name '{self.patch_softwaretitle}'.",
+                )
+            self.patch_version = self.latest_patch_version(
+                self.jamf_url,
+                self.patch_softwaretitle_id,
+                token,
+            )
+            if self.patch_version is not None:
+                break
+            self.forget_patch_title(self.patch_softwaretitle)
+        else:
             raise ProcessorError(
-                f"ERROR: Couldn't find patch software title with name '{self.patch_softwaretitle}'.",
+                f"ERROR: Couldn't fetch patch software title with name '{self.patch_softwaretitle}'.",
             )
         self.env["patch_softwaretitle_id"] = self.patch_softwaretitle_id
 
-        # fetch the latest version reported by the Patch Title
-        self.patch_version = self.latest_patch_version(
-            self.jamf_url,
-            self.patch_softwaretitle_id,
-            token,
-        )
-
         # Set Output Variable
         self.env["latest_patch_version"] = self.patch_version
 
+
 if __name__ == "__main__":
-    PROCESSOR = JamfPatchUploader()
+    PROCESSOR = JamfPatchTitleVersioner()
     PROCESSOR.execute_shell()
@@ -1,47 +1,183 @@
 #!/usr/local/autopkg/python
 #
 # This requires https://github.com/ninxsoft/mist-cli and
-# sudo access to the mist binary in order to create macOS 
+# sudo access to the mist binary in order to create macOS
 # installers
 # e.g. user ALL = NOPASSWD: /usr/local/bin/mist
-# 
+#
 # Make sure the risk associated with that is well understood
 # and worth it in your environment
-# 
+#
 # Processor to download the latest macOS installer
 # in a given format
 
-import plistlib
-import subprocess
+import hashlib
+import json
 import os
-import json 
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 from autopkglib import Processor, ProcessorError
 
 
 __all__ = ["MistDownloader"]
 
+DEFAULT_MIST = "/usr/local/bin/mist"
+CATALOG_TTL = 3600
+HASH_CHUNK = 8 * 1024 * 1024
+# mist's default output file names
+EXTENSIONS = {"package": ".pkg", "image": ".dmg", "iso": ".iso",
+              "application": ".app"}
+DOWNLOAD_WORKERS = 2
+# Space needed while building each format, in multiples of the size mist
+# lists: the downloaded packages plus the result (an ISO is built from an
+# image)
+SPACE_FACTORS = {"package": 2, "application": 2, "image": 2, "iso": 3}
+GB = 1024 ** 3
+
+
+def file_digest(path):
+    """Returns the SHA-256 of a file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def installer_size(path):
+    """Returns the size of an installer file, or of all files in an App"""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    size = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            size += os.lstat(os.path.join(root, name)).st_size
+    return size
+
+
+def write_json(path, data):
+    """Replaces path atomically, so concurrent runs never read half a file"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as fp:
+            json.dump(data, fp, indent=2)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def read_json(path):
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+class DiskSpace:
+    """Hands out the free space of a volume to concurrent downloads"""
+
+    def __init__(self, path):
+        self.path = path
+        self.reserved = 0
+        self.running = 0
+        self.condition = threading.Condition()
+
+    def available(self):
+        # space already written by running jobs is still counted as
+        # reserved, which errs on the safe side
+        return shutil.disk_usage(self.path).free - self.reserved
+
+    @contextmanager
+    def reserve(self, size, name, output=None):
+        """Waits until size bytes are free, and keeps them for the job"""
+        waiting = False
+        with self.condition:
+            while size > self.available():
+                if not self.running:
+                    raise ProcessorError(
+                        "%s needs about %.1fGB but only %.1fGB are free on "
+                        "%s" % (name, size / GB, self.available() / GB,
+                                self.path))
+                if output and not waiting:
+                    output("Waiting for %.1fGB free for %s" % (size / GB,
+                                                               name))
+                waiting = True
+                self.condition.wait()
+            self.reserved += size
+            self.running += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.reserved -= size
+                self.running -= 1
+                self.condition.notify_all()
+
 
 class MistDownloader(Processor):
     description = ( "Downloads a macOS installer.",
     				"Need to specify OS and format" )
     input_variables = {
         "format": {
-            "required": True,
+            "required": False,
             "description": "Installer format to be downloaded. Options: iso, image, package, application"
         },
         "type": {
-            "required": True,
+            "required": False,
             "description": "Action to perform: download"
         },
         "macOS": {
-            "required": True,
+            "required": False,
             "description": "Name of the macOS version to install. "
         },
+        "targets": {
+            "required": False,
+            "description": "List of installers to download in one run "
+            "instead of macOS and format, as dictionaries with macOS, format "
+            "and optionally type and compat_only (defaulting to the inputs of "
+            "the same name), or as [macOS, format, type] lists"
+        },
+        "download_workers": {
+            "required": False,
+            "default": DOWNLOAD_WORKERS,
+            "description": "Number of targets downloaded at the same time. "
+            "A download only starts once RECIPE_CACHE_DIR's volume has room "
+            "for it"
+        },
         "compat_only": {
             "required": False,
             "description": "Flag to only download compatible versions"
-        }
+        },
+        "mist_path": {
+            "required": False,
+            "description": "Path to the mist binary. Defaults to "
+            "/usr/local/bin/mist, the path the sudoers rule allows. The mist "
+            "found in PATH is only used if neither exists"
+        },
+        "mist_catalog_ttl": {
+            "required": False,
+            "default": CATALOG_TTL,
+            "description": "Seconds the latest version listed by mist is "
+            "reused for the same type, macOS and compat_only. 0 always asks "
+            "mist"
+        },
+        "verify_hash": {
+            "required": False,
+            "default": False,
+            "description": "Record the SHA-256 of a downloaded installer, "
+            "and compare it instead of size and mtime before skipping the "
+            "download of an installer already in RECIPE_CACHE_DIR"
+        },
     }
     output_variables = {
         "installer_path": {
@@ -49,54 +185,249 @@ class MistDownloader(Processor):
         },
         "version": {
              "description": "macOS version"
-        }
+        },
+        "download_changed": {
+            "description": "False if the latest installer was already in "
+            "RECIPE_CACHE_DIR and nothing was downloaded. With targets, "
+            "whether any of them was downloaded"
+        },
+        "installers": {
+            "description": "List of dictionaries with macOS, format, type, "
+            "installer_path, version, build and download_changed of each "
+            "target. installer_path and version are those of the first"
+        },
    }
 
     __doc__ = description
 
-    def main(self):
+    def mist(self):
+        """Returns the mist command, run through sudo unless we are root"""
+        if getattr(self, "mist_path", None) is None:
+            candidates = [self.env.get("mist_path"), DEFAULT_MIST]
+            self.mist_path = next(
+                (path for path in candidates if path and os.path.exists(path)),
+                None) or shutil.which("mist")
+            if not self.mist_path:
+                raise ProcessorError("mist is neither at %s nor in PATH" %
+                                     " nor at ".join(filter(None, candidates)))
+            self.output("Using %s" % self.mist_path)
+        if os.geteuid() == 0:
+            return [self.mist_path]
+        return ["sudo", self.mist_path]
+
+    def cache_dir(self):
+        return self.env.get("MIST_CACHE_DIR") or os.path.join(
+            self.env.get("CACHE_DIR") or os.path.expanduser(
+                "~/Library/AutoPkg/Cache"), "Mist")
 
-        output_dir = self.env["RECIPE_CACHE_DIR"]
-        version_cmd = [ "sudo", \
-                    "/usr/local/bin/mist", \
-                    "list", \
-                    self.env[ "type" ], \
-                    "--latest", \
-                    self.env[ "macOS" ],\
-                    "-o", \
-                    "json", \
-                    "-q" ]
-        if self.env.get("compat_only"):
+    def list_latest(self, mist_type, macos, compat_only):
+        """Returns the catalog entry of the latest release mist lists,
+        reusing a listing younger than mist_catalog_ttl"""
+        ttl = int(self.env.get("mist_catalog_ttl", CATALOG_TTL))
+        key = "%s|%s|%s" % (mist_type, macos, bool(compat_only))
+        path = os.path.join(self.cache_dir(), "catalog.json")
+        catalog = read_json(path) or {}
+        entry = catalog.get(key)
+        if ttl > 0 and entry and time.time() - entry["listed"] < ttl:
+            self.output("Using the %s listed %ds ago"
+                        % (macos, time.time() - entry["listed"]), verbose_level=2)
+            return entry["release"]
+
+        version_cmd = self.mist() + ["list", mist_type, "--latest", macos,
+                                     "-o", "json", "-q"]
+        if compat_only:
             version_cmd.append('--compatible')
-            
-        version_data = subprocess.check_output( version_cmd )
-        #print(version_data)
-        data = json.loads(version_data)
-        version = data[0]['version']
-        build = data[0]['build']
-        #print(version)
-    	# rename unsigned package so that we can slot the signed package into place
-        command_line_list = [ "sudo", \
-                              "/usr/local/bin/mist", \
-                              "download", \
-                              self.env[ "type" ], \
-                              self.env[ "macOS" ], \
-                              self.env[ "format" ], \
-                              "--output-directory", \
-                              output_dir, \
-                              "-q" ]
-        if self.env.get("compat_only"):
+        try:
+            version_data = subprocess.check_output(version_cmd)
+            data = json.loads(version_data)
+        except (OSError, subprocess.CalledProcessError, ValueError) as err:
+            raise ProcessorError("mist could not list %s: %s" % (macos, err))
+        if not data:
+            raise ProcessorError("mist lists no %s %s" % (mist_type, macos))
+
+        release = data[0]
+        if ttl > 0:
+            # another run may have listed other releases meanwhile
+            catalog = read_json(path) or {}
+            catalog[key] = {"listed": time.time(), "release": release}
+            write_json(path, catalog)
+        return release
+
+    def installer_path(self, macos, mist_format, release):
+        return os.path.join(
+            self.env["RECIPE_CACHE_DIR"], "Install %s %s-%s%s" % (
+                macos, release["version"], release["build"],
+                EXTENSIONS.get(mist_format, ".pkg")))
+
+    @staticmethod
+    def record_path(installer_path):
+        directory, name = os.path.split(installer_path)
+        return os.path.join(directory, ".%s.mist.json" % name)
+
+    def is_downloaded(self, installer_path):
+        """True if installer_path still is the installer recorded after the
+        last download"""
+        record = read_json(self.record_path(installer_path))
+        if not record or not os.path.exists(installer_path):
+            return False
+        if installer_size(installer_path) != record["size"]:
+            return False
+        if self.env.get("verify_hash") and record.get("sha256"):
+            return file_digest(installer_path) == record["sha256"]
+        return int(os.path.getmtime(installer_path)) == record["mtime"]
+
+    def record_download(self, installer_path, release):
+        record = {"version": release["version"], "build": release["build"],
+                  "size": installer_size(installer_path),
+                  "mtime": int(os.path.getmtime(installer_path))}
+        # hashing a multi-GB installer takes a while, only done when asked
+        if self.env.get("verify_hash") and not os.path.isdir(installer_path):
+            record["sha256"] = file_digest(installer_path)
+        write_json(self.record_path(installer_path), record)
+
+    def download(self, mist_type, macos, mist_format, compat_only,
+                 installer_path, temporary_dir=None):
+        output_dir = os.path.dirname(installer_path)
+        command_line_list = self.mist() + ["download", mist_type, macos,
+                                           mist_format, "--output-directory",
+                                           output_dir, "-q"]
+        if compat_only:
             command_line_list.append('--compatible')
+        if temporary_dir:
+            # concurrent runs of mist would share its default temporary
+            # directory
+            command_line_list += ["--temporary-directory", temporary_dir]
+        result = subprocess.call(command_line_list, stderr=subprocess.DEVNULL)
+        if result != 0 or not os.path.exists(installer_path):
+            raise ProcessorError("mist could not download %s (exit status "
+                                 "%d)" % (installer_path, result))
+        sudo = [] if os.geteuid() == 0 else ["sudo"]
+        subprocess.call(sudo + ["/bin/chmod", "777", installer_path])
+
+    def targets(self):
+        """Returns the targets as dictionaries, None for a single
+        installer"""
+        targets = self.env.get("targets")
+        if not targets:
+            return None
+        result = []
+        seen = set()
+        for target in targets:
+            if not isinstance(target, dict):
+                target = dict(zip(("macOS", "format", "type"), target))
+            target = {"macOS": target.get("macOS"),
+                      "format": target.get("format") or self.env.get("format"),
+                      "type": target.get("type") or self.env.get("type"),
+                      "compat_only": target.get(
+                          "compat_only", self.env.get("compat_only"))}
+            if not all(target[key] for key in ("macOS", "format", "type")):
+                raise ProcessorError("Targets need macOS, format and type: "
+                                     "%r" % (target,))
+            key = (target["macOS"], target["format"], target["type"],
+                   bool(target["compat_only"]))
+            if key not in seen:
+                seen.add(key)
+                result.append(target)
+        return result
+
+    def fetch(self, target, release, space=None):
+        """Downloads target unless it already is, returns its output
+        dictionary"""
+        installer_path = self.installer_path(target["macOS"],
+                                             target["format"], release)
+        changed = not self.is_downloaded(installer_path)
+        if changed and space is None:
+            self.download(target["type"], target["macOS"], target["format"],
+                          target["compat_only"], installer_path)
+            self.record_download(installer_path, release)
+        elif changed:
+            size = int(release.get("size") or 0) * \
+                SPACE_FACTORS.get(target["format"], 2)
+            name = os.path.basename(installer_path)
+            with space.reserve(size, name, self.output):
+                self.output("Downloading %s" % name)
+                temporary_dir = tempfile.mkdtemp(prefix=".mist-",
+                                                 dir=space.path)
+                try:
+                    self.download(target["type"], target["macOS"],
+                                  target["format"], target["compat_only"],
+                                  installer_path, temporary_dir)
+                finally:
+                    shutil.rmtree(temporary_dir, ignore_errors=True)
+            self.record_download(installer_path, release)
+        else:
+            self.output("%s is already downloaded" % installer_path)
+        return {"macOS": target["macOS"], "format": target["format"],
+                "type": target["type"], "installer_path": installer_path,
+                "version": release["version"], "build": release["build"],
+                "download_changed": changed}
 
-        # print command_line_list
-        #subprocess.call( command_line_list, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL )
-        subprocess.call( command_line_list, stderr=subprocess.DEVNULL )
-        installer_path = os.path.join(self.env["RECIPE_CACHE_DIR"], "Install "+ self.env["macOS"] + " " + version + "-" + build + ".pkg")
-        subprocess.call( ["sudo", "/bin/chmod", "777", installer_path] )
+    def fetch_all(self, targets):
+        """Downloads all targets concurrently, looking each release up
+        once. Returns the output dictionaries in the order of targets, and
+        an error message for each target that failed. A release that can't
+        be listed only fails its own targets."""
+        keys = [(target["type"], target["macOS"], bool(target["compat_only"]))
+                for target in targets]
+        releases = {}
+        for key in keys:
+            if key not in releases:
+                try:
+                    releases[key] = self.list_latest(*key)
+                except (ProcessorError, OSError,
+                        subprocess.CalledProcessError) as err:
+                    releases[key] = err
+        target_releases = [releases[key] for key in keys]
+
+        space = DiskSpace(self.env["RECIPE_CACHE_DIR"])
+        workers = max(1, int(self.env.get("download_workers",
+                                          DOWNLOAD_WORKERS)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [None if isinstance(release, Exception) else
+                       pool.submit(self.fetch, target, release, space)
+                       for target, release in zip(targets, target_releases)]
+        installers = []
+        errors = []
+        for target, release, future in zip(targets, target_releases,
+                                           futures):
+            error = release if future is None else None
+            if future is not None:
+                try:
+                    installers.append(future.result())
+                except (ProcessorError, OSError,
+                        subprocess.CalledProcessError) as err:
+                    error = err
+            if error is not None:
+                errors.append("%s %s: %s" % (target["macOS"],
+                                             target["format"], error))
+        return installers, errors
+
+    def main(self):
+        targets = self.targets()
+        if targets is None:
+            for key in ("macOS", "format", "type"):
+                if not self.env.get(key):
+                    raise ProcessorError("%s or targets is required" % key)
+            target = {key: self.env.get(key) for key in
+                      ("macOS", "format", "type", "compat_only")}
+            release = self.list_latest(target["type"], target["macOS"],
+                                       target["compat_only"])
+            installers = [self.fetch(target, release)]
+            errors = []
+        else:
+            installers, errors = self.fetch_all(targets)
 
-        self.env['installer_path'] = installer_path
-        self.env['version'] = version
-        return installer_path, version
+        self.env['installers'] = installers
+        self.env['download_changed'] = any(
+            installer["download_changed"] for installer in installers)
+        if installers:
+            self.env['installer_path'] = installers[0]["installer_path"]
+            self.env['version'] = installers[0]["version"]
+        if errors:
+            raise ProcessorError("Could not download %d of %d installers:\n"
+                                 "%s" % (len(errors), len(targets),
+                                         "\n".join(errors)))
+        return self.env['installer_path'], self.env['version']
 
 
 
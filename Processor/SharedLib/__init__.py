@@ -0,0 +1 @@
+"""Helper modules shared by the Title Editor and Jamf Pro processors"""
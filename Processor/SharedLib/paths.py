@@ -0,0 +1,48 @@
+"""Locations of the files the processors and their tools keep between runs"""
+
+import os
+import plistlib
+
+DEFAULT_CACHE_DIR = "~/Library/AutoPkg/Cache"
+AUTOPKG_PREFERENCES = "~/Library/Preferences/com.github.autopkg.plist"
+
+
+def cache_dir(env, override, folder):
+    """env[override] if it is set, otherwise folder in AutoPkg's
+    CACHE_DIR"""
+    if env.get(override):
+        return os.path.expanduser(env[override])
+    return os.path.join(
+        os.path.expanduser(env.get("CACHE_DIR") or DEFAULT_CACHE_DIR),
+        folder)
+
+
+def title_editor_cache_root(env=None):
+    """
+    Returns the directory for TitleEditorLib's persistent caches.
+    TITLE_EDITOR_CACHE_DIR wins, otherwise a TitleEditor folder in AutoPkg's
+    CACHE_DIR is used.
+    """
+    env = autopkg_settings() if env is None else env
+    return cache_dir(env, "TITLE_EDITOR_CACHE_DIR", "TitleEditor")
+
+
+def jamf_patch_cache_root(env=None):
+    """JAMF_PATCH_CACHE_DIR, or a JamfPatch folder in AutoPkg's CACHE_DIR"""
+    env = autopkg_settings() if env is None else env
+    return cache_dir(env, "JAMF_PATCH_CACHE_DIR", "JamfPatch")
+
+
+def autopkg_settings():
+    """
+    Returns AutoPkg's preferences overridden by the environment, for the
+    command line tools that run outside of a recipe.
+    """
+    settings = {}
+    try:
+        with open(os.path.expanduser(AUTOPKG_PREFERENCES), "rb") as fp:
+            settings.update(plistlib.load(fp))
+    except (OSError, plistlib.InvalidFileException):
+        pass
+    settings.update(os.environ)
+    return settings
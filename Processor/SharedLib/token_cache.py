@@ -0,0 +1,106 @@
+"""
+Bearer tokens shared between processes until shortly before they expire.
+
+Tokens are stored in a JSON file readable by the owner only, keyed by a
+hash of the API URL and user. All access goes through an exclusive lock
+on a sidecar lock file, so parallel recipe runs don't race each other.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Tokens are refreshed this many seconds before they expire
+REFRESH_MARGIN = 300
+
+
+def parse_expiry(expires):
+    """
+    Returns the epoch seconds of an "expires" value, which is either an ISO
+    8601 timestamp or epoch seconds/milliseconds. None if unparseable.
+    """
+    if isinstance(expires, (int, float)):
+        return expires / 1000 if expires > 1e11 else float(expires)
+    try:
+        expires = str(expires).strip()
+        if expires.endswith("Z"):
+            expires = expires[:-1] + "+00:00"
+        # fromisoformat() before 3.11 only knows 0, 3 or 6 fraction digits
+        if "." in expires:
+            head, tail = expires.split(".", 1)
+            digits = len(tail) - len(tail.lstrip("0123456789"))
+            fraction = tail[:digits][:6].ljust(6, "0")
+            expires = "%s.%s%s" % (head, fraction, tail[digits:])
+        return datetime.fromisoformat(expires).timestamp()
+    except ValueError:
+        return None
+
+
+def cache_key(url, user):
+    return hashlib.sha256(("%s\0%s" % (url, user)).encode()).hexdigest()
+
+
+class TokenCache:
+    """Locked, owner-only JSON file of tokens and their expiry"""
+
+    def __init__(self, path, refresh_margin=REFRESH_MARGIN):
+        self.path = path
+        self.refresh_margin = refresh_margin
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _load(self):
+        try:
+            with open(self.path) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, tokens):
+        now = time.time()
+        tokens = {key: entry for key, entry in tokens.items()
+                  if entry.get("expires", 0) > now}
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as fp:
+            json.dump(tokens, fp)
+        os.replace(tmp_path, self.path)
+
+    def get(self, url, user):
+        """Returns a cached token that is not about to expire, or None"""
+        with self._locked():
+            entry = self._load().get(cache_key(url, user))
+        if entry and entry.get("expires", 0) - self.refresh_margin > \
+                time.time():
+            return entry["token"]
+        return None
+
+    def put(self, url, user, token, expires):
+        """Stores a token; tokens without a known expiry are not cached"""
+        expires = parse_expiry(expires)
+        if expires is None:
+            return
+        with self._locked():
+            tokens = self._load()
+            tokens[cache_key(url, user)] = {"token": token,
+                                            "expires": expires}
+            self._save(tokens)
+
+    def invalidate(self, url, user):
+        with self._locked():
+            tokens = self._load()
+            if tokens.pop(cache_key(url, user), None) is not None:
+                self._save(tokens)
@@ -16,16 +16,77 @@
 # limitations under the License.
 """See docstring for SleepIf class"""
 
-from time import sleep
-from autopkglib import Processor, ProcessorError, log
+import os
+import random
+import sys
 
-try:
-    from Foundation import NSPredicate
-except ImportError:
-    log("WARNING: Failed 'from Foundation import NSPredicate' in " + __name__)
+from time import monotonic, sleep
+from autopkglib import Processor, ProcessorError
+
+# to use a base module in AutoPkg we need to add this path to the sys.path.
+# this violates flake8 E402 (PEP8 imports) but is unavoidable, so the following
+# imports require noqa comments for E402
+sys.path.insert(0, os.path.dirname(__file__))
+
+from JamfPatchLib.auth import AuthError, get_token  # noqa: E402
+from JamfPatchLib.client import list_patch_titles, title_fetcher  # noqa: E402
+from SharedLib.paths import jamf_patch_cache_root, title_editor_cache_root  # noqa: E402
+from SharedLib.token_cache import TokenCache  # noqa: E402
+from SleepIfLib.predicate import PredicateError, evaluate  # noqa: E402
+from JamfPatchLib.title_cache import (  # noqa: E402
+    PatchTitleIndex,
+    TitleFetchError,
+    VersionCache,
+    latest_version,
+    server_key,
+)
+from TitleEditorLib.client import TitleEditorClient, TitleEditorError  # noqa: E402
+from TitleEditorLib.versions import version_key  # noqa: E402
 
 __all__ = ["SleepIf"]
 
+WAIT_MODES = ("jamf_patch", "title_editor")
+PREDICATE_ENGINES = ("auto", "python", "nspredicate")
+
+# NSPredicate objects by predicate string
+_ns_predicates = {}
+
+
+def nspredicate(predicate_string):
+    """Returns the NSPredicate of a predicate string, made once. Foundation
+    is imported on the first call, it is slow to load."""
+    if predicate_string not in _ns_predicates:
+        try:
+            from Foundation import NSPredicate
+        except ImportError:
+            raise ProcessorError(
+                f"Predicate '{predicate_string}' needs NSPredicate, but "
+                "Foundation (PyObjC) can't be imported"
+            )
+        _ns_predicates[predicate_string] = NSPredicate.predicateWithFormat_(
+            predicate_string
+        )
+    return _ns_predicates[predicate_string]
+
+
+def wait_until(probe, timeout, interval, max_interval):
+    """
+    Calls probe() until it returns True or timeout seconds passed, sleeping
+    interval seconds between calls, doubled each time up to max_interval,
+    with jitter. Returns (ready, seconds waited).
+    """
+    start = monotonic()
+    attempt = 0
+    while True:
+        if probe():
+            return True, monotonic() - start
+        remaining = timeout - (monotonic() - start)
+        if remaining <= 0:
+            return False, monotonic() - start
+        delay = min(max_interval, interval * 2 ** attempt)
+        sleep(min(remaining, random.uniform(delay / 2, delay)))
+        attempt += 1
+
 
 class SleepIf(Processor):
     """Sets a variable to tell AutoPackager to stop processing a recipe if a
@@ -46,31 +107,205 @@ class SleepIf(Processor):
             "description": "The number of seconds to sleep.",
             "default": "5",
         },
+        "predicate_engine": {
+            "required": False,
+            "description": (
+                "'python' evaluates the predicate with the built-in evaluator, "
+                "which knows the comparisons, AND/OR/NOT and literals recipes use "
+                "and needs neither PyObjC nor macOS. 'nspredicate' uses "
+                "Foundation's NSPredicate. 'auto' uses NSPredicate only for "
+                "predicates the built-in one doesn't know."
+            ),
+            "default": "auto",
+        },
+        "wait_for": {
+            "required": False,
+            "description": (
+                "Instead of sleeping sleep_time, poll until the server reports "
+                "wait_version and return at once: 'jamf_patch' waits for the "
+                "latest version of the Jamf Pro patch title patch_softwaretitle, "
+                "'title_editor' for the currentVersion of Title Editor title "
+                "title_id. A newer version counts as ready as well."
+            ),
+            "default": "",
+        },
+        "wait_version": {
+            "required": False,
+            "description": "Version to wait for, defaults to version.",
+        },
+        "wait_timeout": {
+            "required": False,
+            "description": "Seconds to wait at most before failing.",
+            "default": "600",
+        },
+        "wait_interval": {
+            "required": False,
+            "description": (
+                "Seconds between the first polls, doubled after each poll up to "
+                "wait_max_interval."
+            ),
+            "default": "5",
+        },
+        "wait_max_interval": {
+            "required": False,
+            "description": "Longest time between two polls in seconds.",
+            "default": "60",
+        },
     }
     output_variables = {
         "sleep_recipe": {
             "description": "Boolean. Should we sleep the recipe?"
-        }
+        },
+        "waited_seconds": {
+            "description": "Seconds spent sleeping or waiting for the server.",
+        },
     }
 
     def predicate_evaluates_as_true(self, predicate_string):
         """Evaluates predicate against our environment dictionary"""
-        try:
-            predicate = NSPredicate.predicateWithFormat_(predicate_string)
-        except Exception as err:
-            raise ProcessorError(f"Predicate error for '{predicate_string}': {err}")
+        engine = self.env.get("predicate_engine") or "auto"
+        if engine not in PREDICATE_ENGINES:
+            raise ProcessorError(
+                f"predicate_engine must be one of {', '.join(PREDICATE_ENGINES)}, not '{engine}'"
+            )
+        result = None
+        if engine != "nspredicate":
+            try:
+                result = evaluate(predicate_string, self.env)
+            except PredicateError as err:
+                if engine == "python":
+                    raise ProcessorError(f"Predicate error for '{predicate_string}': {err}")
+                self.output(f"Using NSPredicate: {err}", 2)
+        if result is None:
+            try:
+                predicate = nspredicate(predicate_string)
+            except ProcessorError:
+                raise
+            except Exception as err:
+                raise ProcessorError(f"Predicate error for '{predicate_string}': {err}")
+            result = bool(predicate.evaluateWithObject_(self.env))
 
-        result = predicate.evaluateWithObject_(self.env)
         self.output(f"({predicate_string}) is {result}")
         return result
 
+    def jamf_patch_probe(self):
+        """Returns a function that returns the latest version Jamf Pro
+        reports for patch_softwaretitle"""
+        jamf_url = self.env.get("JSS_URL")
+        name = self.env.get("patch_softwaretitle")
+        if not jamf_url or not name:
+            raise ProcessorError("wait_for jamf_patch needs JSS_URL and patch_softwaretitle")
+        cache_dir = os.path.join(jamf_patch_cache_root(self.env), server_key(jamf_url))
+        index = PatchTitleIndex(os.path.join(cache_dir, "index.json"))
+        cache = VersionCache(os.path.join(cache_dir, "titles"))
+        auth = {}
+
+        def token(fresh=False):
+            if fresh or "token" not in auth:
+                try:
+                    auth["token"] = get_token(
+                        jamf_url,
+                        self.env.get("API_USERNAME"),
+                        self.env.get("API_PASSWORD"),
+                        self.env.get("CLIENT_ID"),
+                        self.env.get("CLIENT_SECRET"),
+                    )
+                except AuthError as err:
+                    raise ProcessorError(f"ERROR: {err}")
+            return auth["token"]
+
+        def probe():
+            title_id = index.resolve(name, lambda: list_patch_titles(jamf_url, token()))
+            if title_id is None:
+                return None
+            try:
+                return latest_version(title_fetcher(jamf_url, token()), title_id, cache)[0]
+            except TitleFetchError as err:
+                if err.status == 401:
+                    token(fresh=True)
+                elif err.status == 404:
+                    index.forget(name)
+                raise
+
+        return probe
+
+    def title_editor_probe(self):
+        """Returns a function that returns the currentVersion of title_id"""
+        title_id = self.env.get("title_id")
+        if not (self.env.get("TITLE_URL") and self.env.get("TITLE_USER")
+                and self.env.get("TITLE_PASS") and title_id):
+            raise ProcessorError(
+                "wait_for title_editor needs TITLE_URL, TITLE_USER, TITLE_PASS and title_id"
+            )
+        client = TitleEditorClient(
+            self.env["TITLE_URL"],
+            self.env["TITLE_USER"],
+            self.env["TITLE_PASS"],
+            token_cache=TokenCache(
+                os.path.join(title_editor_cache_root(self.env), "tokens.json")
+            ),
+            log=self.output,
+        )
+
+        def probe():
+            return client.title_state(title_id).current_version
+
+        return probe
+
+    def wait_for_version(self, mode, version):
+        """Polls the server until it reports version or newer. Returns the
+        seconds waited."""
+        if mode == "jamf_patch":
+            current_version = self.jamf_patch_probe()
+        else:
+            current_version = self.title_editor_probe()
+        wanted = version_key(version)
+
+        def ready():
+            try:
+                current = current_version()
+            except (TitleFetchError, TitleEditorError) as err:
+                self.output(f"Server not ready: {err}", 2)
+                return False
+            self.output(f"Server reports version {current}, waiting for {version}", 2)
+            return current is not None and version_key(current) >= wanted
+
+        timeout = float(self.env.get("wait_timeout", 600))
+        ready, waited = wait_until(
+            ready,
+            timeout,
+            float(self.env.get("wait_interval", 5)),
+            float(self.env.get("wait_max_interval", 60)),
+        )
+        if not ready:
+            raise ProcessorError(
+                f"Server didn't report version {version} within {timeout:.0f} seconds"
+            )
+        self.output(f"Server reports version {version} or newer after {waited:.1f} seconds")
+        return waited
+
     def main(self):
         self.env["sleep_recipe"] = self.predicate_evaluates_as_true(
             self.env["predicate"]
         )
+        self.env["waited_seconds"] = 0
         if self.env["sleep_recipe"]:
-            sleep_time = int(self.env.get("sleep_time"))
-            sleep(sleep_time)
+            mode = self.env.get("wait_for")
+            if mode:
+                if mode not in WAIT_MODES:
+                    raise ProcessorError(
+                        f"wait_for must be one of {', '.join(WAIT_MODES)}, not '{mode}'"
+                    )
+                version = self.env.get("wait_version") or self.env.get("version")
+                if not version:
+                    raise ProcessorError("wait_for needs wait_version or version")
+                self.env["waited_seconds"] = round(
+                    self.wait_for_version(mode, str(version)), 1
+                )
+            else:
+                sleep_time = int(self.env.get("sleep_time"))
+                sleep(sleep_time)
+                self.env["waited_seconds"] = sleep_time
 
 
 if __name__ == "__main__":
@@ -0,0 +1,317 @@
+"""
+A pure Python evaluator for the NSPredicate syntax used in recipes.
+
+Supported are comparisons of key paths and literals with ==, =, !=, <>,
+<, <=, >, >=, CONTAINS, BEGINSWITH, ENDSWITH, LIKE, MATCHES and IN (the
+string operators take the [c], [d] and [cd] modifiers), combined with
+AND/&&, OR/||, NOT/! and parentheses, and TRUEPREDICATE/FALSEPREDICATE.
+Literals are quoted strings, numbers, TRUE/YES, FALSE/NO, NIL/NULL and
+{...} lists. Key paths are looked up in the environment dictionary, dotted
+ones through nested dictionaries; a missing key is nil. A key named like a
+keyword is escaped with #, e.g. #in.
+
+compile_predicate() turns a predicate string into a Python closure once
+and caches it by string, so evaluating it again costs no parsing.
+Anything else raises PredicateError, and callers may hand the string to
+NSPredicate instead.
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+
+CACHE_SIZE = 256
+
+TOKEN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<number>-?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?)
+  | (?P<operator>==|=<|=>|<=|>=|!=|<>|&&|\|\||[=<>!(){},])
+  | (?P<modifier>\[[cdn]+\])
+  | (?P<word>\#?[A-Za-z_$@][\w$@]*(?:\.[A-Za-z_@][\w@]*)*)
+""", re.VERBOSE)
+
+# Keywords are case insensitive in NSPredicate
+KEYWORDS = {"AND", "OR", "NOT", "TRUEPREDICATE", "FALSEPREDICATE", "TRUE",
+            "YES", "FALSE", "NO", "NIL", "NULL", "CONTAINS", "BEGINSWITH",
+            "ENDSWITH", "LIKE", "MATCHES", "IN"}
+LITERALS = {"TRUE": True, "YES": True, "FALSE": False, "NO": False,
+            "NIL": None, "NULL": None}
+OPERATORS = {"==": "==", "=": "==", "!=": "!=", "<>": "!=", "<": "<",
+             ">": ">", "<=": "<=", "=<": "<=", ">=": ">=", "=>": ">="}
+STRING_OPERATORS = {"CONTAINS", "BEGINSWITH", "ENDSWITH", "LIKE", "MATCHES",
+                    "IN"}
+ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "0": "\0"}
+
+
+class PredicateError(ValueError):
+    """Raised for predicates the evaluator doesn't understand"""
+
+
+def tokenize(predicate):
+    """Returns [(kind, value)] of a predicate string"""
+    tokens = []
+    pos = 0
+    while pos < len(predicate):
+        match = TOKEN.match(predicate, pos)
+        if match is None:
+            raise PredicateError("Unexpected %r at %d in %r"
+                                 % (predicate[pos], pos, predicate))
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group()
+        if kind == "space":
+            continue
+        if kind == "string":
+            value = re.sub(r"\\(.)", lambda m: ESCAPES.get(m.group(1),
+                                                           m.group(1)),
+                           value[1:-1])
+        elif kind == "number":
+            value = float(value) if re.search(r"[.eE]", value) \
+                else int(value)
+        elif kind == "word" and value.startswith("#"):
+            # a key named like a keyword
+            value = value[1:]
+        elif kind == "word" and value.upper() in KEYWORDS:
+            kind, value = "keyword", value.upper()
+        tokens.append((kind, value))
+    return tokens
+
+
+def lookup(env, path):
+    """Returns the value of a key path in env, None if it's missing"""
+    value = env
+    for key in path.split("."):
+        try:
+            value = value[key]
+        except (KeyError, IndexError, TypeError):
+            if hasattr(value, "get"):
+                return None
+            try:
+                value = value.valueForKey_(key)
+            except AttributeError:
+                return None
+    return value
+
+
+def _fold(value, modifiers):
+    """Applies the [c] and [d] modifiers to a string"""
+    if not isinstance(value, str):
+        return value
+    if "d" in modifiers:
+        value = "".join(char for char in unicodedata.normalize("NFKD", value)
+                        if not unicodedata.combining(char))
+    if "c" in modifiers:
+        value = value.casefold()
+    return value
+
+
+def _coerce(left, right):
+    """Numbers compare with numeric strings as numbers, like NSPredicate
+    comparing an NSNumber with an NSString"""
+    numbers = (int, float)
+    if isinstance(left, numbers) and not isinstance(left, bool) and \
+            isinstance(right, str):
+        try:
+            return left, float(right)
+        except ValueError:
+            return left, right
+    if isinstance(right, numbers) and not isinstance(right, bool) and \
+            isinstance(left, str):
+        try:
+            return float(left), right
+        except ValueError:
+            return left, right
+    return left, right
+
+
+def _like(pattern):
+    """Regex of a LIKE pattern: * matches any run, ? one character"""
+    parts = []
+    for char in pattern:
+        parts.append(".*" if char == "*" else "." if char == "?"
+                     else re.escape(char))
+    return re.compile("".join(parts), re.DOTALL)
+
+
+def _compare(operator, modifiers, left, right):
+    left, right = _fold(left, modifiers), _fold(right, modifiers)
+    if isinstance(right, (list, tuple)):
+        right = [_fold(item, modifiers) for item in right]
+    if operator == "==":
+        left, right = _coerce(left, right)
+        return left == right
+    if operator == "!=":
+        left, right = _coerce(left, right)
+        return left != right
+    if operator in ("<", ">", "<=", ">="):
+        if left is None or right is None:
+            return False
+        left, right = _coerce(left, right)
+        try:
+            return {"<": left < right, ">": left > right,
+                    "<=": left <= right, ">=": left >= right}[operator]
+        except TypeError:
+            return False
+    if operator == "IN":
+        operator, left, right = "CONTAINS", right, left
+    if left is None or right is None:
+        return False
+    if operator == "CONTAINS":
+        if isinstance(left, str):
+            return isinstance(right, str) and right in left
+        try:
+            return right in left
+        except TypeError:
+            return False
+    if not isinstance(left, str) or not isinstance(right, str):
+        return False
+    if operator == "BEGINSWITH":
+        return left.startswith(right)
+    if operator == "ENDSWITH":
+        return left.endswith(right)
+    if operator == "LIKE":
+        return _like(right).fullmatch(left) is not None
+    try:
+        return re.fullmatch(right, left) is not None
+    except re.error:
+        return False
+
+
+class _Parser:
+    """Recursive descent parser building closures of env"""
+
+    def __init__(self, predicate):
+        self.predicate = predicate
+        self.tokens = tokenize(predicate)
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def error(self, message):
+        raise PredicateError("%s in %r" % (message, self.predicate))
+
+    def parse(self):
+        if not self.tokens:
+            self.error("Empty predicate")
+        expression = self.parse_or()
+        if self.pos != len(self.tokens):
+            self.error("Unexpected %r" % (self.peek()[1],))
+        return expression
+
+    def parse_or(self):
+        terms = [self.parse_and()]
+        while self.peek() in (("keyword", "OR"), ("operator", "||")):
+            self.take()
+            terms.append(self.parse_and())
+        if len(terms) == 1:
+            return terms[0]
+        return lambda env: any(term(env) for term in terms)
+
+    def parse_and(self):
+        terms = [self.parse_not()]
+        while self.peek() in (("keyword", "AND"), ("operator", "&&")):
+            self.take()
+            terms.append(self.parse_not())
+        if len(terms) == 1:
+            return terms[0]
+        return lambda env: all(term(env) for term in terms)
+
+    def parse_not(self):
+        if self.peek() in (("keyword", "NOT"), ("operator", "!")):
+            self.take()
+            term = self.parse_not()
+            return lambda env: not term(env)
+        return self.parse_primary()
+
+    def parse_primary(self):
+        token = self.peek()
+        if token == ("operator", "("):
+            self.take()
+            expression = self.parse_or()
+            if self.take() != ("operator", ")"):
+                self.error("Missing ')'")
+            return expression
+        if token == ("keyword", "TRUEPREDICATE"):
+            self.take()
+            return lambda env: True
+        if token == ("keyword", "FALSEPREDICATE"):
+            self.take()
+            return lambda env: False
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        left = self.parse_value()
+        kind, value = self.take()
+        if kind == "operator" and value in OPERATORS:
+            operator = OPERATORS[value]
+        elif kind == "keyword" and value in STRING_OPERATORS:
+            operator = value
+        else:
+            self.error("Expected a comparison, got %r" % (value,))
+        modifiers = ""
+        if self.peek()[0] == "modifier":
+            modifiers = self.take()[1][1:-1]
+        right = self.parse_value()
+        if not callable(left):
+            left = lambda env, left=left: left  # noqa: E731
+        if operator == "LIKE" and not callable(right) and \
+                isinstance(right, str):
+            # constant patterns are compiled once
+            pattern = _like(_fold(right, modifiers))
+
+            def like(env):
+                value = _fold(left(env), modifiers)
+                return isinstance(value, str) and \
+                    pattern.fullmatch(value) is not None
+            return like
+        right = right if callable(right) else (lambda env, right=right:
+                                               right)
+        return lambda env: _compare(operator, modifiers, left(env),
+                                    right(env))
+
+    def parse_value(self):
+        """Returns a constant, or a closure for key paths and lists that
+        hold key paths"""
+        kind, value = self.take()
+        if kind in ("string", "number"):
+            return value
+        if kind == "keyword" and value in LITERALS:
+            return LITERALS[value]
+        if kind == "word":
+            if value.startswith("$"):
+                self.error("Variables like %r are not supported" % value)
+            return lambda env, path=value: lookup(env, path)
+        if (kind, value) == ("operator", "{"):
+            items = []
+            if self.peek() != ("operator", "}"):
+                items.append(self.parse_value())
+                while self.peek() == ("operator", ","):
+                    self.take()
+                    items.append(self.parse_value())
+            if self.take() != ("operator", "}"):
+                self.error("Missing '}'")
+            if any(callable(item) for item in items):
+                return lambda env: [item(env) if callable(item) else item
+                                    for item in items]
+            return items
+        self.error("Expected a value, got %r" % (value,))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def compile_predicate(predicate):
+    """Returns a function of an environment dictionary that evaluates the
+    predicate. Cached by predicate string."""
+    return _Parser(predicate).parse()
+
+
+def evaluate(predicate, env):
+    return bool(compile_predicate(predicate)(env))
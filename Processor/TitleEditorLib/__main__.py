@@ -0,0 +1,275 @@
+"""
+Command line tools for the caches and queues used by UpdateTitleEditor.
+Run from the Processor directory, e.g.:
+
+    python3 -m TitleEditorLib cache list
+    python3 -m TitleEditorLib batch titles.json
+    python3 -m TitleEditorLib backfill 12 ~/Packages/Firefox
+    python3 -m TitleEditorLib trace-summary --since 168
+    python3 -m TitleEditorLib outbox flush
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from TitleEditorLib.backfill import (BackfillState, find_packages,
+                                     format_items, run_backfill)
+from TitleEditorLib.batch import (ManifestError, format_results,
+                                  load_manifest, run_batch)
+from TitleEditorLib.client import TitleEditorClient, TitleEditorError
+from TitleEditorLib.metadata_cache import MetadataCache
+from TitleEditorLib.outbox import Outbox
+from SharedLib.paths import autopkg_settings, title_editor_cache_root
+from TitleEditorLib.throttle import AdaptiveThrottle
+from SharedLib.token_cache import TokenCache
+from TitleEditorLib.trace import aggregate, format_rows, read_spans
+from TitleEditorLib.workspace import get_manager
+
+
+def title_client(args, max_concurrency=1, retries=0):
+    """Returns a TitleEditorClient for TITLE_URL/USER/PASS from AutoPkg's
+    preferences or the environment"""
+    settings = autopkg_settings()
+    missing = [key for key in ("TITLE_URL", "TITLE_USER", "TITLE_PASS")
+               if not settings.get(key)]
+    if missing:
+        sys.exit("%s not set in AutoPkg preferences or environment"
+                 % ", ".join(missing))
+    return TitleEditorClient(
+        settings["TITLE_URL"], settings["TITLE_USER"],
+        settings["TITLE_PASS"],
+        token_cache=TokenCache(os.path.join(args.cache_dir, "tokens.json")),
+        throttle=AdaptiveThrottle(max_concurrency), retries=retries,
+        log=print if args.verbose else None)
+
+
+def cache_command(args):
+    cache = MetadataCache(os.path.join(args.cache_dir, "metadata"))
+    if args.action == "purge":
+        print("Removed %d entries" % cache.purge())
+    elif args.action == "evict":
+        print("Removed %d entries" % cache.evict(args.max_entries))
+    else:
+        for path, last_used, size in cache.entries():
+            try:
+                with open(path) as fp:
+                    entry = json.load(fp)
+            except (OSError, ValueError):
+                continue
+            info_plist = entry["info_plist"]
+            print("%s  %s  %s %s  (%d bytes)" % (
+                time.strftime("%Y-%m-%d %H:%M", time.localtime(last_used)),
+                os.path.basename(path)[:16],
+                info_plist.get("CFBundleIdentifier"),
+                info_plist.get("CFBundleShortVersionString", ""),
+                size,
+            ))
+
+
+def batch_command(args):
+    try:
+        jobs = load_manifest(args.manifest)
+    except ManifestError as err:
+        sys.exit(str(err))
+    client = None if args.dry_run else \
+        title_client(args, args.workers, args.retries)
+    results = run_batch(jobs, client, args.extract_workers, args.workers,
+                        args.cache_dir, args.dry_run, not args.no_preflight)
+    print(format_results(results))
+    return 1 if any(r.status == "failed" for r in results) else 0
+
+
+def backfill_command(args):
+    pkg_paths = find_packages(args.packages)
+    if not pkg_paths:
+        sys.exit("No packages found in %s" % ", ".join(args.packages))
+    overrides = {"package_info_fast_path": args.package_info_fast_path}
+    if args.pkg_vers_key:
+        overrides["pkg_vers_key"] = args.pkg_vers_key
+    state = BackfillState(os.path.join(args.cache_dir, "backfill",
+                                       "%s.json" % args.title_id))
+    if args.restart:
+        state.remove()
+    state.load()
+    client = None if args.dry_run else title_client(args, 1, args.retries)
+    try:
+        items = run_backfill(args.title_id, pkg_paths, client, overrides,
+                             args.extract_workers, args.batch_size,
+                             args.cache_dir, state, args.dry_run,
+                             not args.no_set_current)
+    except TitleEditorError as err:
+        sys.exit(str(err))
+    print(format_items(items))
+    return 1 if any(item.status == "failed" for item in items) else 0
+
+
+def outbox_command(args):
+    outbox = Outbox(os.path.join(args.cache_dir, "outbox.sqlite"))
+    try:
+        if args.action == "retry":
+            print("Requeued %d updates" % outbox.retry())
+        elif args.action == "purge":
+            print("Removed %d updates" % outbox.purge(args.older_than * 3600))
+        elif args.action == "flush":
+            client = title_client(args, args.workers, args.retries)
+            while True:
+                for result in outbox.flush(client, args.batch_size,
+                                           args.workers, args.max_attempts):
+                    update = result.update
+                    print("%s  %s  %s  %s" % (update.title_id,
+                                              update.version, result.status,
+                                              result.detail))
+                if not args.watch:
+                    break
+                time.sleep(args.watch)
+        else:
+            for update in outbox.updates(None if args.all else "pending") \
+                    + ([] if args.all else outbox.updates("failed")):
+                print("%s  %-8s %-10s %-10s %d  %s" % (
+                    time.strftime("%Y-%m-%d %H:%M",
+                                  time.localtime(update.created)),
+                    update.title_id, update.version, update.status,
+                    update.attempts, update.last_error or ""))
+    finally:
+        outbox.close()
+    return 0
+
+
+def scratch_command(args):
+    manager = get_manager(args.scratch_dir or
+                          os.path.join(args.cache_dir, "scratch"))
+    if args.action == "sweep":
+        manager.log = print
+        print("Freed %d MB" % (manager.sweep(args.max_age * 3600) >> 20))
+        return 0
+    for path, owner, size in manager.entries():
+        created = owner.get("created")
+        print("%s  %-28s  pid %-7s %s  %d MB" % (
+            time.strftime("%Y-%m-%d %H:%M", time.localtime(created))
+            if created else "-" * 16, os.path.basename(path),
+            owner.get("pid", "-"), owner.get("host", "-"), size >> 20))
+    return 0
+
+
+def trace_summary_command(args):
+    paths = args.trace_files or [
+        os.path.join(args.cache_dir, "trace.jsonl.1"),
+        os.path.join(args.cache_dir, "trace.jsonl")]
+    since = time.time() - args.since * 3600 if args.since else None
+    group_by = tuple(args.by.split(","))
+    rows = aggregate(read_spans(paths, since), group_by)
+    if not rows:
+        print("No spans in %s" % ", ".join(paths))
+        return 1
+    print(format_rows(rows, group_by))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python3 -m TitleEditorLib")
+    parser.add_argument("--cache-dir", default=title_editor_cache_root(),
+                        help="defaults to %(default)s")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cache = commands.add_parser("cache", help="inspect or purge the "
+                                "package metadata cache")
+    cache.add_argument("action", choices=("list", "evict", "purge"),
+                       nargs="?", default="list")
+    cache.add_argument("--max-entries", type=int, default=0,
+                       help="entries to keep when evicting")
+    cache.set_defaults(func=cache_command)
+
+    batch = commands.add_parser("batch", help="update the titles listed in "
+                                "a JSON or plist manifest")
+    batch.add_argument("manifest")
+    batch.add_argument("--workers", type=int, default=8,
+                       help="concurrent Title Editor requests")
+    batch.add_argument("--extract-workers", type=int, default=None,
+                       help="package extraction processes")
+    batch.add_argument("--retries", type=int, default=5,
+                       help="retries for throttled (429/5xx) requests")
+    batch.add_argument("--dry-run", action="store_true",
+                       help="only extract, don't update Title Editor")
+    batch.add_argument("--no-preflight", action="store_true",
+                       help="don't list the titles' current versions first")
+    batch.set_defaults(func=batch_command)
+
+    backfill = commands.add_parser("backfill", help="add the versions of "
+                                   "old packages to a title")
+    backfill.add_argument("title_id")
+    backfill.add_argument("packages", nargs="+",
+                          help="packages, or directories of packages")
+    backfill.add_argument("--pkg-vers-key",
+                          help="Info.plist key to read the version from "
+                          "(default CFBundleShortVersionString)")
+    backfill.add_argument("--package-info-fast-path", action="store_true",
+                          help="read the Apps from PackageInfo/Bom")
+    backfill.add_argument("--extract-workers", type=int, default=None,
+                          help="package extraction processes")
+    backfill.add_argument("--batch-size", type=int, default=20,
+                          help="patches sent between progress messages")
+    backfill.add_argument("--retries", type=int, default=5,
+                          help="retries for throttled (429/5xx) requests")
+    backfill.add_argument("--dry-run", action="store_true",
+                          help="only extract and show the order")
+    backfill.add_argument("--no-set-current", action="store_true",
+                          help="leave the title's currentVersion alone")
+    backfill.add_argument("--restart", action="store_true",
+                          help="ignore the state of an interrupted run")
+    backfill.set_defaults(func=backfill_command)
+
+    outbox = commands.add_parser("outbox", help="list or deliver the "
+                                 "queued Title Editor updates")
+    outbox.add_argument("action", choices=("list", "flush", "retry",
+                                           "purge"), nargs="?",
+                        default="list")
+    outbox.add_argument("--all", action="store_true",
+                        help="list delivered and superseded updates too")
+    outbox.add_argument("--batch-size", type=int, default=20)
+    outbox.add_argument("--workers", type=int, default=4,
+                        help="concurrent Title Editor requests")
+    outbox.add_argument("--retries", type=int, default=2,
+                        help="immediate retries for 429/5xx responses")
+    outbox.add_argument("--max-attempts", type=int, default=10,
+                        help="flushes an update is tried in before it "
+                        "fails")
+    outbox.add_argument("--watch", type=float, default=0,
+                        help="keep flushing every WATCH seconds")
+    outbox.add_argument("--older-than", type=float, default=24 * 7,
+                        help="hours after which purge removes finished "
+                        "updates (default %(default)s)")
+    outbox.set_defaults(func=outbox_command)
+
+    scratch = commands.add_parser("scratch", help="list the scratch "
+                                  "folders or sweep those of crashed runs")
+    scratch.add_argument("action", choices=("list", "sweep"), nargs="?",
+                         default="list")
+    scratch.add_argument("--scratch-dir", help="the processor's scratch_dir "
+                         "(default scratch in the cache dir)")
+    scratch.add_argument("--max-age", type=float, default=24,
+                         help="hours after which even the folders of live "
+                         "runs are swept (default %(default)s)")
+    scratch.set_defaults(func=scratch_command)
+
+    trace = commands.add_parser("trace-summary", help="p50/p95 per phase "
+                                "of the recorded UpdateTitleEditor runs")
+    trace.add_argument("trace_files", nargs="*",
+                       help="JSONL trace files (default trace.jsonl in the "
+                       "cache dir)")
+    trace.add_argument("--since", type=float, default=None,
+                       help="only runs of the last SINCE hours")
+    trace.add_argument("--by", default="phase",
+                       help="comma separated span fields to group by, e.g. "
+                       "phase,host or phase,title_id (default %(default)s)")
+    trace.set_defaults(func=trace_summary_command)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+In-process HTTP client for the Title Editor API.
+
+Connections are kept alive and pooled per scheme/host/port for the life of
+the process, so consecutive requests (and consecutive recipes in one
+`autopkg run`) reuse one TLS session instead of forking curl each time.
+"""
+
+import http.client
+import json
+import ssl
+import threading
+from urllib.parse import urlsplit
+
+DEFAULT_TIMEOUT = 60
+POOL_SIZE = 8
+
+# Errors a kept-alive connection shows when the server has closed it
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """Idle keep-alive connections to one host, shared between threads"""
+
+    def __init__(self, scheme, host, port, maxsize=POOL_SIZE,
+                 timeout=DEFAULT_TIMEOUT):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._context = ssl.create_default_context() \
+            if scheme == "https" else None
+
+    def new_connection(self):
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.timeout,
+                context=self._context)
+        return http.client.HTTPConnection(self.host, self.port,
+                                          timeout=self.timeout)
+
+    def get(self):
+        """Returns (connection, reused)"""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self.new_connection(), False
+
+    def put(self, connection):
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+def get_pool(url):
+    """Returns the ConnectionPool for the host of url"""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("Unsupported URL %s" % url)
+    key = (parts.scheme, parts.hostname, parts.port)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(*key)
+        return _pools[key]
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+class Response:
+    """Status, headers and decoded body of a finished request"""
+
+    def __init__(self, status, headers, data):
+        self.status = status
+        self.headers = headers
+        self.data = data
+
+
+def _decode(response):
+    """Decodes the JSON body straight from the response stream"""
+    content_type = response.getheader("Content-Type", "")
+    if response.status == 204 or response.getheader("Content-Length") == "0":
+        response.read()
+        return None
+    if "json" in content_type:
+        try:
+            return json.load(response)
+        except ValueError:
+            return None
+    body = response.read().decode("utf-8", "replace")
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body
+
+
+def request(method, url, headers=None, data=None):
+    """
+    Sends one request over a pooled keep-alive connection and returns a
+    Response. A request on a connection the server already closed is
+    retried once on a fresh connection.
+    """
+    pool = get_pool(url)
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    headers = dict(headers or {})
+    connection, reused = pool.get()
+    while True:
+        try:
+            connection.request(method, path, body=data, headers=headers)
+            response = connection.getresponse()
+            body = _decode(response)
+            # drain anything the decoder left so the connection is reusable
+            response.read()
+        except STALE_CONNECTION_ERRORS:
+            connection.close()
+            if reused:
+                # other idle connections are likely stale as well
+                connection, reused = pool.new_connection(), False
+                continue
+            raise
+        except Exception:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            pool.put(connection)
+        return Response(response.status, dict(response.getheaders()), body)
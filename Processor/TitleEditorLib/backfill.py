@@ -0,0 +1,239 @@
+"""
+Backfill: load the history of one title from its old packages.
+
+The packages are read in a process pool (see batch.py), ordered by version
+and their patches added newest first, each at the absoluteOrderId that
+keeps the title's patch list sorted. Title Editor has no bulk endpoint and
+every insert shifts the order ids after it, so patches are sent one after
+the other, in batches.
+
+The metadata of every package is saved in a state file after the
+extraction. An interrupted backfill resumes from there: packages that did
+not change are not read again, and the versions the title already lists
+(read from Title Editor on every run) are skipped.
+"""
+
+import glob
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from TitleEditorLib.batch import BatchJob, extract_metadata
+from TitleEditorLib.client import TitleEditorError
+from TitleEditorLib.extract import ExtractError
+from TitleEditorLib.metadata_cache import AppMetadata
+from TitleEditorLib.patch import build_patch
+from TitleEditorLib.versions import version_key
+
+BackfillItem = namedtuple("BackfillItem", ["pkg_path", "version", "status",
+                                           "order_id", "detail"])
+
+
+def order_id(versions, version):
+    """Returns the absoluteOrderId for version in a newest first list of
+    versions: in front of the first older one"""
+    key = version_key(version)
+    for index, existing in enumerate(versions):
+        if version_key(existing) < key:
+            return index
+    return len(versions)
+
+
+def find_packages(paths):
+    """Expands directories to the flat packages in them"""
+    packages = []
+    for path in paths:
+        if os.path.isdir(path):
+            packages += sorted(candidate for candidate in
+                               glob.glob(os.path.join(path, "*.pkg"))
+                               if os.path.isfile(candidate))
+        else:
+            packages.append(path)
+    return list(dict.fromkeys(os.path.abspath(path) for path in packages))
+
+
+class BackfillState:
+    """
+    JSON file of the packages a backfill read, keyed by path with their
+    size, mtime, version and AppMetadata
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.packages = {}
+
+    def load(self):
+        try:
+            with open(self.path) as fp:
+                self.packages = dict(json.load(fp)["packages"])
+        except (OSError, ValueError, KeyError, TypeError):
+            self.packages = {}
+        return self
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp_path, "w") as fp:
+            json.dump({"packages": self.packages}, fp)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def extracted(self, pkg_path):
+        """Returns the stored (AppMetadata, version) of an unchanged
+        package, or None"""
+        entry = self.packages.get(pkg_path)
+        try:
+            stat = os.stat(pkg_path)
+            if entry and entry["size"] == stat.st_size and \
+                    entry["mtime"] == int(stat.st_mtime):
+                return AppMetadata(**entry["app"]), entry["version"]
+        except (OSError, KeyError, TypeError):
+            pass
+        return None
+
+    def store(self, pkg_path, app, version):
+        stat = os.stat(pkg_path)
+        self.packages[pkg_path] = {
+            "size": stat.st_size, "mtime": int(stat.st_mtime),
+            "version": version, "app": app._replace(info_plist={
+                key: value for key, value in app.info_plist.items()
+                if isinstance(value, str)})._asdict()}
+
+
+def extract_all(title_id, pkg_paths, overrides, extract_workers=None,
+                cache_dir=None, state=None):
+    """Returns {pkg_path: (AppMetadata, version) or ExtractError}"""
+    results = {}
+    if state:
+        for path in pkg_paths:
+            stored = state.extracted(path)
+            if stored:
+                results[path] = stored
+    with ProcessPoolExecutor(extract_workers) as extractors:
+        futures = {path: extractors.submit(
+            extract_metadata, BatchJob(path, title_id, overrides), cache_dir)
+            for path in pkg_paths if path not in results}
+        for path, future in futures.items():
+            try:
+                results[path] = future.result()
+            except (ExtractError, OSError, KeyError) as err:
+                results[path] = ExtractError(str(err))
+                continue
+            if state:
+                state.store(path, *results[path])
+    if state and futures:
+        state.save()
+    return results
+
+
+def run_backfill(title_id, pkg_paths, client, overrides=None,
+                 extract_workers=None, batch_size=20, cache_dir=None,
+                 state=None, dry_run=False, set_current=True):
+    """
+    Adds a patch for every version in pkg_paths the title doesn't have
+    yet. With set_current the title's currentVersion is moved to the
+    newest version if that is newer. Returns a BackfillItem per package,
+    newest first.
+    """
+    title_id = str(title_id)
+    log = client.log if client else (lambda message: None)
+    extracted = extract_all(title_id, pkg_paths, dict(overrides or {}),
+                            extract_workers, cache_dir, state)
+    items = []
+    apps = {}
+    for path, result in extracted.items():
+        if isinstance(result, Exception):
+            items.append(BackfillItem(path, None, "failed", None,
+                                      str(result)))
+        elif result[1] in apps:
+            items.append(BackfillItem(path, result[1], "duplicate", None,
+                                      os.path.basename(apps[result[1]][0])))
+        else:
+            apps[result[1]] = (path, result[0])
+    versions = sorted(apps, key=version_key, reverse=True)
+
+    current_version = None
+    existing = []
+    if not dry_run:
+        title = client.title_state(title_id)
+        current_version = title.current_version
+        existing = list(title.patch_versions)
+
+    pending = []
+    for version in versions:
+        path = apps[version][0]
+        if version in existing:
+            items.append(BackfillItem(path, version, "exists",
+                                      existing.index(version), ""))
+        else:
+            pending.append(version)
+    log("%d of %d versions to add to title %s"
+        % (len(pending), len(versions), title_id))
+
+    failed = False
+    batch_size = max(1, batch_size)
+    for start in range(0, len(pending), batch_size):
+        for version in pending[start:start + batch_size]:
+            path, app = apps[version]
+            index = order_id(existing, version)
+            if dry_run:
+                existing.insert(index, version)
+                items.append(BackfillItem(path, version, "planned", index,
+                                          ""))
+                continue
+            patch, current = build_patch(title_id, app, version, index)
+            try:
+                added = client.add_patch(title_id, patch,
+                                         os.path.basename(path))
+            except TitleEditorError as err:
+                failed = True
+                items.append(BackfillItem(path, version, "failed", index,
+                                          str(err)))
+                continue
+            existing.insert(index, version)
+            items.append(BackfillItem(path, version,
+                                      "added" if added else "exists",
+                                      index, ""))
+        log("Added %d of %d versions" % (min(start + batch_size,
+                                             len(pending)), len(pending)))
+
+    if set_current and versions and not dry_run and \
+            (current_version is None or version_key(versions[0]) >
+             version_key(current_version)):
+        path, app = apps[versions[0]]
+        try:
+            if versions[0] in existing:
+                client.set_current_version(
+                    title_id, build_patch(title_id, app, versions[0])[1])
+                log("Set currentVersion to %s" % versions[0])
+        except TitleEditorError as err:
+            failed = True
+            items.append(BackfillItem(path, versions[0], "failed", None,
+                                      str(err)))
+    if state and not failed and not dry_run:
+        state.remove()
+
+    rank = {version: index for index, version in enumerate(versions)}
+    return sorted(items, key=lambda item: (
+        rank.get(item.version, len(versions)), item.pkg_path))
+
+
+def format_items(items):
+    """Returns the items as a plain text table"""
+    rows = [("VERSION", "ORDER", "STATUS", "PACKAGE", "DETAIL")]
+    for item in items:
+        rows.append((item.version or "-",
+                     "-" if item.order_id is None else item.order_id,
+                     item.status, os.path.basename(item.pkg_path),
+                     item.detail))
+    widths = [max(len(str(row[i])) for row in rows) for i in range(4)]
+    return "\n".join(
+        "  ".join(str(value).ljust(width)
+                  for value, width in zip(row, widths)) + "  " + row[4]
+        for row in rows).rstrip()
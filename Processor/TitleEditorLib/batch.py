@@ -0,0 +1,188 @@
+"""
+Batch mode: update many Title Editor titles in one run.
+
+Package metadata is extracted in a process pool (pure Python, see
+extract.py) while a bounded thread pool pushes the patches of finished
+extractions. All pushes share one AdaptiveThrottle, so concurrency backs
+off on 429/5xx responses and recovers afterwards.
+"""
+
+import json
+import os
+import plistlib
+import time
+from collections import namedtuple
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
+
+from TitleEditorLib.client import TitleEditorError
+from TitleEditorLib.extract import (ExtractError, extract_app,
+                                     package_info_app)
+from TitleEditorLib.metadata_cache import MetadataCache, package_key
+from TitleEditorLib.patch import build_patch, select_version
+from TitleEditorLib.title_state import TitleState
+
+BatchJob = namedtuple("BatchJob", ["pkg_path", "title_id", "overrides"])
+BatchResult = namedtuple("BatchResult", ["title_id", "pkg_path", "version",
+                                         "status", "detail", "seconds"])
+Extracted = namedtuple("Extracted", ["job", "version", "patch", "current",
+                                     "seconds"])
+
+
+class ManifestError(Exception):
+    """Raised for unreadable batch manifests"""
+
+
+def load_manifest(path):
+    """
+    Reads a JSON or plist list of {"pkg_path", "title_id", "overrides"}
+    dicts. overrides takes the processor's input variables, e.g. version,
+    forcevers, pkg_vers_key or package_info_fast_path.
+    """
+    try:
+        with open(path, "rb") as fp:
+            data = fp.read()
+        if data.lstrip().startswith((b"[", b"{")):
+            entries = json.loads(data)
+        else:
+            entries = plistlib.loads(data)
+    except (OSError, ValueError, plistlib.InvalidFileException) as err:
+        raise ManifestError("Can't read %s: %s" % (path, err))
+    if isinstance(entries, dict):
+        entries = entries.get("titles", [])
+    jobs = []
+    base = os.path.dirname(os.path.abspath(path))
+    for entry in entries:
+        try:
+            jobs.append(BatchJob(os.path.join(base, entry["pkg_path"]),
+                                 str(entry["title_id"]),
+                                 dict(entry.get("overrides") or {})))
+        except (KeyError, TypeError):
+            raise ManifestError("Entry without pkg_path/title_id: %r"
+                                % (entry,))
+    return jobs
+
+
+def publish_version(app, overrides):
+    """Returns the version select_version() picks for a job's App"""
+    env = dict(overrides)
+    env.setdefault("version",
+                   app.info_plist.get("CFBundleShortVersionString"))
+    return select_version(app.info_plist, env)
+
+
+def extract_metadata(job, cache_dir=None):
+    """Returns the AppMetadata and the version to publish of one job.
+    The package is only hashed for the metadata cache when PackageInfo
+    can't answer."""
+    overrides = job.overrides
+    vers_key = overrides.get("pkg_vers_key")
+    if overrides.get("package_info_fast_path"):
+        app = package_info_app(job.pkg_path, vers_key)
+        if app:
+            return app, publish_version(app, overrides)
+    cache = key = app = None
+    if cache_dir:
+        cache = MetadataCache(os.path.join(cache_dir, "metadata"))
+        key = package_key(job.pkg_path)
+        app = cache.get(key, "payload")
+        if app and vers_key and not overrides.get("forcevers") and \
+                vers_key not in app.info_plist:
+            app = None
+    if app is None:
+        app = extract_app(job.pkg_path, pkg_vers_key=vers_key)
+        if cache:
+            cache.put(key, "payload", app._replace(info_plist={
+                k: v for k, v in app.info_plist.items()
+                if isinstance(v, str)}))
+    return app, publish_version(app, overrides)
+
+
+def extract_job(job, cache_dir=None):
+    """Builds the patch of one job. Runs in a worker process."""
+    start = time.monotonic()
+    app, version = extract_metadata(job, cache_dir)
+    patch, current = build_patch(job.title_id, app, version)
+    return Extracted(job, version, patch, current, time.monotonic() - start)
+
+
+def push_job(client, extracted, current_versions=None):
+    start = time.monotonic()
+    job = extracted.job
+    name = os.path.basename(job.pkg_path)
+    state = None
+    if current_versions and job.title_id in current_versions:
+        # The listing has no patch versions, but currentVersion can only
+        # name an existing patch
+        current_version = current_versions[job.title_id]
+        state = TitleState(job.title_id, current_version, [current_version],
+                           start)
+    try:
+        updated = client.update_title(job.title_id, extracted.patch,
+                                      extracted.current, extracted.version,
+                                      state, name)
+    except TitleEditorError as err:
+        status, detail = "failed", str(err)
+    else:
+        status, detail = ("updated", "") if updated else ("current", "")
+    return BatchResult(job.title_id, job.pkg_path, extracted.version, status,
+                       detail, extracted.seconds + time.monotonic() - start)
+
+
+def run_batch(jobs, client, extract_workers=None, push_workers=8,
+              cache_dir=None, dry_run=False, preflight=True):
+    """
+    Extracts and pushes all jobs. client should carry an AdaptiveThrottle
+    sized push_workers. With preflight, one listing of all titles is used
+    to skip titles already at their version. Returns a BatchResult per
+    job, in manifest order.
+    """
+    results = [None] * len(jobs)
+    current_versions = None
+    if not dry_run and jobs:
+        # One token for all workers instead of a race for it
+        client.get_token()
+        if preflight:
+            try:
+                current_versions = client.current_versions()
+            except TitleEditorError as err:
+                client.log("Can't list titles, skipping pre-flight: %s"
+                           % err)
+    with ProcessPoolExecutor(extract_workers) as extractors, \
+            ThreadPoolExecutor(push_workers) as pushers:
+        extractions = {extractors.submit(extract_job, job, cache_dir): index
+                       for index, job in enumerate(jobs)}
+        pushes = {}
+        for future in as_completed(extractions):
+            index = extractions[future]
+            job = jobs[index]
+            try:
+                extracted = future.result()
+            except (ExtractError, OSError, KeyError) as err:
+                results[index] = BatchResult(job.title_id, job.pkg_path,
+                                             None, "failed", str(err), 0.0)
+                continue
+            if dry_run:
+                results[index] = BatchResult(job.title_id, job.pkg_path,
+                                             extracted.version, "extracted",
+                                             "", extracted.seconds)
+            else:
+                pushes[pushers.submit(push_job, client, extracted,
+                                      current_versions)] = index
+        for future in as_completed(pushes):
+            results[pushes[future]] = future.result()
+    return results
+
+
+def format_results(results):
+    """Returns the results as a plain text table"""
+    rows = [("TITLE", "PACKAGE", "VERSION", "STATUS", "SECONDS", "DETAIL")]
+    for result in results:
+        rows.append((result.title_id, os.path.basename(result.pkg_path),
+                     result.version or "-", result.status,
+                     "%.1f" % result.seconds, result.detail))
+    widths = [max(len(str(row[i])) for row in rows) for i in range(5)]
+    return "\n".join(
+        "  ".join(str(value).ljust(width)
+                  for value, width in zip(row, widths)) + "  " + row[5]
+        for row in rows).rstrip()
@@ -0,0 +1,101 @@
+"""
+Reader for the Bom (bill of materials) of a component package.
+
+The Bom lists every path of the Payload together with its type, mode and
+modification time, so it answers "which App-Bundles does this package
+install" without reading the Payload itself. Layout as documented by the
+bomutils project.
+"""
+
+import struct
+from collections import namedtuple
+
+BOM_MAGIC = b"BOMStore"
+
+BOM_TYPE_FILE = 1
+BOM_TYPE_DIR = 2
+BOM_TYPE_LINK = 3
+
+BomEntry = namedtuple("BomEntry", ["path", "type", "mode", "mtime", "size"])
+
+
+class BomError(Exception):
+    """Raised when a Bom file can not be parsed"""
+
+
+def read_bom(data):
+    """Returns a dict of payload relative path -> BomEntry"""
+    if not data.startswith(BOM_MAGIC):
+        raise BomError("Not a Bom file")
+    try:
+        return _read_paths(memoryview(data))
+    except (struct.error, IndexError, KeyError) as err:
+        raise BomError("Corrupt Bom file: %s" % err)
+
+
+def _read_paths(data):
+    (_, _, index_offset, _, vars_offset, _) = \
+        struct.unpack_from(">6I", data, 8)
+
+    (count,) = struct.unpack_from(">I", data, index_offset)
+    blocks = [struct.unpack_from(">II", data, index_offset + 4 + 8 * i)
+              for i in range(count)]
+
+    def block(index):
+        address, length = blocks[index]
+        return data[address:address + length]
+
+    variables = {}
+    (count,) = struct.unpack_from(">I", data, vars_offset)
+    pos = vars_offset + 4
+    for _ in range(count):
+        (index,) = struct.unpack_from(">I", data, pos)
+        length = data[pos + 4]
+        variables[bytes(data[pos + 5:pos + 5 + length]).decode()] = index
+        pos += 5 + length
+
+    tree = block(variables["Paths"])
+    if bytes(tree[:4]) != b"tree":
+        raise BomError("Paths is not a tree")
+    (child,) = struct.unpack_from(">I", tree, 8)
+
+    # Walk down to the first leaf, then follow the leaves' forward links
+    paths = block(child)
+    is_leaf, count, forward, _ = struct.unpack_from(">HHII", paths)
+    while not is_leaf:
+        (child,) = struct.unpack_from(">I", paths, 12)
+        paths = block(child)
+        is_leaf, count, forward, _ = struct.unpack_from(">HHII", paths)
+
+    files = {}
+    while True:
+        for i in range(count):
+            info_index, file_index = struct.unpack_from(">II", paths,
+                                                        12 + 8 * i)
+            file_id, info2_index = struct.unpack_from(">II",
+                                                      block(info_index))
+            info = block(info2_index)
+            (mode,) = struct.unpack_from(">H", info, 4)
+            mtime, size = struct.unpack_from(">II", info, 14)
+            bom_file = block(file_index)
+            (parent,) = struct.unpack_from(">I", bom_file)
+            name = bytes(bom_file[4:]).split(b"\0", 1)[0].decode(
+                "utf-8", "surrogateescape")
+            files[file_id] = (parent, name, info[0], mode, mtime, size)
+        if not forward:
+            break
+        paths = block(forward)
+        is_leaf, count, forward, _ = struct.unpack_from(">HHII", paths)
+
+    entries = {}
+    for file_id, (parent, name, ftype, mode, mtime, size) in files.items():
+        parts = [name]
+        while parent in files and len(parts) < 256:
+            parent, name = files[parent][:2]
+            parts.append(name)
+        path = "/".join(reversed(parts))
+        # Normalise "./Applications/Foo.app" to "Applications/Foo.app"
+        while path.startswith("./"):
+            path = path[2:]
+        entries[path] = BomEntry(path, ftype, mode, mtime, size)
+    return entries
@@ -0,0 +1,226 @@
+"""
+Title Editor API client shared by the processor and the command line
+tools: token handling, retries and the patch/currentVersion update.
+"""
+
+import http.client
+import time
+from base64 import b64encode
+
+from TitleEditorLib import api
+from TitleEditorLib.throttle import RETRY_STATUSES
+from TitleEditorLib.title_state import is_current, state_from_title
+
+
+class TitleEditorError(Exception):
+    """Raised for failed Title Editor requests"""
+
+    def __init__(self, message, status=None, data=None):
+        super().__init__(message)
+        self.status = status
+        self.data = data
+
+
+def error_code(data):
+    """Returns the first error code of a Title Editor error response"""
+    try:
+        return data["errors"][0]["code"]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+class TitleEditorClient:
+    """
+    Talks to one Title Editor instance. Pass a TokenCache to share tokens
+    between runs, an AdaptiveThrottle to limit concurrent requests and
+    retry 429/5xx responses, and a Tracer to record a span per request.
+    """
+
+    def __init__(self, url, user, password, token_cache=None,
+                 throttle=None, retries=0, log=None, tracer=None):
+        self.url = url
+        self.user = user
+        self.password = password
+        self.token_cache = token_cache
+        self.throttle = throttle
+        self.retries = retries
+        self.log = log or (lambda message: None)
+        self.tracer = tracer
+        self.token = None
+
+    def enc_creds(self):
+        """encode the username and password into a b64-encoded string"""
+        credentials = f"{self.user}:{self.password}"
+        return str(b64encode(credentials.encode("utf-8")), "utf-8")
+
+    def _request(self, phase, method, path, data, headers):
+        if not self.tracer:
+            return api.request(method, self.url + path, headers=headers,
+                               data=data)
+        with self.tracer.span(phase, method=method, path=path) as span:
+            if data:
+                span["bytes_out"] = len(data.encode("utf-8")
+                                        if isinstance(data, str) else data)
+            r = api.request(method, self.url + path, headers=headers,
+                            data=data)
+            span["status"] = r.status
+            if r.headers.get("Content-Length", "").isdigit():
+                span["bytes"] = int(r.headers["Content-Length"])
+        return r
+
+    def send(self, method, path, data=None, headers=None, phase="http"):
+        """Sends one request, retrying throttled ones. Returns (json,
+        status)"""
+        headers = dict(headers or {})
+        headers.setdefault("Content-Type", "application/json")
+        headers.setdefault("Accept", "application/json")
+        attempt = 0
+        while True:
+            if self.throttle:
+                self.throttle.acquire()
+            r = None
+            try:
+                r = self._request(phase, method, path, data, headers)
+            except (OSError, http.client.HTTPException, ValueError) as err:
+                raise TitleEditorError("Request to %s%s failed: %s"
+                                       % (self.url, path, err))
+            finally:
+                delay = 0
+                if self.throttle:
+                    delay = self.throttle.release(
+                        r.status if r else None, attempt,
+                        r.headers.get("Retry-After") if r else None)
+            if r.status not in RETRY_STATUSES or attempt >= self.retries:
+                return r.data, r.status
+            attempt += 1
+            self.log("HTTP %s for %s %s, retry %d in %.1fs"
+                     % (r.status, method, path, attempt, delay))
+            if not self.throttle:
+                delay = min(2 ** attempt, 60)
+            time.sleep(delay)
+
+    def get_token(self, use_cache=True):
+        """Returns a Bearer token, from the token cache if possible"""
+        if use_cache and self.token_cache:
+            token = self.token_cache.get(self.url, self.user)
+            if token:
+                self.token = token
+                return token
+        r, status = self.send(
+            "POST", "/v2/auth/tokens",
+            headers={"Authorization": f"Basic {self.enc_creds()}"},
+            phase="token_fetch")
+        try:
+            self.token = str(r["token"])
+            expires = r["expires"]
+        except (KeyError, TypeError):
+            raise TitleEditorError("No token received (HTTP %s)" % status,
+                                   status, r)
+        if self.token_cache:
+            self.token_cache.put(self.url, self.user, self.token, expires)
+        return self.token
+
+    def request(self, method, path, data=None, phase="http"):
+        """Sends an authorized request. A rejected token is dropped from
+        the cache and the request retried once with a new one."""
+        if not self.token:
+            self.get_token()
+        r, status = self.send(method, path, data,
+                              {"Authorization": f"Bearer {self.token}"},
+                              phase)
+        if status == 401:
+            self.log("Token was rejected, requesting a new one")
+            if self.token_cache:
+                self.token_cache.invalidate(self.url, self.user)
+            self.get_token(use_cache=False)
+            r, status = self.send(method, path, data,
+                                  {"Authorization": f"Bearer {self.token}"},
+                                  phase)
+        return r, status
+
+    def add_patch(self, title_id, patch, name=None):
+        """
+        Adds a patch to a software title without touching its
+        currentVersion. Returns True if it was added, False if the title
+        already had the patch.
+        """
+        name = name or "title %s" % title_id
+        r, status = self.request(
+            "POST", "/v2/softwaretitles/%s/patches" % title_id, patch,
+            "patch_post")
+        if status in (200, 201):
+            return True
+        if status == 400 and error_code(r) == "DUPLICATE_RECORD":
+            return False
+        raise TitleEditorError("Error %s sending Patch-Data for %s: %s"
+                               % (status, name, error_code(r) or r),
+                               status, r)
+
+    def set_current_version(self, title_id, current, name=None):
+        """Sets the currentVersion of a software title"""
+        name = name or "title %s" % title_id
+        r, status = self.request(
+            "PUT", "/v2/softwaretitles/%s" % title_id, current,
+            "version_put")
+        if status not in (200, 201):
+            raise TitleEditorError("Error %s setting version for %s"
+                                   % (status, name), status, r)
+
+    def push_patch(self, title_id, patch, current, name=None):
+        """
+        Adds the patch to a software title and sets its currentVersion.
+        Returns True if the title was updated, False if it already had the
+        patch.
+        """
+        name = name or "title %s" % title_id
+        if self.add_patch(title_id, patch, name):
+            self.log("New version - setting currentVersion")
+            self.set_current_version(title_id, current, name)
+            return True
+        self.log("%s was already at this version" % name)
+        return False
+
+    def title_state(self, title_id):
+        """Returns the TitleState of a software title"""
+        r, status = self.request("GET", "/v2/softwaretitles/%s" % title_id,
+                                 phase="title_state")
+        if status != 200 or not isinstance(r, dict):
+            raise TitleEditorError("Error %s reading title %s"
+                                   % (status, title_id), status, r)
+        patches = None
+        if "patches" not in r:
+            patches, status = self.request(
+                "GET", "/v2/softwaretitles/%s/patches" % title_id,
+                phase="title_state")
+            if status != 200 or not isinstance(patches, list):
+                raise TitleEditorError("Error %s reading patches of title %s"
+                                       % (status, title_id), status, patches)
+        return state_from_title(title_id, r, patches)
+
+    def current_versions(self):
+        """Returns {title_id: currentVersion} of all titles in one call"""
+        r, status = self.request("GET", "/v2/softwaretitles",
+                                 phase="title_list")
+        if status != 200 or not isinstance(r, list):
+            raise TitleEditorError("Error %s listing titles" % status,
+                                   status, r)
+        return {str(title.get("softwareTitleId")): title.get("currentVersion")
+                for title in r if isinstance(title, dict)}
+
+    def update_title(self, title_id, patch, current, version, state,
+                     name=None):
+        """
+        push_patch() that skips the requests state shows to be redundant:
+        nothing is sent for a title already at version, and only the
+        currentVersion is set if the patch exists. Returns True if the
+        title was updated.
+        """
+        name = name or "title %s" % title_id
+        if is_current(state, version):
+            self.log("%s was already at this version" % name)
+            return False
+        if state is not None and version in state.patch_versions:
+            self.log("Patch exists - setting currentVersion")
+            self.set_current_version(title_id, current, name)
+            return True
+        return self.push_patch(title_id, patch, current, name)
@@ -0,0 +1,92 @@
+"""
+Pure Python extraction of the App metadata of a flat package.
+
+Reads PackageInfo/Bom (optionally) and streams the Payload straight out of
+the xar archive, so nothing is written to disk and no macOS tools are
+needed. Used where the AutoPkg unpacker processors are not available, e.g.
+when processing many packages in worker processes.
+"""
+
+import plistlib
+import xml.parsers.expat
+
+from TitleEditorLib.metadata_cache import AppMetadata
+from TitleEditorLib.payload import APP_PATTERNS, PayloadError, search_payloads
+from TitleEditorLib.pkginfo import (PackageInfoError, find_package_apps,
+                                    sort_payloads)
+from TitleEditorLib.xar import XarArchive, XarError
+
+
+class ExtractError(Exception):
+    """Raised when no single App-Bundle can be found in a package"""
+
+
+def payload_names(archive):
+    """Returns the Payloads of a component or product package, the ones
+    most likely to hold the App first, and how many PackageInfo says hold
+    an App-Bundle"""
+    if "Payload" in archive:
+        return ["Payload"], 0
+
+    def package_info(name):
+        try:
+            return archive.read(name[:-len("Payload")] + "PackageInfo")
+        except XarError:
+            return None
+
+    return sort_payloads([name for name in archive.names()
+                          if name.endswith(".pkg/Payload")
+                          and name.count("/") == 1],
+                         package_info, lambda name: archive.members[name].size)
+
+
+def _single(pattern, matches, pkg_path):
+    if len(matches) > 1:
+        raise ExtractError("Multiple matches found by globbing %s in %s"
+                           % (pattern, pkg_path))
+    return matches[0]
+
+
+def package_info_app(pkg_path, pkg_vers_key=None):
+    """Returns the AppMetadata PackageInfo/Bom give for the package's
+    single App-Bundle, or None if they can't answer"""
+    try:
+        pattern, matches = find_package_apps(pkg_path)
+    except PackageInfoError:
+        return None
+    if len(matches) == 1 and (not pkg_vers_key or
+                              pkg_vers_key in matches[0].info_plist):
+        app = matches[0]
+        return AppMetadata(app.path, app.info_plist, app.mtime)
+    return None
+
+
+def extract_app(pkg_path, package_info_fast_path=False, pkg_vers_key=None,
+                workers=4):
+    """Returns the AppMetadata of the App-Bundle installed by a package"""
+    if package_info_fast_path:
+        app = package_info_app(pkg_path, pkg_vers_key)
+        if app:
+            return app
+
+    try:
+        archive = XarArchive(pkg_path)
+        names, likely = payload_names(archive)
+        index, pattern, matches, errors = search_payloads(
+            [lambda name=name: archive.open(name) for name in names],
+            workers, likely=likely)
+        if not matches and errors:
+            raise errors[min(errors)]
+        if matches:
+            app = _single(pattern, matches, pkg_path)
+            try:
+                info_plist = plistlib.loads(app.info_plist)
+            except (plistlib.InvalidFileException,
+                    xml.parsers.expat.ExpatError) as err:
+                raise ExtractError("Unreadable Info.plist in %s: %s"
+                                   % (pkg_path, err))
+            return AppMetadata(app.path, info_plist, app.mtime)
+    except (OSError, XarError, PayloadError) as err:
+        raise ExtractError("Can't read %s: %s" % (pkg_path, err))
+    raise ExtractError("No match found by globbing %s in %s"
+                       % (" or ".join(APP_PATTERNS), pkg_path))
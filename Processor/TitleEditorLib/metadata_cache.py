@@ -0,0 +1,112 @@
+"""
+Content addressed cache of the App metadata extracted from a package.
+
+Entries are keyed by the SHA-256, size and mtime of the package, so a cache
+hit costs one sequential read of the package instead of an unpack. Each
+entry is a small JSON file; the least recently used ones are evicted once
+the cache holds more than max_entries.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import time
+from collections import namedtuple
+
+HASH_CHUNK = 8 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 256
+
+AppMetadata = namedtuple("AppMetadata", ["path", "info_plist", "mtime"])
+
+
+def file_digest(path):
+    """Returns the SHA-256 of a file, read through mmap"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        size = os.fstat(fp.fileno()).st_size
+        if size:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    for offset in range(0, size, HASH_CHUNK):
+                        digest.update(view[offset:offset + HASH_CHUNK])
+                finally:
+                    view.release()
+    return digest.hexdigest()
+
+
+def package_key(path):
+    """Returns the cache key for a package"""
+    stat = os.stat(path)
+    return "%s-%d-%d" % (file_digest(path), stat.st_size, int(stat.st_mtime))
+
+
+class MetadataCache:
+    """JSON file per package, LRU ordered by the files' mtime"""
+
+    def __init__(self, directory, max_entries=DEFAULT_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+
+    def _entry_path(self, key, variant):
+        return os.path.join(self.directory, "%s.%s.json" % (key, variant))
+
+    def get(self, key, variant):
+        """Returns the AppMetadata stored for key, or None"""
+        path = self._entry_path(key, variant)
+        try:
+            with open(path) as fp:
+                entry = json.load(fp)
+            # Touch the entry so it counts as recently used
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return AppMetadata(entry["path"], entry["info_plist"], entry["mtime"])
+
+    def put(self, key, variant, app):
+        """Stores an AppMetadata and evicts the oldest entries if needed"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._entry_path(key, variant)
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "w") as fp:
+            json.dump({"path": app.path, "info_plist": app.info_plist,
+                       "mtime": app.mtime, "stored": time.time()}, fp)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def entries(self):
+        """Returns (path, last_used, size) of all entries, oldest first"""
+        result = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return result
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            result.append((path, stat.st_mtime, stat.st_size))
+        return sorted(result, key=lambda entry: entry[1])
+
+    def evict(self, max_entries=None):
+        """Removes the least recently used entries above max_entries"""
+        if max_entries is None:
+            max_entries = self.max_entries
+        entries = self.entries()
+        removed = 0
+        for path, _, _ in entries[:max(len(entries) - max_entries, 0)]:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def purge(self):
+        """Removes all entries"""
+        return self.evict(0)
@@ -0,0 +1,228 @@
+"""
+Durable outbox for Title Editor updates.
+
+Instead of sending a patch right away, the processor can queue it in a
+SQLite database and return. A flusher (in-process at the end of the run,
+or `python3 -m TitleEditorLib outbox flush`) delivers the queue later:
+
+- every update has an idempotency key (hash of title, version and patch),
+  so queuing the same update twice is a no-op, and delivery goes through
+  update_title(), which skips titles already at the version
+- pending updates of one title are coalesced, only the newest version is
+  sent and the older ones are marked superseded
+- failed deliveries are retried with exponential backoff and jitter until
+  max_attempts; client errors other than 429 fail at once
+"""
+
+import fcntl
+import hashlib
+import os
+import random
+import sqlite3
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from TitleEditorLib.client import TitleEditorError
+from TitleEditorLib.versions import version_key
+
+MAX_ATTEMPTS = 10
+BACKOFF_BASE = 30
+BACKOFF_MAX = 6 * 60 * 60
+
+Update = namedtuple("Update", ["id", "title_id", "version", "patch",
+                               "current", "name", "key", "created",
+                               "attempts", "next_attempt", "status",
+                               "last_error"])
+# updated: whether update_title() changed the title, False if it was
+# already at the version
+FlushResult = namedtuple("FlushResult", ["update", "status", "detail",
+                                         "updated"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS updates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title_id TEXT NOT NULL,
+    version TEXT NOT NULL,
+    patch TEXT NOT NULL,
+    current TEXT NOT NULL,
+    name TEXT,
+    key TEXT NOT NULL UNIQUE,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS updates_pending
+    ON updates (status, next_attempt);
+"""
+
+
+def idempotency_key(title_id, version, patch):
+    return hashlib.sha256(("%s\0%s\0%s" % (title_id, version, patch))
+                          .encode()).hexdigest()
+
+
+def backoff(attempts, base=BACKOFF_BASE, maximum=BACKOFF_MAX):
+    """Seconds to wait before the next attempt, with full jitter"""
+    return random.uniform(0, min(maximum, base * 2 ** attempts))
+
+
+def permanent(err):
+    """True for errors a retry can't fix, e.g. a title that doesn't
+    exist"""
+    return err.status is not None and 400 <= err.status < 500 and \
+        err.status != 429
+
+
+class Outbox:
+    """SQLite queue of patch/currentVersion updates"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def enqueue(self, title_id, version, patch, current, name=None):
+        """Queues an update. Returns True if it was new."""
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT OR IGNORE INTO updates (title_id, version, patch, "
+                "current, name, key, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (str(title_id), version, patch, current, name,
+                 idempotency_key(title_id, version, patch), time.time()))
+        return cursor.rowcount == 1
+
+    def updates(self, status=None):
+        """Returns the updates, optionally only those with status"""
+        query = "SELECT %s FROM updates" % ", ".join(Update._fields)
+        if status:
+            rows = self.db.execute(query + " WHERE status = ? ORDER BY id",
+                                   (status,))
+        else:
+            rows = self.db.execute(query + " ORDER BY id")
+        return [Update(*row) for row in rows]
+
+    def coalesce(self):
+        """Marks all pending versions of a title superseded but the newest,
+        and those older than one already delivered. Returns the number
+        marked."""
+        newest = {}
+        superseded = []
+        for update in self.updates("delivered") + self.updates("pending"):
+            best = newest.get(update.title_id)
+            if best is None or (version_key(update.version), update.id) > \
+                    (version_key(best.version), best.id):
+                if best and best.status == "pending":
+                    superseded.append(best.id)
+                newest[update.title_id] = update
+            elif update.status == "pending":
+                superseded.append(update.id)
+        with self.db:
+            self.db.executemany(
+                "UPDATE updates SET status = 'superseded' WHERE id = ?",
+                [(update_id,) for update_id in superseded])
+        return len(superseded)
+
+    def due(self, now=None, limit=None):
+        """Returns the pending updates whose next attempt is due"""
+        now = time.time() if now is None else now
+        return [update for update in self.updates("pending")
+                if update.next_attempt <= now][:limit]
+
+    def delivered(self, update):
+        with self.db:
+            self.db.execute(
+                "UPDATE updates SET status = 'delivered', attempts = "
+                "attempts + 1, last_error = NULL WHERE id = ?", (update.id,))
+
+    def failed(self, update, error, retry, max_attempts=MAX_ATTEMPTS):
+        """Records a failed delivery; retried later unless it is out of
+        attempts. Returns the new status."""
+        attempts = update.attempts + 1
+        status = "pending" if retry and attempts < max_attempts \
+            else "failed"
+        with self.db:
+            self.db.execute(
+                "UPDATE updates SET status = ?, attempts = ?, next_attempt "
+                "= ?, last_error = ? WHERE id = ?",
+                (status, attempts, time.time() + backoff(attempts),
+                 str(error), update.id))
+        return status
+
+    def retry(self):
+        """Queues failed updates again. Returns the number requeued."""
+        with self.db:
+            cursor = self.db.execute(
+                "UPDATE updates SET status = 'pending', attempts = 0, "
+                "next_attempt = 0 WHERE status = 'failed'")
+        return cursor.rowcount
+
+    def purge(self, older_than):
+        """Removes finished updates older than older_than seconds"""
+        with self.db:
+            cursor = self.db.execute(
+                "DELETE FROM updates WHERE status IN ('delivered', "
+                "'superseded') AND created < ?", (time.time() - older_than,))
+        return cursor.rowcount
+
+    def flush(self, client, batch_size=20, workers=4,
+              max_attempts=MAX_ATTEMPTS, deadline=None):
+        """
+        Delivers due updates in batches of batch_size, workers at a time,
+        until none are due or the deadline (monotonic seconds) passed.
+        Only one flusher runs at a time; a second one returns at once.
+        Returns a FlushResult per update handled.
+        """
+        lock = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                client.log("Another flusher is running")
+                return []
+            results = []
+            self.coalesce()
+            while deadline is None or time.monotonic() < deadline:
+                batch = self.due(limit=batch_size)
+                if not batch:
+                    break
+                with ThreadPoolExecutor(max(1, workers)) as pool:
+                    outcomes = list(pool.map(
+                        lambda update: self._deliver(client, update), batch))
+                for update, (updated, error) in zip(batch, outcomes):
+                    if error is None:
+                        self.delivered(update)
+                        results.append(FlushResult(update, "delivered", "",
+                                                   updated))
+                    else:
+                        status = self.failed(update, error,
+                                             not permanent(error),
+                                             max_attempts)
+                        results.append(FlushResult(update, status,
+                                                   str(error), False))
+            return results
+        finally:
+            os.close(lock)
+
+    def _deliver(self, client, update):
+        """Sends one update, returns update_title()'s result and None or
+        the TitleEditorError"""
+        try:
+            try:
+                state = client.title_state(update.title_id)
+            except TitleEditorError:
+                # update_title() reports it if the title is unreachable
+                state = None
+            updated = client.update_title(update.title_id, update.patch,
+                                          update.current, update.version,
+                                          state, update.name)
+        except TitleEditorError as err:
+            return False, err
+        return updated, None
@@ -0,0 +1,58 @@
+"""Builds the Title Editor patch and currentVersion JSON for an App"""
+
+import json
+import os
+from datetime import datetime
+
+DEFAULT_MIN_OS = "10.9"
+
+
+def select_version(info_plist, env):
+    """
+    Returns the version to publish: forcevers wins, then the Info.plist key
+    named by pkg_vers_key, then the recipe's version.
+    """
+    if env.get("forcevers"):
+        return env["forcevers"]
+    if env.get("pkg_vers_key"):
+        return info_plist[env["pkg_vers_key"]]
+    return env["version"]
+
+
+def build_patch(title_id, app, version, absolute_order_id=0):
+    """Returns the patch JSON and the currentVersion JSON for an
+    AppMetadata"""
+    filename = os.path.basename(app.path.rstrip("/"))
+    name = filename.replace('.app', '')
+    info_plist = app.info_plist
+    bundle_id = info_plist["CFBundleIdentifier"]
+
+    # If a minimumOperatingSystem is set, use that
+    min_os = info_plist.get("LSMinimumSystemVersion", DEFAULT_MIN_OS)
+
+    # get timestamps
+    timestamp = datetime.utcfromtimestamp(
+        app.mtime).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    # generate patchData
+    patch = json.dumps(
+        {"patchId": 0, "softwareTitleId": title_id,
+         "absoluteOrderId": absolute_order_id, "version": version,
+         "releaseDate": timestamp, "standalone": True,
+         "minimumOperatingSystem": min_os, "reboot": False,
+         "killApps": [{"bundleId": bundle_id,
+                       "appName": filename}],
+         "components": [{"name": name, "version": version,
+                        "criteria": [{"name": "Application Bundle ID",
+                                      "operator": "is", "value": bundle_id,
+                                      "type": "recon", "and": True},
+                                     {"name": "Application Version",
+                                      "operator": "is", "value": version,
+                                      "type": "recon"}]}],
+         "capabilities": [{"name": "Operating System Version",
+                           "operator": "greater than or equal",
+                           "value": min_os, "type": "recon"}],
+         "dependencies": []})
+    current = json.dumps({"currentVersion": version,
+                          "softwareTitleId": title_id})
+    return patch, current
@@ -0,0 +1,295 @@
+"""
+Streaming reader for the Payload of a flat installer package.
+
+A Payload is a cpio archive that is either gzip compressed (pkgbuild) or
+wrapped in Apple's pbzx container (xz compressed chunks). Instead of
+unpacking the whole archive to disk we walk its entries once and only keep
+the few small files we are interested in, e.g. an App's Info.plist.
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import struct
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
+
+GZIP_MAGIC = b"\x1f\x8b"
+BZIP2_MAGIC = b"BZh"
+XZ_MAGIC = b"\xfd7zXZ\x00"
+PBZX_MAGIC = b"pbzx"
+CPIO_ODC_MAGIC = b"070707"
+CPIO_NEWC_MAGICS = (b"070701", b"070702")
+CPIO_TRAILER = "TRAILER!!!"
+
+# Where to look for the App-Bundle, in order of preference. The second
+# pattern fixes it for Virtualbox, which installs the App at the root.
+APP_PATTERNS = ("Applications/*.app", "*.app")
+
+S_IFMT = 0o170000
+S_IFDIR = 0o040000
+
+CpioEntry = namedtuple("CpioEntry", ["name", "mode", "mtime", "size"])
+PayloadApp = namedtuple("PayloadApp", ["path", "info_plist", "mtime"])
+
+
+class PayloadError(Exception):
+    """Raised when a Payload can not be read by this module"""
+
+
+class SearchCancelled(Exception):
+    """Raised inside find_apps when another Payload already matched"""
+
+
+def _read_exact(fileobj, size):
+    data = fileobj.read(size)
+    if len(data) != size:
+        raise PayloadError("Unexpected end of Payload")
+    return data
+
+
+def _skip(fileobj, size, cancelled=None):
+    while size > 0:
+        if cancelled and cancelled():
+            raise SearchCancelled()
+        data = fileobj.read(min(size, 1024 * 1024))
+        if not data:
+            raise PayloadError("Unexpected end of Payload")
+        size -= len(data)
+
+
+class _ChunkReader(io.RawIOBase):
+    """Exposes a generator of byte chunks as a readable file object"""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            self._buffer = next(self._chunks, None)
+            if self._buffer is None:
+                self._buffer = b""
+                return 0
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def _pbzx_chunks(fileobj):
+    """Yields the decompressed chunks of a pbzx stream"""
+    _read_exact(fileobj, 4)
+    (flags,) = struct.unpack(">Q", _read_exact(fileobj, 8))
+    # Bit 24 is set on every chunk that is followed by another one
+    while flags & 0x01000000:
+        flags, length = struct.unpack(">QQ", _read_exact(fileobj, 16))
+        chunk = _read_exact(fileobj, length)
+        if chunk.startswith(XZ_MAGIC):
+            try:
+                yield lzma.decompress(chunk)
+            except lzma.LZMAError as err:
+                raise PayloadError("Corrupt pbzx chunk: %s" % err)
+        else:
+            yield chunk
+
+
+def open_payload(fileobj):
+    """Returns a file object yielding the uncompressed cpio archive"""
+    if not hasattr(fileobj, "peek"):
+        fileobj = io.BufferedReader(fileobj)
+    head = fileobj.peek(6)[:6]
+    if head.startswith(PBZX_MAGIC):
+        return io.BufferedReader(_ChunkReader(_pbzx_chunks(fileobj)),
+                                 buffer_size=1024 * 1024)
+    if head.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+    if head.startswith(XZ_MAGIC):
+        return lzma.LZMAFile(fileobj)
+    if head.startswith(BZIP2_MAGIC):
+        return bz2.BZ2File(fileobj)
+    if head == CPIO_ODC_MAGIC or head in CPIO_NEWC_MAGICS:
+        return fileobj
+    raise PayloadError("Unknown Payload format (starts with %r)" % head)
+
+
+class _Member:
+    """Data of the current cpio entry, readable once"""
+
+    def __init__(self, fileobj, size):
+        self._fileobj = fileobj
+        self.remaining = size
+
+    def read(self):
+        data = _read_exact(self._fileobj, self.remaining)
+        self.remaining = 0
+        return data
+
+
+def iter_cpio(stream, cancelled=None):
+    """
+    Walks an uncompressed cpio archive (odc or newc format).
+    Yields a CpioEntry and a member whose read() returns the file data. Data
+    that is not read is skipped before the next entry is parsed.
+    cancelled is polled while skipping and stops the walk with
+    SearchCancelled when it returns True.
+    """
+    while True:
+        magic = _read_exact(stream, 6)
+        if magic == CPIO_ODC_MAGIC:
+            header = _read_exact(stream, 70)
+            mode = int(header[12:18], 8)
+            mtime = int(header[42:53], 8)
+            namesize = int(header[53:59], 8)
+            size = int(header[59:70], 8)
+            name = _read_exact(stream, namesize)
+            name_pad = data_pad = 0
+        elif magic in CPIO_NEWC_MAGICS:
+            header = _read_exact(stream, 104)
+            fields = [int(header[i:i + 8], 16) for i in range(0, 104, 8)]
+            mode, mtime, size, namesize = (fields[1], fields[5], fields[6],
+                                           fields[11])
+            name = _read_exact(stream, namesize)
+            name_pad = -(110 + namesize) % 4
+            data_pad = -size % 4
+        else:
+            raise PayloadError("Bad cpio header magic %r" % magic)
+        _skip(stream, name_pad)
+        name = name.rstrip(b"\0").decode("utf-8", "surrogateescape")
+        if name == CPIO_TRAILER:
+            return
+        # Normalise "./Applications/Foo.app" to "Applications/Foo.app"
+        while name.startswith("./"):
+            name = name[2:]
+        member = _Member(stream, size)
+        yield CpioEntry(name, mode, mtime, size), member
+        _skip(stream, member.remaining + data_pad, cancelled)
+
+
+def match_path(path, pattern):
+    """Like fnmatch, but a '*' never matches across a '/'"""
+    parts = path.split("/")
+    pattern_parts = pattern.split("/")
+    return len(parts) == len(pattern_parts) and all(
+        fnmatchcase(part, pat) for part, pat in zip(parts, pattern_parts))
+
+
+def find_apps(fileobj, patterns=APP_PATTERNS, cancelled=None):
+    """
+    Reads a Payload once and returns the App-Bundles it contains.
+    Returns the first pattern with matches and a list of PayloadApps with
+    the raw Info.plist data, or the last pattern and an empty list.
+    cancelled is polled while reading and stops the search with
+    SearchCancelled when it returns True.
+    """
+    plist_patterns = [pattern + "/Contents/Info.plist"
+                      for pattern in patterns]
+    app_mtimes = {}
+    plists = {}
+    for entry, member in iter_cpio(open_payload(fileobj), cancelled):
+        if (entry.mode & S_IFMT) == S_IFDIR:
+            if any(match_path(entry.name, p) for p in patterns):
+                app_mtimes[entry.name] = entry.mtime
+        elif any(match_path(entry.name, p) for p in plist_patterns):
+            plists[entry.name] = (member.read(), entry.mtime)
+
+    for pattern in patterns:
+        matches = []
+        for name in sorted(plists):
+            app_path = name[:-len("/Contents/Info.plist")]
+            if match_path(app_path, pattern):
+                data, plist_mtime = plists[name]
+                matches.append(PayloadApp(
+                    app_path, data, app_mtimes.get(app_path, plist_mtime)))
+        if matches:
+            return pattern, matches
+    return patterns[-1], []
+
+
+def _search(openers, workers, patterns):
+    lock = threading.Lock()
+    first_match = [len(openers)]
+
+    def search(index):
+        def cancelled():
+            return first_match[0] < index
+        with openers[index]() as fileobj:
+            pattern, matches = find_apps(fileobj, patterns, cancelled)
+        if matches:
+            with lock:
+                first_match[0] = min(first_match[0], index)
+        return pattern, matches
+
+    errors = {}
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        futures = [pool.submit(search, index)
+                   for index in range(len(openers))]
+        try:
+            for index, future in enumerate(futures):
+                try:
+                    pattern, matches = future.result()
+                except SearchCancelled:
+                    continue
+                except (OSError, PayloadError) as err:
+                    errors[index] = err
+                    continue
+                if matches:
+                    return index, pattern, matches, errors
+        finally:
+            with lock:
+                first_match[0] = -1
+            for future in futures:
+                future.cancel()
+    return None, patterns[-1], [], errors
+
+
+def search_payloads(openers, workers=4, patterns=APP_PATTERNS, likely=0):
+    """
+    Searches several Payloads concurrently for App-Bundles.
+    openers is a list of callables returning a Payload file object, most
+    likely match first; the first `likely` of them are searched before the
+    others are started. Returns the index of the first Payload in that
+    order with matches, its pattern, the matches and a dict of index ->
+    PayloadError for Payloads that could not be read. As soon as a Payload
+    matches, the search of all Payloads after it is cancelled.
+    """
+    errors = {}
+    offset = 0
+    for tier in (openers[:likely], openers[likely:]):
+        index, pattern, matches, tier_errors = _search(tier, workers,
+                                                       patterns)
+        errors.update((offset + i, err) for i, err in tier_errors.items())
+        if matches:
+            return offset + index, pattern, matches, errors
+        offset += len(tier)
+    return None, patterns[-1], [], errors
+
+
+def collect_apps(openers, workers=4, patterns=APP_PATTERNS):
+    """
+    Searches every Payload concurrently and returns the App-Bundles of all
+    of them, for packages that install several Apps (suites). Returns a
+    list of (index, PayloadApp) in Payload order and a dict of index ->
+    PayloadError for Payloads that could not be read.
+    """
+    def search(index):
+        with openers[index]() as fileobj:
+            return find_apps(fileobj, patterns)[1]
+
+    apps = []
+    errors = {}
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        futures = [pool.submit(search, index)
+                   for index in range(len(openers))]
+        for index, future in enumerate(futures):
+            try:
+                apps.extend((index, app) for app in future.result())
+            except (OSError, PayloadError) as err:
+                errors[index] = err
+    return apps, errors
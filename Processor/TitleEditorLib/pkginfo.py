@@ -0,0 +1,145 @@
+"""
+Fast path for finding the App-Bundle of a flat package.
+
+Every component package carries a PackageInfo file with a <bundle> entry
+(id, CFBundleShortVersionString, CFBundleVersion, path) for each bundle it
+installs, and a Bom listing the paths of its Payload. Both are tiny, so
+reading them straight from the xar archive answers most packages without
+expanding a single Payload.
+"""
+
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+from TitleEditorLib.bom import BOM_TYPE_DIR, BomError, read_bom
+from TitleEditorLib.payload import APP_PATTERNS, match_path
+from TitleEditorLib.xar import XarArchive, XarError
+
+# Info.plist keys that PackageInfo <bundle> attributes provide
+BUNDLE_KEYS = ("CFBundleShortVersionString", "CFBundleVersion")
+
+PackageInfoApp = namedtuple("PackageInfoApp",
+                            ["path", "info_plist", "mtime", "component"])
+
+
+class PackageInfoError(Exception):
+    """Raised when the package metadata can not answer the question"""
+
+
+def _components(archive):
+    """Returns the component prefixes of a product or component package"""
+    if "PackageInfo" in archive:
+        return [""]
+    return sorted(name[:-len("PackageInfo")] for name in archive.names()
+                  if name.endswith(".pkg/PackageInfo")
+                  and name.count("/") == 1)
+
+
+def minimum_os(archive):
+    """Returns the lowest allowed OS version from the Distribution, if any"""
+    if "Distribution" not in archive:
+        return None
+    try:
+        distribution = ET.fromstring(archive.read("Distribution"))
+    except ET.ParseError:
+        return None
+    for os_version in distribution.iter("os-version"):
+        if os_version.get("min"):
+            return os_version.get("min")
+    return None
+
+
+def lists_app(package_info, patterns=APP_PATTERNS):
+    """True if PackageInfo data has a <bundle> for an App-Bundle the
+    patterns match. Used to search the likely component Payloads first."""
+    try:
+        root = ET.fromstring(package_info)
+    except ET.ParseError:
+        return False
+    for bundle in root.iter("bundle"):
+        path = bundle.get("path", "")
+        while path.startswith("./"):
+            path = path[2:]
+        if any(match_path(path, pattern) for pattern in patterns):
+            return True
+    return False
+
+
+def sort_payloads(names, package_info, size):
+    """
+    Returns the component Payloads ordered most likely to hold the App
+    first: those whose PackageInfo lists an App-Bundle, then the biggest.
+    Also returns how many of them PackageInfo lists one for.
+    package_info(name) returns the PackageInfo data of a Payload's
+    component (None if it has none) and size(name) its size; each is
+    called once per Payload.
+    """
+    decorated = []
+    for name in names:
+        data = package_info(name)
+        has_app = data is not None and lists_app(data)
+        decorated.append((not has_app, -size(name), name))
+    decorated.sort()
+    return ([name for _, _, name in decorated],
+            sum(1 for no_app, _, _ in decorated if not no_app))
+
+
+def component_apps(archive, component, patterns=APP_PATTERNS):
+    """
+    Returns the first pattern with matches and the PackageInfoApps of one
+    component, using its PackageInfo for the bundle data and its Bom to
+    confirm the App-Bundle and get its modification time.
+    """
+    try:
+        package_info = ET.fromstring(archive.read(component + "PackageInfo"))
+        bom = read_bom(archive.read(component + "Bom"))
+    except (ET.ParseError, BomError, XarError) as err:
+        raise PackageInfoError("%sPackageInfo/Bom unreadable: %s"
+                               % (component, err))
+    bundles = {}
+    for bundle in package_info.iter("bundle"):
+        path = bundle.get("path", "")
+        while path.startswith("./"):
+            path = path[2:]
+        if bundle.get("id") and path:
+            bundles[path] = bundle
+    for pattern in patterns:
+        matches = []
+        for path in sorted(bundles):
+            entry = bom.get(path)
+            if not match_path(path, pattern) or entry is None \
+                    or entry.type != BOM_TYPE_DIR:
+                continue
+            bundle = bundles[path]
+            info_plist = {"CFBundleIdentifier": bundle.get("id")}
+            for key in BUNDLE_KEYS:
+                if bundle.get(key):
+                    info_plist[key] = bundle.get(key)
+            matches.append(PackageInfoApp(path, info_plist, entry.mtime,
+                                          component))
+        if matches:
+            return pattern, matches
+    return patterns[-1], []
+
+
+def find_package_apps(pkg_path, patterns=APP_PATTERNS, all_components=False):
+    """
+    Returns the PackageInfoApps of the first component installing an
+    App-Bundle, or with all_components those of every component. A minimum
+    OS from the Distribution is added to each as LSMinimumSystemVersion.
+    """
+    try:
+        archive = XarArchive(pkg_path)
+    except (OSError, XarError) as err:
+        raise PackageInfoError(str(err))
+    min_os = minimum_os(archive)
+    found = []
+    for component in _components(archive):
+        pattern, matches = component_apps(archive, component, patterns)
+        if min_os:
+            for match in matches:
+                match.info_plist["LSMinimumSystemVersion"] = min_os
+        if matches and not all_components:
+            return pattern, matches
+        found += matches
+    return patterns[-1], found
@@ -0,0 +1,65 @@
+"""
+Adaptive concurrency limit for requests to the Title Editor API.
+
+Works like TCP congestion control: every successful request raises the
+limit a little (additive increase), every 429/5xx halves it and pauses all
+workers for a backoff delay (multiplicative decrease).
+"""
+
+import random
+import threading
+import time
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class AdaptiveThrottle:
+    """Shared between the threads sending requests"""
+
+    def __init__(self, max_concurrency=8, min_concurrency=1,
+                 base_delay=1.0, max_delay=60.0):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limit = float(max_concurrency)
+        self.active = 0
+        self.resume_at = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                delay = self.resume_at - time.monotonic()
+                if delay <= 0 and self.active < int(self.limit):
+                    self.active += 1
+                    return
+                self._cond.wait(delay if delay > 0 else None)
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """Exponential backoff with full jitter, or the server's
+        Retry-After"""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_delay)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_delay,
+                                     self.base_delay * 2 ** attempt))
+
+    def release(self, status=None, attempt=0, retry_after=None):
+        """Returns the slot and adapts the limit to the response status.
+        Returns the delay to wait before retrying a throttled request."""
+        delay = 0.0
+        with self._cond:
+            self.active -= 1
+            if status in RETRY_STATUSES:
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                delay = self.backoff_delay(attempt, retry_after)
+                self.resume_at = max(self.resume_at,
+                                     time.monotonic() + delay)
+            elif status is not None:
+                self.limit = min(self.max_concurrency,
+                                 self.limit + 1 / self.limit)
+            self._cond.notify_all()
+        return delay
@@ -0,0 +1,73 @@
+"""
+Current state of Title Editor software titles, and a local snapshot of it.
+
+Before writing a patch we read the title's currentVersion and patch
+versions; a title that already is at the version needs neither the patch
+POST nor the currentVersion PUT. The last state seen per title is kept on
+disk so callers can skip even that read while the snapshot is fresh.
+"""
+
+import json
+import os
+import time
+from collections import namedtuple
+
+TitleState = namedtuple("TitleState", ["title_id", "current_version",
+                                       "patch_versions", "fetched"])
+
+
+def state_from_title(title_id, title, patches=None):
+    """Builds a TitleState from a softwaretitle (and patches) response"""
+    if patches is None:
+        patches = title.get("patches") or []
+    return TitleState(
+        str(title_id),
+        title.get("currentVersion"),
+        [patch.get("version") for patch in patches
+         if isinstance(patch, dict)],
+        time.time(),
+    )
+
+
+def is_current(state, version):
+    """True if the title is at version and already has its patch"""
+    return state is not None and state.current_version == version and \
+        version in state.patch_versions
+
+
+class TitleStateStore:
+    """One small JSON file per title_id"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, title_id):
+        return os.path.join(self.directory, "%s.json" % title_id)
+
+    def get(self, title_id, max_age=None):
+        """Returns the snapshot of a title, None if missing or older than
+        max_age seconds"""
+        try:
+            with open(self._path(title_id)) as fp:
+                state = TitleState(**json.load(fp))
+        except (OSError, ValueError, TypeError):
+            return None
+        if max_age is not None and time.time() - state.fetched > max_age:
+            return None
+        return state
+
+    def put(self, state):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(state.title_id)
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "w") as fp:
+            json.dump(state._asdict(), fp)
+        os.replace(tmp_path, path)
+
+    def updated(self, title_id, version):
+        """Records that a title was set to version"""
+        state = self.get(title_id)
+        versions = list(state.patch_versions) if state else []
+        if version not in versions:
+            versions.insert(0, version)
+        self.put(TitleState(str(title_id), version, versions, time.time()))
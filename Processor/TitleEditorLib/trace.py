@@ -0,0 +1,184 @@
+"""
+Timing spans of an UpdateTitleEditor run, written as JSON lines.
+
+Each span records one phase (unpack_flat_pkg, token_fetch, patch_post,
+...) with its duration and optional byte counts or HTTP status. A run
+appends its spans to the trace file in one write when it finishes, so
+concurrent runs don't interleave; `python3 -m TitleEditorLib trace-summary`
+aggregates them into percentiles per phase.
+"""
+
+import fcntl
+import json
+import math
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# The trace file is rotated to <name>.1 once it grows beyond this
+MAX_TRACE_BYTES = 16 * 1024 * 1024
+
+
+class Tracer:
+    """Collects the spans of one run"""
+
+    def __init__(self, path=None, **attrs):
+        self.path = path
+        self.run = uuid.uuid4().hex[:12]
+        self.attrs = {key: value for key, value in attrs.items()
+                      if value is not None}
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def record(self, phase, seconds, **attrs):
+        span = {"run": self.run, "phase": phase, "start": time.time() -
+                seconds, "seconds": round(seconds, 6)}
+        span.update(self.attrs)
+        span.update((key, value) for key, value in attrs.items()
+                    if value is not None)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, phase, **attrs):
+        """Times the block. Yields a dict to add attributes to, e.g. bytes
+        or status; an exception is recorded as error."""
+        start = time.monotonic()
+        try:
+            yield attrs
+        except BaseException as err:
+            attrs.setdefault("error", type(err).__name__)
+            raise
+        finally:
+            self.record(phase, time.monotonic() - start, **attrs)
+
+    def totals(self):
+        """Returns [(phase, seconds, count)] in order of first appearance"""
+        totals = {}
+        with self._lock:
+            for span in self.spans:
+                seconds, count = totals.get(span["phase"], (0.0, 0))
+                totals[span["phase"]] = (seconds + span["seconds"], count + 1)
+        return [(phase, seconds, count)
+                for phase, (seconds, count) in totals.items()]
+
+    def summary(self):
+        """One line with the time spent per phase"""
+        return "Timing: " + ", ".join(
+            "%s %.2fs%s" % (phase, seconds,
+                            " (%d)" % count if count > 1 else "")
+            for phase, seconds, count in self.totals())
+
+    def write(self):
+        """Appends the spans to the trace file. Returns the number
+        written."""
+        with self._lock:
+            spans, self.spans = self.spans, []
+        if not self.path or not spans:
+            return 0
+        data = "".join(json.dumps(span, sort_keys=True) + "\n"
+                       for span in spans).encode()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                    exist_ok=True)
+        fd = _open_locked(self.path)
+        try:
+            if os.fstat(fd).st_size > MAX_TRACE_BYTES:
+                os.replace(self.path, self.path + ".1")
+                os.close(fd)
+                fd = _open_locked(self.path)
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        return len(spans)
+
+
+def _open_locked(path):
+    """Opens path for appending with an exclusive lock. A file another
+    run rotated while this one waited for the lock is opened again."""
+    while True:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            locked = os.fstat(fd)
+            current = os.stat(path)
+        except FileNotFoundError:
+            current = None
+        except BaseException:
+            os.close(fd)
+            raise
+        if current is not None and \
+                (current.st_dev, current.st_ino) == \
+                (locked.st_dev, locked.st_ino):
+            return fd
+        os.close(fd)
+
+
+def default_attrs():
+    return {"host": socket.gethostname().split(".")[0]}
+
+
+def read_spans(paths, since=None):
+    """Yields the spans of JSONL trace files, skipping broken lines"""
+    for path in paths:
+        try:
+            fp = open(path)
+        except FileNotFoundError:
+            continue
+        with fp:
+            for line in fp:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue
+                if since is None or span.get("start", 0) >= since:
+                    yield span
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def aggregate(spans, group_by=("phase",)):
+    """Returns a row per group: key, count, p50, p95, max, total seconds,
+    total bytes and HTTP error count"""
+    groups = {}
+    for span in spans:
+        key = tuple(str(span.get(field, "-")) for field in group_by)
+        groups.setdefault(key, []).append(span)
+    rows = []
+    for key, group in sorted(groups.items()):
+        seconds = sorted(span["seconds"] for span in group)
+        rows.append({
+            "key": key,
+            "count": len(seconds),
+            "p50": percentile(seconds, 0.50),
+            "p95": percentile(seconds, 0.95),
+            "max": seconds[-1],
+            "total": sum(seconds),
+            "bytes": sum(span.get("bytes", 0) for span in group),
+            "errors": sum(1 for span in group
+                          if span.get("error") or
+                          span.get("status", 0) >= 400),
+        })
+    return rows
+
+
+def format_rows(rows, group_by=("phase",)):
+    """Returns aggregate() rows as a plain text table"""
+    header = tuple(field.upper() for field in group_by) + (
+        "COUNT", "P50", "P95", "MAX", "TOTAL", "MB", "ERRORS")
+    table = [header]
+    for row in rows:
+        table.append(row["key"] + (
+            str(row["count"]), "%.3f" % row["p50"], "%.3f" % row["p95"],
+            "%.3f" % row["max"], "%.1f" % row["total"],
+            "%.1f" % (row["bytes"] / 1024 / 1024), str(row["errors"])))
+    widths = [max(len(row[i]) for row in table) for i in range(len(header))]
+    return "\n".join("  ".join(value.ljust(width)
+                               for value, width in zip(row, widths)).rstrip()
+                     for row in table)
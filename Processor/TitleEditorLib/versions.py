@@ -0,0 +1,11 @@
+"""Ordering of version strings, shared by backfill, the outbox and SleepIf"""
+
+import re
+
+
+def version_key(version):
+    """Sort key for version strings: numbers compare numerically, and
+    letters mark pre-releases, so 1.10 > 1.9.1 > 1.9 > 1.9b2"""
+    parts = tuple((2, int(part)) if part.isdigit() else (0, part.lower())
+                  for part in re.findall(r"\d+|[A-Za-z]+", str(version)))
+    return parts + ((1, ""),)
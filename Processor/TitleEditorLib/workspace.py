@@ -0,0 +1,227 @@
+"""
+Scratch directories for unpacking packages.
+
+Every run gets its own directory below one scratch root, which can live
+on a fast volume or tmpfs. The directories of all runs together are kept
+under a disk quota. A released directory is renamed out of the way at
+once and deleted by a background thread, so the recipe doesn't wait for
+the rmtree. Directories left behind by crashed runs (the owning process
+is gone) are swept before new ones are handed out.
+"""
+
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+
+RUN_PREFIX = "run-"
+TRASH_PREFIX = "trash-"
+OWNER_FILE = ".owner"
+# Directories of live processes older than this are swept all the same
+MAX_AGE = 24 * 60 * 60
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+class WorkspaceError(Exception):
+    """Raised when a scratch directory can not be handed out"""
+
+
+def tree_size(path):
+    """Returns the bytes used by the files below path"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WorkspaceManager:
+    """Hands out per-run directories below root within quota bytes (0 is
+    unlimited)"""
+
+    def __init__(self, root, quota=0, log=None):
+        self.root = root
+        self.quota = quota
+        self.log = log or (lambda message: None)
+        self._deleting = []
+        self._lock = threading.Lock()
+
+    def workspace(self, needed=0):
+        """Returns a Workspace, a context manager whose directory is
+        created on first use and released on exit"""
+        return Workspace(self, needed)
+
+    def entries(self):
+        """Returns (path, owner dict, size) of all directories below root"""
+        result = []
+        try:
+            names = sorted(os.listdir(self.root))
+        except FileNotFoundError:
+            return result
+        for name in names:
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(path) or \
+                    not name.startswith((RUN_PREFIX, TRASH_PREFIX)):
+                continue
+            try:
+                with open(os.path.join(path, OWNER_FILE)) as fp:
+                    owner = json.load(fp)
+            except (OSError, ValueError):
+                owner = {}
+            result.append((path, owner, tree_size(path)))
+        return result
+
+    def usage(self):
+        return sum(size for _, _, size in self.entries())
+
+    def orphaned(self, path, owner, max_age=MAX_AGE):
+        """True for run directories and trash whose process is gone or
+        that are older than max_age. Trash keeps the .owner file of its
+        run directory, so trash another process is still deleting is left
+        alone."""
+        if os.path.basename(path).startswith(TRASH_PREFIX):
+            with self._lock:
+                if path in self._deleting:
+                    return False
+        created = owner.get("created")
+        if created is None:
+            try:
+                created = os.path.getmtime(path)
+            except OSError:
+                return False
+        if time.time() - created > max_age:
+            return True
+        return owner.get("host") == socket.gethostname() and \
+            isinstance(owner.get("pid"), int) and not _alive(owner["pid"])
+
+    def sweep(self, max_age=MAX_AGE):
+        """Removes the directories and trash of crashed runs. Returns the
+        bytes freed."""
+        freed = 0
+        for path, owner, size in self.entries():
+            if self.orphaned(path, owner, max_age):
+                self.log("Removing orphaned scratch dir %s" % path)
+                shutil.rmtree(path, ignore_errors=True)
+                freed += size
+        return freed
+
+    def create(self, needed=0):
+        """Creates a run directory, making sure needed bytes fit in the
+        quota and on the volume"""
+        os.makedirs(self.root, exist_ok=True)
+        self.sweep()
+        if self.quota:
+            used = self.usage()
+            if used + needed > self.quota:
+                self.wait()
+                used = self.usage()
+            if used + needed > self.quota:
+                raise WorkspaceError(
+                    "Scratch quota exceeded in %s: %d MB used, %d MB "
+                    "needed, quota %d MB" % (self.root, used >> 20,
+                                             needed >> 20, self.quota >> 20))
+        free = shutil.disk_usage(self.root).free
+        if needed > free:
+            raise WorkspaceError("Not enough space in %s: %d MB free, %d MB "
+                                 "needed" % (self.root, free >> 20,
+                                             needed >> 20))
+        path = os.path.join(self.root, "%s%d-%s" % (RUN_PREFIX, os.getpid(),
+                                                    uuid.uuid4().hex[:8]))
+        os.makedirs(path)
+        with open(os.path.join(path, OWNER_FILE), "w") as fp:
+            json.dump({"pid": os.getpid(), "host": socket.gethostname(),
+                       "created": time.time()}, fp)
+        return path
+
+    def release(self, path, background=True):
+        """Deletes a run directory; in the background it is renamed to
+        trash first so it is gone from the run's point of view at once"""
+        if not os.path.isdir(path):
+            return
+        if not background:
+            shutil.rmtree(path, ignore_errors=True)
+            return
+        trash = os.path.join(self.root, TRASH_PREFIX +
+                             os.path.basename(path)[len(RUN_PREFIX):])
+        os.rename(path, trash)
+        with self._lock:
+            self._deleting.append(trash)
+        # Not a daemon: the interpreter finishes the deletion before exit
+        thread = threading.Thread(target=self._delete, args=(trash,),
+                                  name="scratch-cleanup")
+        thread.start()
+
+    def _delete(self, path):
+        try:
+            shutil.rmtree(path, ignore_errors=True)
+        finally:
+            with self._lock:
+                self._deleting.remove(path)
+
+    def wait(self, timeout=None):
+        """Waits for the background deletions to finish"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if not self._deleting:
+                    return True
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+
+
+def get_manager(root):
+    """Returns the WorkspaceManager of root, shared within the process so
+    every run knows which trash is still being deleted"""
+    root = os.path.abspath(os.path.expanduser(root))
+    with _managers_lock:
+        if root not in _managers:
+            _managers[root] = WorkspaceManager(root)
+        return _managers[root]
+
+
+class Workspace:
+    """One run's scratch directory"""
+
+    def __init__(self, manager, needed=0):
+        self.manager = manager
+        self.needed = needed
+        self._path = None
+
+    @property
+    def path(self):
+        if self._path is None:
+            self._path = self.manager.create(self.needed)
+        return self._path
+
+    def join(self, *parts):
+        return os.path.join(self.path, *parts)
+
+    def release(self, background=True):
+        path, self._path = self._path, None
+        if path:
+            self.manager.release(path, background)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
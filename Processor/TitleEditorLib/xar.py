@@ -0,0 +1,105 @@
+"""
+Minimal reader for xar archives (flat installer packages).
+
+Only the table of contents is parsed up front; single members can then be
+read or streamed straight from the archive without expanding the package.
+"""
+
+import bz2
+import struct
+import zlib
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+from TitleEditorLib.payload import _ChunkReader
+
+XAR_MAGIC = b"xar!"
+XAR_HEADER = struct.Struct(">4sHHQQI")
+
+XarMember = namedtuple("XarMember",
+                       ["name", "offset", "length", "size", "encoding"])
+
+
+class XarError(Exception):
+    """Raised when a package can not be read as a xar archive"""
+
+
+class XarArchive:
+    """Read-only access to the members of a xar archive"""
+
+    def __init__(self, path):
+        self.path = path
+        self.members = {}
+        with open(path, "rb") as fp:
+            header = fp.read(XAR_HEADER.size)
+            if len(header) != XAR_HEADER.size or \
+                    not header.startswith(XAR_MAGIC):
+                raise XarError("%s is not a flat package" % path)
+            (_, header_size, _, toc_length,
+             _, _) = XAR_HEADER.unpack(header)
+            fp.seek(header_size)
+            try:
+                toc = ET.fromstring(zlib.decompress(fp.read(toc_length)))
+            except (zlib.error, ET.ParseError) as err:
+                raise XarError("Unreadable table of contents: %s" % err)
+        self.heap_offset = header_size + toc_length
+        for element in toc.findall("toc/file"):
+            self._add_members(element, "")
+
+    def _add_members(self, element, parent):
+        name = parent + element.findtext("name", "")
+        data = element.find("data")
+        if element.findtext("type") == "file" and data is not None:
+            encoding = data.find("encoding")
+            self.members[name] = XarMember(
+                name,
+                int(data.findtext("offset")),
+                int(data.findtext("length")),
+                int(data.findtext("size")),
+                encoding.get("style") if encoding is not None
+                else "application/octet-stream",
+            )
+        for child in element.findall("file"):
+            self._add_members(child, name + "/")
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def names(self):
+        return list(self.members)
+
+    def _chunks(self, member):
+        if member.encoding == "application/x-gzip":
+            decompressor = zlib.decompressobj()
+        elif member.encoding == "application/x-bzip2":
+            decompressor = bz2.BZ2Decompressor()
+        elif member.encoding == "application/octet-stream":
+            decompressor = None
+        else:
+            raise XarError("Unsupported encoding %s for %s"
+                           % (member.encoding, member.name))
+        with open(self.path, "rb") as fp:
+            fp.seek(self.heap_offset + member.offset)
+            remaining = member.length
+            while remaining > 0:
+                data = fp.read(min(remaining, 1024 * 1024))
+                if not data:
+                    raise XarError("Truncated member %s" % member.name)
+                remaining -= len(data)
+                yield decompressor.decompress(data) if decompressor else data
+        if hasattr(decompressor, "flush"):
+            yield decompressor.flush()
+
+    def _member(self, name):
+        try:
+            return self.members[name]
+        except KeyError:
+            raise XarError("%s not found in %s" % (name, self.path))
+
+    def open(self, name):
+        """Returns a readable stream of the uncompressed member"""
+        return _ChunkReader(self._chunks(self._member(name)))
+
+    def read(self, name):
+        """Returns the uncompressed data of a member"""
+        return b"".join(self._chunks(self._member(name)))
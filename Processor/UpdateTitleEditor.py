@@ -1,14 +1,19 @@
 #!/usr/local/autopkg/python
 
+import http.client
 import os
 import plistlib
-import shutil
+import sys
+import tempfile
+import threading
 import xml
+import zlib
 import subprocess
 import json
 import re
+import time
 from collections import namedtuple
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 
 from base64 import b64encode
@@ -16,6 +21,42 @@ from autopkglib import ProcessorError
 from autopkglib.FlatPkgUnpacker import FlatPkgUnpacker
 from autopkglib.PkgPayloadUnpacker import PkgPayloadUnpacker
 
+# to use a base module in AutoPkg we need to add this path to the sys.path.
+# this violates flake8 E402 (PEP8 imports) but is unavoidable, so the following
+# imports require noqa comments for E402
+sys.path.insert(0, os.path.dirname(__file__))
+
+from TitleEditorLib import api  # noqa: E402
+from TitleEditorLib.client import TitleEditorClient, TitleEditorError  # noqa: E402
+from TitleEditorLib.extract import payload_names  # noqa: E402
+from TitleEditorLib.outbox import Outbox  # noqa: E402
+from TitleEditorLib.metadata_cache import (  # noqa: E402
+    DEFAULT_MAX_ENTRIES,
+    AppMetadata,
+    MetadataCache,
+    package_key,
+)
+from TitleEditorLib.patch import build_patch, select_version  # noqa: E402
+from SharedLib.paths import title_editor_cache_root as cache_root  # noqa: E402
+from TitleEditorLib.payload import (  # noqa: E402
+    PayloadApp,
+    PayloadError,
+    collect_apps,
+    find_apps,
+    search_payloads,
+)
+from TitleEditorLib.pkginfo import (  # noqa: E402
+    PackageInfoApp,
+    PackageInfoError,
+    find_package_apps,
+    sort_payloads,
+)
+from TitleEditorLib.title_state import TitleStateStore  # noqa: E402
+from SharedLib.token_cache import TokenCache  # noqa: E402
+from TitleEditorLib.trace import Tracer, default_attrs  # noqa: E402
+from TitleEditorLib.workspace import WorkspaceError, get_manager  # noqa: E402
+from TitleEditorLib.xar import XarArchive, XarError  # noqa: E402
+
 """
 Based off of NotifyPatchServer.py - \
 https://github.com/autopkg/lrz-recipes/blob/main/SharedProcessors/NotifyPatchServer.py
@@ -35,13 +76,18 @@ Set Title Editor URL
 
 __all__ = ["UpdateTitleEditor"]
 
+# Info.plist keys genPatchVersion reads, kept in the metadata cache
+CACHED_PLIST_KEYS = ("CFBundleIdentifier", "CFBundleName",
+                     "CFBundleShortVersionString", "CFBundleVersion",
+                     "LSMinimumSystemVersion")
+
 
 class UpdateTitleEditor(PkgPayloadUnpacker, FlatPkgUnpacker):
     """
     This is a Post-Processor for AutoPkg.
-    It unpacks the newly generated Package, searches for an App-Bundle and \
-    extracts all Information needed forupdating Title Editor. The unpacked \
-    data will be removed from disk afterwards.
+    It unpacks the newly generated Package, streams its Payload to find an \
+    App-Bundle and extracts all Information needed forupdating Title Editor. \
+    The unpacked data will be removed from disk afterwards.
     """
 
     description = __doc__
@@ -68,13 +114,83 @@ class UpdateTitleEditor(PkgPayloadUnpacker, FlatPkgUnpacker):
             "required": False,
             "description": "plist file"
         },
+        "package_info_fast_path": {
+            "required": False,
+            "description": "Read bundle id and version from the package's \
+            PackageInfo and Bom and only fall back to the Payload when they \
+            can't answer. The minimum OS then comes from the Distribution \
+            (or defaults to 10.9) as the App's Info.plist is not read."
+        },
+        "metadata_cache_size": {
+            "required": False,
+            "description": "Number of packages to remember the extracted \
+            App metadata for, keyed by the package's SHA-256. Set to 0 to \
+            disable the cache.",
+            "default": str(DEFAULT_MAX_ENTRIES),
+        },
+        "title_state_ttl": {
+            "required": False,
+            "description": "Seconds the locally stored state of the title \
+            (currentVersion and patch versions) is trusted before it is \
+            read from Title Editor again. 0 reads it on every run.",
+            "default": "0",
+        },
+        "payload_search_workers": {
+            "required": False,
+            "description": "Number of sub-package Payloads searched at the \
+            same time when a package has no top-level Payload.",
+            "default": "4",
+        },
+        "scratch_dir": {
+            "required": False,
+            "description": "Folder the package is unpacked in, e.g. on a \
+            fast volume. Each run gets its own subfolder, deleted in the \
+            background when the run ends, failed or not. Defaults to \
+            scratch in the TitleEditor cache folder.",
+        },
+        "scratch_quota_mb": {
+            "required": False,
+            "description": "Disk space in MB all runs may use in \
+            scratch_dir together. 0 is unlimited.",
+            "default": "0",
+        },
+        "outbox": {
+            "required": False,
+            "description": "'queue' writes the update to the local outbox \
+            and returns without contacting Title Editor; deliver it with \
+            python3 -m TitleEditorLib outbox flush. 'flush' queues it and \
+            then delivers the outbox for up to outbox_flush_seconds, \
+            leaving what fails queued instead of failing the recipe. \
+            Empty (the default) sends the update directly.",
+        },
+        "outbox_flush_seconds": {
+            "required": False,
+            "description": "Time the 'flush' outbox mode spends delivering.",
+            "default": "30",
+        },
+        "trace_file": {
+            "required": False,
+            "description": "JSONL file the timing spans of each run are \
+            appended to. Defaults to trace.jsonl in the TitleEditor cache \
+            folder, 'none' disables it. Summarize with python3 -m \
+            TitleEditorLib trace-summary.",
+        },
         "debug": {
             "required": False,
             "description": "Flag to enable debugging - run with --key debug=true"
         },        
         "title_id": {
-            "required": True,
-            "description": "Title Editor Numeric ID"
+            "required": False,
+            "description": "Title Editor Numeric ID. Required unless \
+            title_ids is set."
+        },
+        "title_ids": {
+            "required": False,
+            "description": "Dictionary of bundle id -> Title Editor \
+            Numeric ID, to update a title for each of several Apps in one \
+            package (e.g. Office). The package is read once. The version of \
+            each title is read from the App's pkg_vers_key (default \
+            CFBundleShortVersionString) unless forcevers is set."
         }
     }
 
@@ -90,81 +206,175 @@ class UpdateTitleEditor(PkgPayloadUnpacker, FlatPkgUnpacker):
             },
         "title_updated": {
             "description": "true if title def was updated",
+            },
+        "titles_updated": {
+            "description": "With title_ids, the ids of the titles that were \
+            updated.",
+            },
+        "title_queued": {
+            "description": "true if the update was written to the outbox.",
             }
     }
 
     # Required for FlatPkgUnpacker
     source_path = None
-    # Remove these directories after processing
-    cleanupDirs = []
 
     title_updated = False
 
+    # Log messages of the prefetch worker running on this thread
+    _worker_log = threading.local()
+
+    def package_info_app(self):
+        """Returns the App-Bundle listed in PackageInfo/Bom if that is all
+        genPatchVersion needs, None otherwise"""
+        if not self.env.get("package_info_fast_path") or \
+                self.env.get("app_plist_path"):
+            return None
+        try:
+            with self.tracer().span("package_info"):
+                pattern, matches = find_package_apps(self.env["pkg_path"])
+        except PackageInfoError as err:
+            self.output("Can't use PackageInfo: %s" % err)
+            return None
+        self.debug_log("PackageInfo matches for %s" % pattern,
+                       [match.path for match in matches])
+        if len(matches) != 1:
+            return None
+        vers_key = self.env.get("pkg_vers_key")
+        if vers_key and not self.env.get("forcevers") and \
+                vers_key not in matches[0].info_plist:
+            self.output("%s is not in PackageInfo" % vers_key)
+            return None
+        self.output("Found %s in PackageInfo" % matches[0].path)
+        return matches[0]
+
     def unpack(self):
-        """Unpacks the Package file using other Processors"""
+        """Finds the App-Bundle in the package's Payloads, streamed
+        straight from the package if it can be read as a xar archive and
+        from the package expanded by pkgutil otherwise"""
+        archive = self.package_archive()
+        if archive is not None:
+            try:
+                with self.tracer().span("payload_extraction") as span:
+                    matches, app_glob_path = self.search_archive(archive,
+                                                                 span)
+                return self.single_app(matches, app_glob_path)
+            except (XarError, zlib.error) as err:
+                self.output("Unable to stream from '%s' (%s), expanding it"
+                            % (self.env["pkg_path"], err))
+        self.unpack_package()
+        with self.tracer().span("payload_extraction") as span:
+            # If there is a payload already, unpack it
+            if os.path.isfile(self.env["pkg_payload_path"]):
+                span["bytes"] = os.path.getsize(self.env["pkg_payload_path"])
+                matches, app_glob_path = self.find_app()
+            else:
+                # Sometimes there is no Payload, so we have to find the .pkg
+                # which contains it.
+                payload_paths = self.sub_payloads()
+                span["bytes"] = sum(os.path.getsize(path)
+                                    for path in payload_paths)
+                matches, app_glob_path = self.search_sub_payloads(
+                    payload_paths)
+        return self.single_app(matches, app_glob_path)
+
+    def single_app(self, matches, app_glob_path):
+        """Returns the only App-Bundle found by globbing app_glob_path"""
+        if len(matches) == 0:
+            raise ProcessorError("No match found by globbing %s" %
+                                 app_glob_path)
+        elif len(matches) > 1:
+            raise ProcessorError("Multiple matches found by globbing %s" %
+                                 app_glob_path)
+        else:
+            if isinstance(matches[0], PayloadApp):
+                self.output("Found %s" % matches[0].path)
+            else:
+                self.output("Found %s" % matches[0])
+            return matches[0]
+
+    def package_archive(self):
+        """Returns the package as a XarArchive, or None if it has to be
+        expanded by pkgutil"""
+        try:
+            return XarArchive(self.env["pkg_path"])
+        except (OSError, XarError) as err:
+            self.output("Can't read '%s' as a xar archive (%s), expanding it"
+                        % (self.env["pkg_path"], err))
+            return None
+
+    def search_archive(self, archive, span):
+        """Streams the Payloads straight from the package, most likely one
+        first, and stops as soon as one holds the App-Bundle. Payloads
+        that can't be streamed are unpacked from the expanded package."""
+        names, likely = payload_names(archive)
+        if not names:
+            raise ProcessorError("No Payload found in %s"
+                                 % self.env["pkg_path"])
+        span["bytes"] = sum(archive.members[name].size for name in names)
+        workers = int(self.env.get("payload_search_workers", 4))
+        self.output("Searching %d Payloads in '%s'"
+                    % (len(names), self.env["pkg_path"]))
+        index, pattern, matches, errors = search_payloads(
+            [lambda name=name: archive.open(name) for name in names],
+            workers, likely=likely)
+        if matches:
+            return matches, os.path.join(self.env["pkg_path"], names[index],
+                                         pattern)
+        app_glob_path = os.path.join(self.env["pkg_path"], pattern)
+        for index in sorted(errors):
+            self.output("Unable to stream Payload (%s), unpacking it"
+                        % errors[index])
+            self.env["pkg_payload_path"] = self.expanded_payload(names[index])
+            matches, app_glob_path = self.unpack_app()
+            if len(matches) > 0:
+                break
+        return matches, app_glob_path
+
+    def expanded_payload(self, name):
+        """Returns the path of the Payload name in the package expanded by
+        pkgutil, expanding it on the first call"""
+        if getattr(self, "expanded_path", None) is None:
+            self.unpack_package()
+            self.expanded_path = self.env["destination_path"]
+        return os.path.join(self.expanded_path, name)
+
+    def unpack_package(self):
+        """Expands the flat package, leaving its Payloads on disk"""
         # Emulate FlatPkgUnpacker/main-method
         self.env["destination_path"] = \
-            os.path.join(self.env["RECIPE_CACHE_DIR"], "UnpackedPackage")
-        self.cleanupDirs.append(self.env["destination_path"])
+            self.scratch_dir("UnpackedPackage")
         self.output("Unpacking '%s' to '%s'" % (self.env["pkg_path"],
                     self.env["destination_path"]))
         self.source_path = self.env["pkg_path"]
-        self.unpack_flat_pkg()
+        with self.tracer().span("unpack_flat_pkg",
+                                bytes=os.path.getsize(self.source_path)):
+            self.unpack_flat_pkg()
         # Emulate PkgPayloadUnpacker/main-method
         self.env["pkg_payload_path"] = \
             os.path.join(self.env["destination_path"], "Payload")
-        # If there is a payload already, unpack it
-        if os.path.isfile(self.env["pkg_payload_path"]):
-            matches, app_glob_path = self.find_app()
-        else:
-            # Sometimes there is no Payload, so we have to find the .pkg which
-            # contains it.
-            pkgs = os.path.join(self.env["destination_path"], "*.pkg",
-                                "Payload")
-            payloadmatches = glob(pkgs)
-            if len(payloadmatches) == 0:
-                ProcessorError("No Subpackage found by globbing %s" % pkgs)
-            else:
-                for payloadmatch in payloadmatches:
-                    self.env["pkg_payload_path"] = payloadmatch
-                    matches, app_glob_path = self.find_app()
-                    if len(matches) > 0:
-                        break
-        if len(matches) == 0:
-            ProcessorError("No match found by globbing %s" % app_glob_path)
-        elif len(matches) > 1:
-            ProcessorError("Multiple matches found by globbing %s" %
-                           app_glob_path)
-        else:
-            self.output("Found %s" % matches[0])
-            return matches[0]
 
-    def genPatchVersion(self, app_path):
+    def sub_payloads(self):
+        """Returns the Payloads of the component packages of an expanded
+        product package"""
+        pkgs = os.path.join(self.env["destination_path"], "*.pkg", "Payload")
+        payloadmatches = glob(pkgs)
+        if len(payloadmatches) == 0:
+            raise ProcessorError("No Subpackage found by globbing %s" % pkgs)
+        return payloadmatches
+
+    def genPatchVersion(self, app):
         """Generates a PatchVersion based on the current AppBundle"""
         # Extract the Filename and open the Info.plist
         patch_title_id = self.env["title_id"]
         if self.env.get("app_plist_path"):
-            app_path = self.env["app_plist_path"]
-        filename = os.path.basename(app_path.rstrip("/"))
-        info_plist_path = os.path.join(app_path, "Contents", "Info.plist")
-        # Try to extract data to an hashtable
-        try:
-            with open(info_plist_path, 'rb') as fp:
-                info_plist = plistlib.load(fp)
-        except EnvironmentError as err:
-            print('ERROR: {}'.format(err))
-            raise SystemExit(1)
-        except xml.parsers.expat.ExpatError:
-            info_plist = self.read_binary_plist(info_plist_path)
+            app = self.env["app_plist_path"]
+        if not isinstance(app, AppMetadata):
+            app = self.read_app(app)
+        filename = os.path.basename(app.path.rstrip("/"))
+        info_plist = app.info_plist
 
-        if self.env.get("forcevers"):
-            pkgversion = self.env["forcevers"]
-        elif self.env.get("pkg_vers_key"):
-            pkgversion = info_plist[self.env["pkg_vers_key"]]
-        else:
-            pkgversion = self.env["version"]
-
-        useVer = pkgversion
+        useVer = select_version(info_plist, self.env)
         """ Grab name (with spaces) and id (without spaces) + bundleId
             and Version from Info.plist"""
         name = filename.replace('.app', '')
@@ -176,40 +386,9 @@ class UpdateTitleEditor(PkgPayloadUnpacker, FlatPkgUnpacker):
         except KeyError:
             patch_id = name.replace(' ', '')
         patch_id = self.env["title_id"]
-        bundle_id = info_plist["CFBundleIdentifier"]
 
-        # If a minimumOperatingSystem is set, use that
-        try:
-            min_os = info_plist["LSMinimumSystemVersion"]
-        except KeyError:
-            min_os = "10.9"
-
-        # get timestamps
-        timestamp = datetime.utcfromtimestamp(
-            os.path.getmtime(app_path)).strftime("%Y-%m-%dT%H:%M:%SZ")
-
-        # generate patchData
-        patch = json.dumps(
-            {"patchId": 0, "softwareTitleId": patch_id,
-             "absoluteOrderId": 0, "version": useVer,
-             "releaseDate": timestamp, "standalone": True,
-             "minimumOperatingSystem": min_os, "reboot": False,
-             "killApps": [{"bundleId": bundle_id,
-                           "appName": filename}],
-             "components": [{"name": name, "version": useVer,
-                            "criteria": [{"name": "Application Bundle ID",
-                                          "operator": "is", "value": bundle_id,
-                                          "type": "recon", "and": True},
-                                         {"name": "Application Version",
-                                          "operator": "is", "value": useVer,
-                                          "type": "recon"}]}],
-             "capabilities": [{"name": "Operating System Version",
-                               "operator": "greater than or equal",
-                               "value": min_os, "type": "recon"}],
-             "dependencies": []})
+        patch, verJson = build_patch(patch_id, app, useVer)
         self.env['patchJson'] = patch
-        verJson = json.dumps({"currentVersion": useVer,
-                              "softwareTitleId": patch_id})
         self.env['verJson'] = verJson
 
         return patch_id, patch, verJson
@@ -228,23 +407,42 @@ class UpdateTitleEditor(PkgPayloadUnpacker, FlatPkgUnpacker):
         enc_creds = str(enc_creds_bytes, "utf-8")
         return enc_creds
 
-    def get_api_token(self, jamf_url, enc_creds):
-        """get a token for the Jamf Pro API or
-           Classic API for Jamf Pro 10.35+"""
+    def token_cache(self):
+        return TokenCache(os.path.join(cache_root(self.env), "tokens.json"))
+
+    def title_client(self):
+        """Returns the TitleEditorClient for TITLE_URL, created once"""
+        if getattr(self, "client", None):
+            return self.client
         if self.env.get("TITLE_URL"):
-            jamf_url = self.env.get("TITLE_URL")
+            my_url = self.env.get("TITLE_URL")
         else:
             self.output("Title URL is not in prefs")
             raise ProcessorError("No Title Editor URL supplied")
-        url = jamf_url + "/v2/auth/tokens"
-        r, httpcode = self.curl(request="POST", url=url, enc_creds=enc_creds)
-        try:
-            token = str(r["token"])
-            expires = str(r["expires"])
 
-            return token
-        except KeyError:
-            self.output("ERROR: No token received")
+        if self.env.get("TITLE_USER") and self.env.get("TITLE_PASS"):
+            username = self.env.get("TITLE_USER")
+            password = self.env.get("TITLE_PASS")
+        else:
+            self.output("Title User and Pass are not in prefs")
+            raise ProcessorError("No Title Editor Auth info supplied")
+
+        self.client = TitleEditorClient(my_url, username, password,
+                                        token_cache=self.token_cache(),
+                                        log=self.log,
+                                        tracer=self.tracer())
+        return self.client
+
+    def get_api_token(self, jamf_url=None, enc_creds=None, use_cache=True):
+        """get a token for the Jamf Pro API or
+           Classic API for Jamf Pro 10.35+
+           Tokens are reused from the token cache until shortly before
+           they expire."""
+        try:
+            return self.title_client().get_token(use_cache)
+        except TitleEditorError as err:
+            self.output("ERROR: %s" % err)
+            return None
 
     def curl(
             self,
@@ -255,112 +453,570 @@ class UpdateTitleEditor(PkgPayloadUnpacker, FlatPkgUnpacker):
             data="",
             additional_headers="",
             ):
-        """ Setup the curl command """
-        if url:
-            curl_cmd = [
-                "/usr/bin/curl",
-                "--silent",
-                "--show-error",
-                url
-            ]
-            curl_cmd.extend(["--header", "Content-Type: application/json"])
-            curl_cmd.extend(["-w", "\n%{http_code}"])
-        else:
+        """Sends a request to Title Editor over a pooled keep-alive
+        connection. Returns the decoded JSON body and the HTTP status."""
+        if not url:
             raise ProcessorError("No URL supplied")
 
-        if request:
-            curl_cmd.extend(["--request", request])
-
+        headers = {"Content-Type": "application/json"}
         if enc_creds:
-            curl_cmd.extend(["--header", f"Authorization: Basic {enc_creds}"])
+            headers["Authorization"] = f"Basic {enc_creds}"
         elif token:
-            curl_cmd.extend(["--header", f"authorization: Bearer {token}"])
+            headers["Authorization"] = f"Bearer {token}"
+        if additional_headers:
+            headers.update(additional_headers)
 
-        if data:
-            curl_cmd.extend(["--data", data])
+        try:
+            with self.tracer().span("http", method=request) as span:
+                r = api.request(request or ("POST" if data else "GET"), url,
+                                headers=headers, data=data or None)
+                span["status"] = r.status
+        except (OSError, http.client.HTTPException, ValueError) as err:
+            raise ProcessorError("Request to %s failed: %s" % (url, err))
+        self.debug_log("HTTP %s %s" % (request, url), r.status)
 
-        proc = subprocess.Popen(curl_cmd, stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
-        (out, err) = proc.communicate()
+        return r.data, r.status
 
-        length = len(out.decode())
-        httpcode = int(out.decode()[-3:])
+    def title_state_store(self):
+        return TitleStateStore(os.path.join(cache_root(self.env), "titles"))
 
-        jsonload = out.decode()[0:length - 3]
-        jsonoutput = json.loads(jsonload)
+    def log(self, message, emit=None):
+        """Outputs message, or on a prefetch worker keeps it until the main
+        thread collects the worker's result"""
+        emit = emit or self.output
+        messages = getattr(self._worker_log, "messages", None)
+        if messages is None:
+            emit(message)
+        else:
+            messages.append((emit, message))
 
-        return jsonoutput, httpcode
+    def on_worker(self, messages, func, *args):
+        """Runs func on a prefetch worker, logging to messages"""
+        self._worker_log.messages = messages
+        try:
+            return func(*args)
+        finally:
+            self._worker_log.messages = None
 
-    def notifyServer(self, id, patchData, currentData):
-        if self.env.get("TITLE_URL"):
-            my_url = self.env.get("TITLE_URL")
-        else:
-            self.output("Title URL is not in prefs")
-            raise ProcessorError("No Title Editor URL supplied")
+    @staticmethod
+    def emit_messages(messages):
+        while messages:
+            emit, message = messages.pop(0)
+            emit(message)
 
-        if self.env.get("TITLE_USER") and self.env.get("TITLE_PASS"):
-            username = self.env.get("TITLE_USER")
-            password = self.env.get("TITLE_PASS")
-        else:
-            self.output("Title User and Pass are not in prefs")
-            raise ProcessorError("No Title Editor Auth info supplied")
+    def prefetch_title_states(self, title_ids):
+        """
+        Starts the token fetch and the title state reads on worker threads,
+        so they overlap with reading the package. title_state() picks up
+        the results and join_prefetch() waits for the rest. Nothing is
+        started if Title Editor isn't configured; notifyServer() reports
+        that.
+        """
+        try:
+            client = self.title_client()
+        except ProcessorError:
+            return
+        self.prefetch_executor = ThreadPoolExecutor(
+            min(4, len(title_ids) + 1), thread_name_prefix="title-editor")
+        self.prefetch_token_messages = []
+        token = self.prefetch_executor.submit(
+            self.on_worker, self.prefetch_token_messages, client.get_token)
 
-        enc_creds = self.get_enc_creds(username, password)
-        authtoken = self.get_api_token(my_url, enc_creds)
-        version = self.env["version"]
-        title = self.env.get("NAME")
+        def fetch(title_id):
+            try:
+                token.result()
+            except TitleEditorError:
+                # title_state() asks for a token again and reports it
+                pass
+            return self.fetch_title_state(title_id)
 
+        self.prefetched = {}
+        for title_id in title_ids:
+            messages = []
+            self.prefetched[str(title_id)] = (self.prefetch_executor.submit(
+                self.on_worker, messages, fetch, title_id), messages)
+
+    def join_prefetch(self):
+        """Waits for the prefetch workers and outputs what they logged"""
+        executor = getattr(self, "prefetch_executor", None)
+        if executor is None:
+            return
+        executor.shutdown(wait=True)
+        self.prefetch_executor = None
+        self.emit_messages(self.prefetch_token_messages)
+        for future, messages in self.prefetched.values():
+            self.emit_messages(messages)
+        self.prefetched = {}
+
+    def title_state(self, id):
+        """Returns the title's TitleState, from the local snapshot while it
+        is fresh. None if Title Editor can't tell."""
+        prefetched = getattr(self, "prefetched", {}).pop(str(id), None)
+        if prefetched is not None:
+            future, messages = prefetched
+            try:
+                return future.result()
+            finally:
+                self.emit_messages(self.prefetch_token_messages)
+                self.emit_messages(messages)
+        return self.fetch_title_state(id)
+
+    def fetch_title_state(self, id):
+        store = self.title_state_store()
+        ttl = int(self.env.get("title_state_ttl", 0))
+        if ttl > 0:
+            state = store.get(id, ttl)
+            if state:
+                self.log("Using stored state of title %s" % id)
+                return state
+        try:
+            state = self.title_client().title_state(id)
+        except TitleEditorError as err:
+            self.log("Can't read title %s, skipping pre-flight: %s"
+                     % (id, err))
+            return None
+        self.debug_log("Title %s currentVersion" % id, state.current_version)
+        store.put(state)
+        return state
+
+    def notifyServer(self, id, patchData, currentData, name=None):
         """Sends the new PatchVersion to a PatchServer"""
+        title = name or self.env.get("NAME")
+        version = json.loads(currentData)["currentVersion"]
+        if self.env.get("outbox"):
+            self.queue_update(id, version, patchData, currentData, title)
+            return
+        client = self.title_client()
+        state = self.title_state(id)
+        try:
+            self.title_updated = client.update_title(
+                id, patchData, currentData, version, state, title)
+        except TitleEditorError as err:
+            raise ProcessorError(str(err))
+        self.title_state_store().updated(id, version)
 
-        # Build url for the Patchtitle
-        patchUrl = "%s/v2/softwaretitles/%s/patches" % (my_url, id)
-        # Fire Request
-        headers = {"Accept": "application/json"}
-        r, httpcode = self.curl(request="POST", url=patchUrl,
-                                additional_headers=headers,
-                                token=authtoken, data=patchData)
-        if httpcode in (200, 201):
-            self.output("New version - setting currentVersion")
-            versionUrl = "%s/v2/softwaretitles/%s" % (my_url, id)
-            r, verhttpcode = self.curl(request="PUT", url=versionUrl,
-                                       data=currentData, token=authtoken)
-            # Get errors if any
-            if verhttpcode not in (200, 201):
-                raise ProcessorError("Error %s setting version for %s"
-                                     % (verhttpcode, title))
-            else:
-                self.title_updated = True
-        elif httpcode == 400:
-            errData = r["errors"][0]["code"]
-            if errData == 'DUPLICATE_RECORD':
-                self.output("%s was already at this version" % title)
-            else:
-                raise ProcessorError("Error %s sending Patch-Data for %s: %s"
-                                     % (httpcode, title, errData))
-        else:
-            raise ProcessorError("Error %s sending Patch-Data for %s: %s"
-                                 % (httpcode, title, r))
-        
         self.env["title_updated"] = self.title_updated
 
+    def outbox(self):
+        return Outbox(os.path.join(cache_root(self.env), "outbox.sqlite"))
+
+    def queue_update(self, id, version, patchData, currentData, name=None):
+        """Writes the update to the outbox instead of sending it"""
+        outbox = self.outbox()
+        try:
+            if outbox.enqueue(id, version, patchData, currentData, name):
+                self.output("Queued version %s of title %s" % (version, id))
+            else:
+                self.output("Version %s of title %s is already queued"
+                            % (version, id))
+        finally:
+            outbox.close()
+        self.title_updated = False
+        self.env["title_queued"] = True
+        self.env["title_updated"] = False
+
+    def flush_outbox(self):
+        """Delivers the outbox for up to outbox_flush_seconds. Failures
+        stay queued and are only reported."""
+        try:
+            client = self.title_client()
+        except ProcessorError as err:
+            self.output("Not flushing the outbox: %s" % err)
+            return
+        deadline = time.monotonic() + \
+            float(self.env.get("outbox_flush_seconds", 30))
+        outbox = self.outbox()
+        try:
+            results = outbox.flush(client, deadline=deadline)
+        finally:
+            outbox.close()
+        ours = set((self.title_ids() or
+                    {"": str(self.env.get("title_id"))}).values())
+        for result in results:
+            update = result.update
+            self.output("Outbox: title %s version %s %s%s" % (
+                update.title_id, update.version, result.status,
+                " (%s)" % result.detail if result.detail else ""))
+            if result.status == "delivered":
+                self.title_state_store().updated(update.title_id,
+                                                 update.version)
+                if result.updated and update.title_id in ours:
+                    self.env["title_updated"] = True
+                    if "titles_updated" in self.env:
+                        self.env["titles_updated"].append(update.title_id)
+
+    def workspace(self):
+        """Returns the Workspace of this run, created once. Its folder is
+        only made when something is unpacked."""
+        if getattr(self, "scratch", None) is None:
+            manager = get_manager(self.env.get("scratch_dir") or
+                                  os.path.join(cache_root(self.env),
+                                               "scratch"))
+            manager.quota = int(self.env.get("scratch_quota_mb", 0)) << 20
+            manager.log = self.output
+            # Room for the expanded package and an unpacked Payload
+            try:
+                needed = 2 * os.path.getsize(self.env["pkg_path"])
+            except (OSError, KeyError):
+                needed = 0
+            self.scratch = manager.workspace(needed)
+        return self.scratch
+
+    def scratch_dir(self, name):
+        """Returns a path in this run's scratch folder"""
+        try:
+            return self.workspace().join(name)
+        except (OSError, WorkspaceError) as err:
+            raise ProcessorError("No scratch folder: %s" % err)
 
     def cleanup(self):
-        """Directory cleanup"""
-        for directory in self.cleanupDirs:
-            if os.path.isdir(directory):
-                shutil.rmtree(directory)
+        """Directory cleanup, in the background"""
+        with self.tracer().span("cleanup"):
+            if getattr(self, "scratch", None) is not None:
+                self.scratch.release()
+
+    def read_app(self, app):
+        """Returns the AppMetadata of an App-Bundle found by unpack()"""
+        if isinstance(app, PackageInfoApp):
+            # App-Bundle described by the package's PackageInfo and Bom
+            return AppMetadata(app.path, app.info_plist, app.mtime)
+        if isinstance(app, PayloadApp):
+            # App-Bundle found while streaming the Payload
+            with self.tracer().span("plist_parse",
+                                    bytes=len(app.info_plist)):
+                info_plist = self.load_plist_data(app.info_plist)
+            return AppMetadata(app.path, info_plist, app.mtime)
+        app_path = app
+        info_plist_path = os.path.join(app_path, "Contents", "Info.plist")
+        # Try to extract data to an hashtable
+        with self.tracer().span("plist_parse"):
+            try:
+                with open(info_plist_path, 'rb') as fp:
+                    info_plist = plistlib.load(fp)
+            except EnvironmentError as err:
+                print('ERROR: {}'.format(err))
+                raise SystemExit(1)
+            except xml.parsers.expat.ExpatError:
+                info_plist = self.read_binary_plist(info_plist_path)
+        return AppMetadata(app_path, info_plist, os.path.getmtime(app_path))
+
+    def metadata_cache(self):
+        """Returns the MetadataCache, or None if it is disabled"""
+        max_entries = int(self.env.get("metadata_cache_size",
+                                       DEFAULT_MAX_ENTRIES))
+        if max_entries <= 0 or self.env.get("app_plist_path"):
+            return None
+        return MetadataCache(os.path.join(cache_root(self.env), "metadata"),
+                             max_entries)
+
+    def metadata_cache_variant(self, bundle_id=None):
+        """Only what was read from the Payload is cached. The Apps of a
+        multi-app package are cached by bundle id."""
+        variant = "payload"
+        if bundle_id:
+            variant += "-" + bundle_id
+        return variant
+
+    def cached_app(self, cache, key, bundle_id=None):
+        """Returns the cached AppMetadata for this package, or None"""
+        app = cache.get(key, self.metadata_cache_variant(bundle_id))
+        if app is None:
+            return None
+        vers_key = self.env.get("pkg_vers_key")
+        if vers_key and not self.env.get("forcevers") and \
+                vers_key not in app.info_plist:
+            return None
+        self.output("Using cached metadata for %s" % app.path)
+        return app
+
+    def cache_app(self, cache, key, app, bundle_id=None):
+        """Stores the Info.plist keys genPatchVersion needs"""
+        keys = CACHED_PLIST_KEYS + (self.env.get("pkg_vers_key", ""),)
+        info_plist = {plist_key: value
+                      for plist_key, value in app.info_plist.items()
+                      if plist_key in keys and isinstance(value, str)}
+        cache.put(key, self.metadata_cache_variant(bundle_id),
+                  AppMetadata(app.path, info_plist, app.mtime))
+
+    def title_ids(self):
+        """Returns the {bundle id: title id} mapping of title_ids, or None
+        if a single title_id is updated"""
+        title_ids = self.env.get("title_ids")
+        if not title_ids:
+            if not self.env.get("title_id"):
+                raise ProcessorError("Either title_id or title_ids is "
+                                     "required")
+            return None
+        if not isinstance(title_ids, dict):
+            raise ProcessorError("title_ids must be a dictionary of bundle "
+                                 "id -> Title Editor Numeric ID")
+        return {str(bundle_id): str(title_id)
+                for bundle_id, title_id in title_ids.items()}
+
+    def package_info_apps(self, bundle_ids):
+        """Returns {bundle id: AppMetadata} from PackageInfo/Bom if they
+        list all bundle_ids and genPatchVersion needs no more, else None"""
+        if not self.env.get("package_info_fast_path"):
+            return None
+        try:
+            with self.tracer().span("package_info"):
+                pattern, matches = find_package_apps(self.env["pkg_path"],
+                                                     all_components=True)
+        except PackageInfoError as err:
+            self.output("Can't use PackageInfo: %s" % err)
+            return None
+        vers_key = self.env.get("pkg_vers_key")
+        apps = {}
+        for match in matches:
+            bundle_id = match.info_plist["CFBundleIdentifier"]
+            if bundle_id in bundle_ids and bundle_id not in apps:
+                apps[bundle_id] = self.read_app(match)
+        if set(apps) != set(bundle_ids):
+            return None
+        if vers_key and not self.env.get("forcevers") and \
+                any(vers_key not in app.info_plist for app in apps.values()):
+            self.output("%s is not in PackageInfo" % vers_key)
+            return None
+        self.output("Found %s in PackageInfo"
+                    % ", ".join(app.path for app in apps.values()))
+        return apps
+
+    def unpack_apps(self, bundle_ids):
+        """
+        Reads the package once and returns {bundle id: AppMetadata} of the
+        App-Bundles with one of bundle_ids. All Payloads are streamed
+        concurrently, straight from the package if it can be read as a xar
+        archive; those that can't be streamed are unpacked.
+        """
+        archive = self.package_archive()
+        found = None
+        if archive is not None:
+            names = sorted(payload_names(archive)[0])
+            if not names:
+                raise ProcessorError("No Payload found in %s"
+                                     % self.env["pkg_path"])
+            try:
+                found = self.collect_payload_apps(
+                    names, archive.open,
+                    lambda name: archive.members[name].size,
+                    self.expanded_payload)
+            except (XarError, zlib.error) as err:
+                self.output("Unable to stream from '%s' (%s), expanding it"
+                            % (self.env["pkg_path"], err))
+        if found is None:
+            self.unpack_package()
+            if os.path.isfile(self.env["pkg_payload_path"]):
+                payload_paths = [self.env["pkg_payload_path"]]
+            else:
+                payload_paths = sorted(self.sub_payloads())
+            found = self.collect_payload_apps(
+                payload_paths, lambda path: open(path, "rb"),
+                os.path.getsize, lambda path: path)
+        apps = {}
+        for app in found:
+            app = self.read_app(app)
+            bundle_id = app.info_plist.get("CFBundleIdentifier")
+            self.debug_log("App %s bundle id" % app.path, bundle_id)
+            if bundle_id in bundle_ids and bundle_id not in apps:
+                self.output("Found %s" % app.path)
+                apps[bundle_id] = app
+        return apps
+
+    def collect_payload_apps(self, payloads, opener, size, payload_path):
+        """Returns the App-Bundles of all payloads, streamed concurrently
+        with opener; those that can't be streamed are unpacked from
+        payload_path(payload)"""
+        workers = int(self.env.get("payload_search_workers", 4))
+        self.output("Searching %d Payloads" % len(payloads))
+        with self.tracer().span("payload_extraction", bytes=sum(
+                size(payload) for payload in payloads)):
+            found, errors = collect_apps(
+                [lambda payload=payload: opener(payload)
+                 for payload in payloads], workers)
+            found = [app for index, app in found]
+            for index in sorted(errors):
+                self.output("Unable to stream Payload (%s), unpacking it"
+                            % errors[index])
+                self.env["pkg_payload_path"] = payload_path(payloads[index])
+                found += self.unpack_app()[0]
+        return found
+
+    def main_titles(self, title_ids):
+        """Updates the title of every App in title_ids from one read of
+        the package"""
+        apps = self.package_info_apps(list(title_ids)) or {}
+        # The package is only hashed when its Payload has to be read
+        cache = None if apps else self.metadata_cache()
+        if cache:
+            key = self.package_key()
+            for bundle_id in title_ids:
+                app = self.cached_app(cache, key, bundle_id)
+                if app:
+                    apps[bundle_id] = app
+        missing = [bundle_id for bundle_id in title_ids
+                   if bundle_id not in apps]
+        if missing:
+            unpacked = self.unpack_apps(missing)
+            for bundle_id, app in unpacked.items():
+                if cache:
+                    self.cache_app(cache, key, app, bundle_id)
+            apps.update(unpacked)
+        missing = [bundle_id for bundle_id in title_ids
+                   if bundle_id not in apps]
+        if missing:
+            raise ProcessorError("No App-Bundle with bundle id %s found in %s"
+                                 % (", ".join(missing), self.env["pkg_path"]))
+
+        updated = []
+        failed = []
+        for bundle_id, title_id in title_ids.items():
+            app = apps[bundle_id]
+            # The recipe's version is the package's, each App has its own
+            env = dict(self.env)
+            env["version"] = app.info_plist.get("CFBundleShortVersionString",
+                                                self.env.get("version"))
+            patchData, verJson = build_patch(
+                title_id, app, select_version(app.info_plist, env))
+            try:
+                self.notifyServer(title_id, patchData, verJson,
+                                  os.path.basename(app.path))
+            except ProcessorError as err:
+                self.output("ERROR: %s" % err)
+                failed.append(title_id)
+                continue
+            if self.title_updated:
+                updated.append(title_id)
+        self.env["titles_updated"] = updated
+        self.env["title_updated"] = bool(updated)
+        if failed:
+            raise ProcessorError("Updating title %s failed"
+                                 % ", ".join(failed))
+
+    def tracer(self):
+        """Returns the Tracer of this run, created once"""
+        if getattr(self, "trace", None) is None:
+            path = self.env.get("trace_file") or \
+                os.path.join(cache_root(self.env), "trace.jsonl")
+            if path.lower() == "none":
+                path = None
+            self.trace = Tracer(path, title_id=self.env.get("title_id"),
+                                recipe=self.env.get("NAME"),
+                                **default_attrs())
+        return self.trace
+
+    def write_trace(self):
+        """Outputs the time spent per phase and appends the spans to the
+        trace file"""
+        tracer = self.tracer()
+        if tracer.spans:
+            self.output(tracer.summary())
+        try:
+            tracer.write()
+        except OSError as err:
+            self.output("Can't write trace to %s: %s" % (tracer.path, err))
+
+    def package_key(self):
+        """Returns the metadata cache key of the package, hashing it"""
+        with self.tracer().span("package_hash") as span:
+            span["bytes"] = os.path.getsize(self.env["pkg_path"])
+            return package_key(self.env["pkg_path"])
 
     def main(self):
-        app_path = self.unpack()
-        patch_id, patchData, verJson = self.genPatchVersion(app_path)
-        self.notifyServer(patch_id, patchData, verJson)
+        try:
+            with self.workspace():
+                self.update_titles()
+        finally:
+            self.join_prefetch()
+            self.write_trace()
+
+    def update_titles(self):
+        """Reads the package (or the metadata cache) and updates the
+        title, or with title_ids every mapped title"""
+        title_ids = self.title_ids()
+        if self.env.get("outbox") not in (None, "", "queue", "flush"):
+            raise ProcessorError("outbox must be 'queue' or 'flush'")
+        if not self.env.get("outbox"):
+            self.prefetch_title_states(list(title_ids.values()) if title_ids
+                                       else [self.env["title_id"]])
+        if title_ids:
+            self.main_titles(title_ids)
+        else:
+            self.update_title()
         self.cleanup()
+        if self.env.get("outbox") == "flush":
+            self.flush_outbox()
+
+    def update_title(self):
+        """Updates title_id from PackageInfo, the metadata cache or the
+        package's Payload. The package is only hashed for the cache when
+        PackageInfo can't answer."""
+        app = self.package_info_app()
+        if app is not None:
+            app = self.read_app(app)
+        else:
+            cache = self.metadata_cache()
+            if cache:
+                key = self.package_key()
+                app = self.cached_app(cache, key)
+            if app is None:
+                app = self.read_app(self.unpack())
+                if cache:
+                    self.cache_app(cache, key, app)
+        patch_id, patchData, verJson = self.genPatchVersion(app)
+        self.notifyServer(patch_id, patchData, verJson)
 
     def find_app(self):
-        """Helper Function to unpack Payloads"""
-        self.env["destination_path"] = os.path.join(self.env["RECIPE_CACHE_DIR"],
-                                                    "UnpackedPayload")
-        self.cleanupDirs.append(self.env["destination_path"])
+        """Helper Function to find the App-Bundle in a Payload"""
+        payload_path = self.env["pkg_payload_path"]
+        self.output("Reading Payload '%s'" % payload_path)
+        try:
+            with open(payload_path, "rb") as fp:
+                pattern, matches = find_apps(fp)
+            return matches, os.path.join(payload_path, pattern)
+        except PayloadError as err:
+            self.output("Unable to stream Payload (%s), unpacking it" % err)
+        return self.unpack_app()
+
+    def component_package_info(self, payload_path):
+        """Returns the PackageInfo next to an expanded sub-package Payload,
+        or None"""
+        try:
+            with open(os.path.join(os.path.dirname(payload_path),
+                                   "PackageInfo"), "rb") as fp:
+                return fp.read()
+        except OSError:
+            return None
+
+    def search_sub_payloads(self, payload_paths):
+        """Streams the sub-package Payloads concurrently, most likely one
+        first, and stops as soon as one holds the App-Bundle. Payloads
+        that can't be streamed are unpacked one by one afterwards."""
+        payload_paths, likely = sort_payloads(
+            payload_paths, self.component_package_info, os.path.getsize)
+        workers = int(self.env.get("payload_search_workers", 4))
+        self.output("Searching %d sub-package Payloads" % len(payload_paths))
+        index, pattern, matches, errors = search_payloads(
+            [lambda path=path: open(path, "rb") for path in payload_paths],
+            workers, likely=likely)
+        if matches:
+            self.env["pkg_payload_path"] = payload_paths[index]
+            return matches, os.path.join(payload_paths[index], pattern)
+        app_glob_path = pattern
+        for index in sorted(errors):
+            self.output("Unable to stream Payload (%s), unpacking it"
+                        % errors[index])
+            self.env["pkg_payload_path"] = payload_paths[index]
+            matches, app_glob_path = self.unpack_app()
+            if len(matches) > 0:
+                break
+        return matches, app_glob_path
+
+    def unpack_app(self):
+        """Helper Function to unpack Payloads. Each Payload gets its own
+        folder, so the glob never sees Apps of one unpacked before."""
+        self.unpacked_payloads = getattr(self, "unpacked_payloads", 0) + 1
+        self.env["destination_path"] = self.scratch_dir(
+            "UnpackedPayload%d" % self.unpacked_payloads)
         self.output("Unpacking Payload to'%s'" % self.env["destination_path"])
         self.unpack_pkg_payload()
         # Find Application in unpacked Payload and return the Path
@@ -375,6 +1031,18 @@ class UpdateTitleEditor(PkgPayloadUnpacker, FlatPkgUnpacker):
             app_glob_path = os.path.join(self.env["destination_path"], "*.app")
             return glob(app_glob_path), app_glob_path
 
+    def load_plist_data(self, data):
+        """Parses Info.plist data read from a Payload"""
+        try:
+            return plistlib.loads(data)
+        except (plistlib.InvalidFileException,
+                xml.parsers.expat.ExpatError):
+            # Let plutil have a go at anything plistlib can't read
+            with tempfile.NamedTemporaryFile(suffix=".plist") as fp:
+                fp.write(data)
+                fp.flush()
+                return self.read_binary_plist(fp.name)
+
     def read_binary_plist(self, plist_path):
         process = subprocess.Popen(
             ['plutil', '-convert', 'json', '-o', '-', plist_path],
@@ -392,7 +1060,7 @@ class UpdateTitleEditor(PkgPayloadUnpacker, FlatPkgUnpacker):
         self.debug_log("Text to desplay after DEBUG - ",variabledata)
         '''
         if self.env.get("debug"):
-            print(("DEBUG - %s is %s") % (message, sub_string))
+            self.log(("DEBUG - %s is %s") % (message, sub_string), print)
 
 if __name__ == "__main__":
     PROCESSOR = UpdateTitleEditor()
@@ -0,0 +1,30 @@
+"""Paths and helpers shared by the tests"""
+
+import importlib.util
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROCESSOR_DIR = os.path.join(ROOT, "Processor")
+BENCHMARKS_DIR = os.path.join(ROOT, "Benchmarks")
+
+for path in (BENCHMARKS_DIR, PROCESSOR_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+def have_module(name):
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ImportError:
+        return False
+
+
+# The processors import AutoPkg (and JamfUploader) modules; run these tests
+# with AutoPkg's Python, e.g. /usr/local/autopkg/python -m unittest
+requires_autopkg = unittest.skipUnless(have_module("autopkglib"),
+                                       "needs AutoPkg's autopkglib")
+requires_jamf_uploader = unittest.skipUnless(
+    have_module("autopkglib") and have_module("JamfUploaderLib"),
+    "needs autopkglib and JamfUploaderLib")
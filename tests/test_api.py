@@ -0,0 +1,133 @@
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import support
+
+from TitleEditorLib import api
+
+if support.have_module("autopkglib"):
+    from UpdateTitleEditor import UpdateTitleEditor
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Answers /status/<code> with a JSON body, as application/json or as
+    text/plain with ?text. /close answers as if the connection stays
+    open, then closes it."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.client_address[1],
+                                     dict(self.headers)))
+        path, _, query = self.path.partition("?")
+        status = int(path.rpartition("/")[2]) if "/status/" in path else 200
+        body = json.dumps({"status": status}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain" if query == "text"
+                         else "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if path == "/close":
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class ServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={"poll_interval": 0.01})
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(api.close_pools)
+        self.url = "http://127.0.0.1:%d" % self.server.server_port
+
+    def get(self, path, headers=None):
+        return api.request("GET", self.url + path, headers=headers)
+
+    def ports(self):
+        return [port for _, port, _ in self.server.requests]
+
+
+class RequestTest(ServerTestCase):
+    def test_connection_is_reused(self):
+        self.get("/status/200")
+        self.get("/status/200")
+        first, second = self.ports()
+        self.assertEqual(first, second)
+        self.assertEqual(len(api.get_pool(self.url)._idle), 1)
+
+    def test_closed_connection_is_retried_once(self):
+        pool = api.get_pool(self.url)
+        # two idle connections the server has closed
+        stale = [pool.new_connection() for _ in range(2)]
+        for connection in stale:
+            connection.request("GET", "/close")
+            connection.getresponse().read()
+        for connection in stale:
+            pool.put(connection)
+        with mock.patch.object(pool, "new_connection",
+                               wraps=pool.new_connection) as new:
+            self.assertEqual(self.get("/status/200").data, {"status": 200})
+        new.assert_called_once_with()
+        self.assertEqual([path for path, _, _ in self.server.requests],
+                         ["/close", "/close", "/status/200"])
+        self.assertEqual(len(set(self.ports())), 3)
+        # only one stale connection was tried, the other is still idle
+        self.assertIn(stale[0], pool._idle)
+
+    def test_fresh_connection_is_not_retried(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with mock.patch.object(api.http.client.HTTPConnection, "request",
+                               side_effect=ConnectionResetError) as sent:
+            with self.assertRaises(ConnectionResetError):
+                self.get("/status/200")
+        self.assertEqual(sent.call_count, 1)
+
+    def test_headers_are_sent(self):
+        self.get("/status/200", {"X-Request-Id": "42"})
+        self.assertEqual(self.server.requests[0][2]["X-Request-Id"], "42")
+
+    def test_json_body_is_decoded(self):
+        for path in ("/status/200", "/status/201", "/status/404",
+                     "/status/500", "/status/500?text"):
+            with self.subTest(path=path):
+                response = self.get(path)
+                status = int(path.split("/")[2].partition("?")[0])
+                self.assertEqual(response.status, status)
+                self.assertEqual(response.data, {"status": status})
+
+
+@support.requires_autopkg
+class CurlTest(ServerTestCase):
+    def test_additional_headers_are_sent(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        processor = UpdateTitleEditor()
+        processor.env = {"CACHE_DIR": tmp, "trace_file": "none"}
+        processor.output = mock.Mock()
+        data, status = processor.curl(
+            url=self.url + "/status/404", token="secret",
+            additional_headers={"Accept": "application/json",
+                                "X-Request-Id": "42"})
+        self.assertEqual((data, status), ({"status": 404}, 404))
+        headers = self.server.requests[0][2]
+        self.assertEqual(headers["Authorization"], "Bearer secret")
+        self.assertEqual(headers["Accept"], "application/json")
+        self.assertEqual(headers["X-Request-Id"], "42")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import support  # noqa: F401
+
+import pkgfixtures
+from TitleEditorLib.backfill import (
+    BackfillState,
+    order_id,
+    run_backfill,
+)
+from TitleEditorLib.title_state import TitleState
+from TitleEditorLib.versions import version_key
+
+
+class VersionKeyTest(unittest.TestCase):
+    def test_order(self):
+        versions = ["1.9b2", "1.10", "1.9", "1.9.1", "2.0", "1.9a1", "10"]
+        self.assertEqual(sorted(versions, key=version_key),
+                         ["1.9a1", "1.9b2", "1.9", "1.9.1", "1.10", "2.0",
+                          "10"])
+
+    def test_order_id(self):
+        existing = ["3.0", "2.0", "1.0"]
+        self.assertEqual(order_id(existing, "4.0"), 0)
+        self.assertEqual(order_id(existing, "2.5"), 1)
+        self.assertEqual(order_id(existing, "0.9"), 3)
+        self.assertEqual(order_id([], "1.0"), 0)
+
+
+class FakeClient:
+    def __init__(self, current_version, patch_versions):
+        self.state = TitleState("12", current_version, list(patch_versions),
+                                0)
+        self.added = []
+        self.current = []
+        self.messages = []
+
+    def log(self, message):
+        self.messages.append(message)
+
+    def title_state(self, title_id):
+        return self.state
+
+    def add_patch(self, title_id, patch, name=None):
+        self.added.append(patch)
+        return True
+
+    def set_current_version(self, title_id, current, name=None):
+        self.current.append(current)
+
+
+class RunBackfillTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.packages = [
+            pkgfixtures.make_package(os.path.join(self.tmp, "%s.pkg"
+                                                  % version), size=2048,
+                                     version=version)
+            for version in ("1.9", "1.10", "1.9.1", "2.0")]
+
+    def test_adds_missing_versions_in_order(self):
+        client = FakeClient("1.9.1", ["1.9.1"])
+        items = run_backfill("12", self.packages, client, extract_workers=2,
+                             batch_size=2)
+        self.assertEqual([(item.version, item.status, item.order_id)
+                          for item in items],
+                         [("2.0", "added", 0), ("1.10", "added", 1),
+                          ("1.9.1", "exists", 0), ("1.9", "added", 3)])
+        self.assertEqual(len(client.added), 3)
+        self.assertIn('"2.0"', client.current[0])
+
+    def test_dry_run_sends_nothing(self):
+        items = run_backfill("12", self.packages, None, extract_workers=1,
+                             dry_run=True)
+        self.assertEqual([(item.version, item.order_id) for item in items],
+                         [("2.0", 0), ("1.10", 1), ("1.9.1", 2),
+                          ("1.9", 3)])
+
+    def test_state_skips_unchanged_packages(self):
+        path = os.path.join(self.tmp, "state", "12.json")
+        run_backfill("12", self.packages, None, extract_workers=1,
+                     state=BackfillState(path).load(), dry_run=True)
+        self.assertEqual(len(BackfillState(path).load().packages), 4)
+
+        # same size and mtime, but no longer readable
+        stat = os.stat(self.packages[0])
+        with open(self.packages[0], "r+b") as fp:
+            fp.write(b"not a xar")
+        os.utime(self.packages[0], (stat.st_atime, stat.st_mtime))
+        items = run_backfill("12", self.packages, None, extract_workers=1,
+                             state=BackfillState(path).load(), dry_run=True)
+        self.assertEqual([item.status for item in items], ["planned"] * 4)
+
+if __name__ == "__main__":
+    unittest.main()
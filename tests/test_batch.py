@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import support  # noqa: F401
+
+import pkgfixtures
+from TitleEditorLib.batch import BatchJob, extract_metadata
+
+
+class ExtractMetadataTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.pkg_path = pkgfixtures.make_package(
+            os.path.join(self.tmp, "Sample.pkg"), size=2048, version="5.1")
+
+    def test_fast_path_does_not_hash(self):
+        job = BatchJob(self.pkg_path, "3", {"package_info_fast_path": True})
+        with mock.patch("TitleEditorLib.batch.package_key",
+                        side_effect=AssertionError("hashed")):
+            app, version = extract_metadata(job, self.tmp)
+        self.assertEqual(version, "5.1")
+
+    def test_payload_answers_are_cached(self):
+        job = BatchJob(self.pkg_path, "3", {"version": "5.1-1"})
+        app, version = extract_metadata(job, self.tmp)
+        self.assertEqual(version, "5.1-1")
+        with mock.patch("TitleEditorLib.batch.extract_app",
+                        side_effect=AssertionError("extracted")):
+            cached, version = extract_metadata(job, self.tmp)
+        self.assertEqual(cached.info_plist["CFBundleIdentifier"],
+                         "com.example.sample")
+
+    def test_pkg_vers_key(self):
+        job = BatchJob(self.pkg_path, "3", {"pkg_vers_key": "CFBundleVersion",
+                                            "package_info_fast_path": True})
+        self.assertEqual(extract_metadata(job)[1], "51")
+
+
+if __name__ == "__main__":
+    unittest.main()
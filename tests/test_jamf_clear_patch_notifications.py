@@ -0,0 +1,231 @@
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import support
+
+if support.have_module("autopkglib"):
+    import JamfClearPatchNotifications
+    from autopkglib import ProcessorError
+
+JSS_URL = "https://jamf.example.com"
+
+NOTIFICATIONS = [
+    {"id": 1, "type": "PATCH_UPDATE",
+     "params": {"softwareTitleName": "Firefox", "latestVersion": "124.0"}},
+    {"id": 2, "type": "OTHER",
+     "params": {"softwareTitleName": "Zoom", "latestVersion": "6.0"}},
+    {"id": 3, "type": "PATCH_UPDATE",
+     "params": {"softwareTitleName": "Zoom", "latestVersion": "6.0"}},
+    {"id": 4, "type": "PATCH_UPDATE",
+     "params": {"softwareTitleName": "Slack", "latestVersion": "4.36"}},
+]
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = json.dumps(body).encode() if body is not None else b""
+
+    def json(self):
+        return json.loads(self.body)
+
+    def iter_content(self, chunk_size):
+        for offset in range(0, len(self.body), chunk_size):
+            yield self.body[offset:offset + chunk_size]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FakeSession:
+    """Answers like Jamf Pro; DELETEs of the ids in failing get a 500"""
+
+    def __init__(self, notifications=NOTIFICATIONS, failing=()):
+        self.notifications = notifications
+        self.failing = set(failing)
+        self.tokens = 0
+        self.deleted = []
+
+    def post(self, url, auth, headers, timeout):
+        self.tokens += 1
+        return FakeResponse(200, {"token": "token%d" % self.tokens,
+                                  "expires": "2099-01-01T00:00:00.000Z"})
+
+    def request(self, method, url, headers, timeout, stream):
+        if method == "GET":
+            return FakeResponse(200, self.notifications)
+        notification_id = url.rpartition("/")[2]
+        if notification_id in self.failing:
+            return FakeResponse(500)
+        self.deleted.append(notification_id)
+        return FakeResponse(204)
+
+
+class ClearTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def processor(self, **env):
+        processor = JamfClearPatchNotifications.JamfClearPatchNotifications()
+        processor.env = dict({"JSS_URL": JSS_URL, "API_USERNAME": "api",
+                              "API_PASSWORD": "secret",
+                              "CACHE_DIR": self.tmp}, **env)
+        processor.output = mock.Mock()
+        return processor
+
+    def run_processor(self, session, processor=None, **env):
+        processor = processor or self.processor(**env)
+        with mock.patch.object(JamfClearPatchNotifications, "get_session",
+                               return_value=session):
+            processor.main()
+        return processor.env
+
+
+@support.requires_autopkg
+class FindNotificationsTest(unittest.TestCase):
+    def test_only_patch_updates_of_the_pairs(self):
+        pairs = [("Zoom", "6.0"), ("Firefox", "124.0"), ("Chrome", "1")]
+        self.assertEqual(
+            JamfClearPatchNotifications.find_notifications(NOTIFICATIONS,
+                                                           pairs),
+            {("Zoom", "6.0"): "3", ("Firefox", "124.0"): "1"})
+
+    def test_stops_once_all_were_found(self):
+        items = iter(NOTIFICATIONS)
+        JamfClearPatchNotifications.find_notifications(
+            items, [("Firefox", "124.0")])
+        self.assertEqual(next(items)["id"], 2)
+
+
+@support.requires_autopkg
+class PatchPairsTest(ClearTestCase):
+    def test_single_pair(self):
+        self.assertEqual(self.processor(patch_name="Firefox",
+                                        version=124.0).patch_pairs(),
+                         [("Firefox", "124.0")])
+
+    def test_dict_and_list_forms_are_deduplicated(self):
+        patches = [{"patch_name": "Firefox", "version": "124.0"},
+                   ["Zoom", "6.0"], ("Firefox", "124.0"),
+                   {"patch_name": "Zoom", "version": "6.0", "other": 1}]
+        self.assertEqual(self.processor(patches=patches).patch_pairs(),
+                         [("Firefox", "124.0"), ("Zoom", "6.0")])
+
+    def test_malformed_entries(self):
+        for patch in ({"patch_name": "Firefox"}, ["Firefox"], 42,
+                      ["Firefox", "124.0", "extra"]):
+            with self.subTest(patch=patch), \
+                    self.assertRaises(ProcessorError):
+                self.processor(patches=[patch]).patch_pairs()
+
+    def test_nothing_to_clear(self):
+        with self.assertRaises(ProcessorError):
+            self.processor(patch_name="Firefox").patch_pairs()
+
+
+@support.requires_autopkg
+class MainTest(ClearTestCase):
+    def test_outputs(self):
+        session = FakeSession(failing={"4"})
+        patches = [["Firefox", "124.0"], ["Zoom", "6.0"], ["Chrome", "1"],
+                   ["Slack", "4.36"]]
+        processor = self.processor(patches=patches)
+        with self.assertRaises(ProcessorError) as raised:
+            self.run_processor(session, processor)
+        self.assertIn("Slack 4.36: Error dismissing notification: 500",
+                      str(raised.exception))
+        env = processor.env
+        self.assertEqual(sorted(session.deleted), ["1", "3"])
+        self.assertEqual(env["cleared_notifications"],
+                         [{"patch_name": "Firefox", "version": "124.0"},
+                          {"patch_name": "Zoom", "version": "6.0"}])
+        self.assertEqual(env["missing_notifications"],
+                         [{"patch_name": "Chrome", "version": "1"}])
+        self.assertEqual(env["failed_notifications"],
+                         [{"patch_name": "Slack", "version": "4.36",
+                           "error": "Error dismissing notification: 500"}])
+
+    def test_missing_pairs_are_reported_with_patches(self):
+        env = self.run_processor(FakeSession(), patches=[
+            ["Firefox", "124.0"], ["Chrome", "1"]])
+        self.assertEqual(env["missing_notifications"],
+                         [{"patch_name": "Chrome", "version": "1"}])
+        self.assertEqual(len(env["cleared_notifications"]), 1)
+
+    def test_missing_single_pair_fails(self):
+        with self.assertRaises(ProcessorError) as raised:
+            self.run_processor(FakeSession(), patch_name="Chrome",
+                               version="1")
+        self.assertEqual(str(raised.exception),
+                         "No notification found for Chrome version 1")
+
+    def test_token_is_reused_between_runs(self):
+        session = FakeSession()
+        self.run_processor(session, patch_name="Firefox", version="124.0")
+        self.run_processor(session, patch_name="Zoom", version="6.0")
+        self.assertEqual(session.tokens, 1)
+
+
+
+class RevokedTokenSession(FakeSession):
+    """Rejects the revoked token once for each of two concurrent requests"""
+
+    def __init__(self):
+        super().__init__()
+        self.both_sent = threading.Barrier(2, timeout=5)
+
+    def request(self, method, url, headers, timeout, stream):
+        if headers["Authorization"] == "Bearer revoked":
+            self.both_sent.wait()
+            return FakeResponse(401)
+        return super().request(method, url, headers, timeout, stream)
+
+
+@support.requires_autopkg
+class RevokedTokenTest(ClearTestCase):
+    def test_concurrent_requests_share_one_new_token(self):
+        session = RevokedTokenSession()
+        processor = self.processor()
+        processor.jamf_url = JSS_URL
+        processor.username = "api"
+        processor.password = "secret"
+        processor.session = session
+        processor.token_lock = threading.Lock()
+        processor.token_cache().put(JSS_URL, "api", "revoked",
+                                    "2099-01-01T00:00:00.000Z")
+        processor.token = processor.get_token()
+        self.assertEqual(processor.token, "revoked")
+
+        errors = []
+
+        def dismiss(notification_id):
+            errors.append(processor.dismiss(JSS_URL + "/api/v1/notifications",
+                                            notification_id))
+
+        threads = [threading.Thread(target=dismiss, args=(notification_id,))
+                   for notification_id in ("1", "3")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(errors, [None, None])
+        self.assertEqual(sorted(session.deleted), ["1", "3"])
+        self.assertEqual(session.tokens, 1)
+        self.assertEqual(processor.token, "token1")
+        self.assertEqual(processor.token_cache().get(JSS_URL, "api"),
+                         "token1")
+
+
+if __name__ == "__main__":
+    unittest.main()
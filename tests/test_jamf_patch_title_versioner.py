@@ -0,0 +1,56 @@
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import support
+
+if support.have_module("autopkglib") and support.have_module("JamfUploaderLib"):
+    from JamfPatchTitleVersioner import JamfPatchTitleVersioner
+
+TITLE = (b"<patch_software_title><versions><version>"
+         b"<software_version>2.0</software_version>"
+         b"</version></versions></patch_software_title>")
+
+
+@support.requires_jamf_uploader
+class PatchTitleFetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.processor = JamfPatchTitleVersioner()
+        self.processor.env = {"JAMF_PATCH_CACHE_DIR": self.tmp}
+        self.processor.jamf_url = "https://jamf.example.com"
+        self.processor.output = mock.Mock()
+        self.processor.api_endpoints = mock.Mock(
+            return_value="JSSResource/patchsoftwaretitles")
+        self.processor.curl = mock.Mock(side_effect=self.curl)
+
+    def curl(self, **kwargs):
+        if "--header" in kwargs["additional_curl_opts"]:
+            return SimpleNamespace(status_code=304, output=None,
+                                   headers=["HTTP/2 304"])
+        return SimpleNamespace(status_code=200, output=TITLE, headers=[
+            "HTTP/2 200", "content-type: application/xml",
+            'etag: "v2"'])
+
+    def test_requests_go_through_curl(self):
+        for _ in range(2):
+            self.assertEqual(self.processor.latest_patch_version(
+                self.processor.jamf_url, 3, "token"), "2.0")
+        first, second = self.processor.curl.call_args_list
+        self.processor.api_endpoints.assert_called_with("patch_software_title")
+        self.assertEqual(first.kwargs["url"], "https://jamf.example.com/"
+                         "JSSResource/patchsoftwaretitles/id/3")
+        self.assertEqual((first.kwargs["token"], first.kwargs["accept_header"],
+                          first.kwargs["additional_curl_opts"]),
+                         ("token", "xml", []))
+        self.assertEqual(second.kwargs["additional_curl_opts"],
+                         ["--header", 'If-None-Match: "v2"'])
+        self.processor.output.assert_called_with(
+            "Patch software title unchanged since the last run", 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
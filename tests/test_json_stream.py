@@ -0,0 +1,84 @@
+import json
+import unittest
+
+import support  # noqa: F401
+
+from JamfPatchLib.json_stream import JSONStreamError, iter_json_array
+
+ITEMS = [
+    {"id": 1, "type": "PATCH_UPDATE",
+     "params": {"softwareTitleName": "Zoom", "latestVersion": "6.0"}},
+    {"id": 2, "type": "OTHER", "params": {"name": "Bücher ✓"}},
+    12345, -0.5, "text, with ] and [", [1, [2]], None, True,
+]
+
+# Commas before brackets inside the elements, where the bulk decoding may
+# cut first
+NESTED = [
+    {"id": 1, "params": [{"a": 1}, {"b": [{"c": ", {"}]}]},
+    {"id": 2, "text": "x, {\"id\": 3}, {"},
+    [[1, 2], [3, [4, 5]]],
+    {"id": 4, "params": {}},
+]
+
+
+def split(data, size):
+    return [data[offset:offset + size]
+            for offset in range(0, len(data), size)]
+
+
+class IterJsonArrayTest(unittest.TestCase):
+    def test_any_chunk_size(self):
+        data = json.dumps(ITEMS, indent=1, ensure_ascii=False).encode()
+        for size in (1, 2, 3, 7, 64, len(data)):
+            with self.subTest(size=size):
+                self.assertEqual(list(iter_json_array(split(data, size))),
+                                 ITEMS)
+
+    def test_nested_brackets_after_commas(self):
+        for indent in (None, 2):
+            data = json.dumps(NESTED * 20, indent=indent).encode()
+            for size in (1, 5, 16, 100, len(data)):
+                with self.subTest(indent=indent, size=size):
+                    self.assertEqual(
+                        list(iter_json_array(split(data, size))),
+                        NESTED * 20)
+
+    def test_number_split_between_chunks(self):
+        self.assertEqual(list(iter_json_array([b"[12", b"34,5", b"6]"])),
+                         [1234, 56])
+
+    def test_empty_array_and_chunks(self):
+        self.assertEqual(list(iter_json_array([b" [", b"", b" ] "])), [])
+
+    def test_stops_reading_with_the_consumer(self):
+        read = []
+
+        def chunks():
+            for chunk in (b'[{"id": 1},', b'{"id": 2},', b'{"id": 3}]'):
+                read.append(chunk)
+                yield chunk
+
+        elements = iter_json_array(chunks())
+        self.assertEqual(next(elements), {"id": 1})
+        self.assertEqual(len(read), 1)
+        self.assertEqual(next(elements), {"id": 2})
+        self.assertEqual(len(read), 2)
+
+    def test_long_array(self):
+        items = [{"id": index, "name": "x" * 100} for index in range(2000)]
+        data = json.dumps(items).encode()
+        self.assertEqual(list(iter_json_array(split(data, 4096))), items)
+
+    def test_errors(self):
+        for data in (b'{"a": 1}', b"[1 2]", b"[1,", b"[1,]", b'["a', b"",
+                     b"[tru]", b"[ , 1]", b"[{}, , {}]", b"[{} {}, {}]",
+                     b"[[1],,[2]]"):
+            for size in (2, max(1, len(data))):
+                with self.subTest(data=data, size=size), \
+                        self.assertRaises(JSONStreamError):
+                    list(iter_json_array(split(data, size)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+import support  # noqa: F401
+
+from TitleEditorLib.metadata_cache import (
+    AppMetadata,
+    MetadataCache,
+    file_digest,
+    package_key,
+)
+
+
+def app(version):
+    return AppMetadata("Applications/Sample.app",
+                       {"CFBundleShortVersionString": version}, 1700000000)
+
+
+class MetadataCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.cache = MetadataCache(os.path.join(self.tmp, "metadata"), 2)
+
+    def test_round_trip(self):
+        self.assertIsNone(self.cache.get("abc", "payload"))
+        self.cache.put("abc", "payload", app("1.0"))
+        self.assertEqual(self.cache.get("abc", "payload"), app("1.0"))
+        self.assertIsNone(self.cache.get("abc", "payload-com.example"))
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put("a", "payload", app("1"))
+        self.cache.put("b", "payload", app("2"))
+        entries = dict((os.path.basename(path)[0], path)
+                       for path, _, _ in self.cache.entries())
+        os.utime(entries["a"], (1000, 1000))
+        os.utime(entries["b"], (2000, 2000))
+        # reading a makes b the least recently used
+        self.assertIsNotNone(self.cache.get("a", "payload"))
+        self.cache.put("c", "payload", app("3"))
+        self.assertIsNone(self.cache.get("b", "payload"))
+        self.assertIsNotNone(self.cache.get("a", "payload"))
+        self.assertIsNotNone(self.cache.get("c", "payload"))
+
+    def test_purge(self):
+        self.cache.put("a", "payload", app("1"))
+        self.cache.put("b", "payload", app("2"))
+        self.assertEqual(self.cache.purge(), 2)
+        self.assertEqual(self.cache.entries(), [])
+
+    def test_corrupt_entry_is_a_miss(self):
+        self.cache.put("a", "payload", app("1"))
+        with open(self.cache.entries()[0][0], "w") as fp:
+            fp.write("{")
+        self.assertIsNone(self.cache.get("a", "payload"))
+
+    def test_package_key(self):
+        path = os.path.join(self.tmp, "a.pkg")
+        with open(path, "wb") as fp:
+            fp.write(b"package")
+        os.utime(path, (1700000000, 1700000000))
+        self.assertEqual(file_digest(path),
+                         hashlib.sha256(b"package").hexdigest())
+        self.assertEqual(package_key(path), "%s-7-1700000000"
+                         % file_digest(path))
+        open(os.path.join(self.tmp, "empty"), "wb").close()
+        self.assertEqual(len(file_digest(os.path.join(self.tmp, "empty"))),
+                         64)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,259 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import support
+
+if support.have_module("autopkglib"):
+    import MistDownloader
+    from autopkglib import ProcessorError
+
+RELEASE = {"version": "13.6.4", "build": "22G513", "size": 1000}
+
+
+class MistTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.recipe_cache = os.path.join(self.tmp, "rc")
+        os.makedirs(self.recipe_cache)
+        self.downloads = []
+
+    def processor(self, **env):
+        processor = MistDownloader.MistDownloader()
+        processor.env = dict({"RECIPE_CACHE_DIR": self.recipe_cache,
+                              "CACHE_DIR": os.path.join(self.tmp, "cache"),
+                              "macOS": "macOS Ventura", "format": "package",
+                              "type": "installer"},
+                             **env)
+        processor.mist_path = "mist"
+        processor.output = mock.Mock()
+        processor.download = mock.Mock(side_effect=self.download)
+        return processor
+
+    def download(self, mist_type, macos, mist_format, compat_only,
+                 installer_path, temporary_dir=None):
+        self.downloads.append(installer_path)
+        with open(installer_path, "wb") as fp:
+            fp.write(b"installer %d" % len(self.downloads))
+
+    def run_processor(self, **env):
+        processor = self.processor(**env)
+        with mock.patch.object(MistDownloader.subprocess, "check_output",
+                               return_value=json.dumps([RELEASE])) as listing:
+            processor.main()
+        return processor.env, listing
+
+
+@support.requires_autopkg
+class MistPathTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.default = os.path.join(self.tmp, "default-mist")
+        patcher = mock.patch.object(MistDownloader, "DEFAULT_MIST",
+                                    self.default)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def mist(self, mist_path=None, in_path="/opt/homebrew/bin/mist",
+             euid=0):
+        processor = MistDownloader.MistDownloader()
+        processor.env = {"mist_path": mist_path} if mist_path else {}
+        processor.output = mock.Mock()
+        with mock.patch("shutil.which", return_value=in_path), \
+                mock.patch("os.geteuid", return_value=euid):
+            command = processor.mist()
+            self.assertEqual(processor.mist(), command)
+        processor.output.assert_called_once_with("Using %s" % command[-1])
+        return command
+
+    def touch(self, name):
+        path = os.path.join(self.tmp, name)
+        open(path, "w").close()
+        return path
+
+    def test_mist_path_wins(self):
+        self.touch("default-mist")
+        mist_path = self.touch("mist")
+        self.assertEqual(self.mist(mist_path), [mist_path])
+
+    def test_default_before_path(self):
+        self.touch("default-mist")
+        self.assertEqual(self.mist(), [self.default])
+        self.assertEqual(self.mist(os.path.join(self.tmp, "missing")),
+                         [self.default])
+
+    def test_path_only_without_default(self):
+        self.assertEqual(self.mist(), ["/opt/homebrew/bin/mist"])
+
+    def test_sudo_unless_root(self):
+        self.touch("default-mist")
+        self.assertEqual(self.mist(euid=501), ["sudo", self.default])
+
+    def test_no_mist(self):
+        with self.assertRaises(ProcessorError):
+            self.mist(in_path=None)
+
+
+@support.requires_autopkg
+class SkipDownloadTest(MistTestCase):
+    def test_second_run_skips_the_download(self):
+        env, _ = self.run_processor()
+        self.assertTrue(env["download_changed"])
+        self.assertEqual(env["installer_path"], os.path.join(
+            self.recipe_cache, "Install macOS Ventura 13.6.4-22G513.pkg"))
+        env, _ = self.run_processor()
+        self.assertFalse(env["download_changed"])
+        self.assertEqual(len(self.downloads), 1)
+
+    def test_changed_installer_is_downloaded_again(self):
+        env, _ = self.run_processor()
+        with open(env["installer_path"], "ab") as fp:
+            fp.write(b"!")
+        env, _ = self.run_processor()
+        self.assertTrue(env["download_changed"])
+
+    def test_verify_hash_notices_same_size_changes(self):
+        env, _ = self.run_processor(verify_hash=True)
+        path = env["installer_path"]
+        mtime = os.path.getmtime(path)
+        with open(path, "r+b") as fp:
+            fp.write(b"X")
+        os.utime(path, (mtime, mtime))
+        env, _ = self.run_processor()
+        self.assertFalse(env["download_changed"])
+        env, _ = self.run_processor(verify_hash=True)
+        self.assertTrue(env["download_changed"])
+
+    def test_catalog_is_reused(self):
+        _, listing = self.run_processor()
+        self.assertEqual(listing.call_count, 1)
+        _, listing = self.run_processor()
+        self.assertEqual(listing.call_count, 0)
+        _, listing = self.run_processor(mist_catalog_ttl=0)
+        self.assertEqual(listing.call_count, 1)
+
+
+@support.requires_autopkg
+class RecordDownloadTest(MistTestCase):
+    def record(self, **env):
+        env, _ = self.run_processor(**env)
+        with open(MistDownloader.MistDownloader.record_path(
+                env["installer_path"])) as fp:
+            return json.load(fp)
+
+    def test_hashed_only_with_verify_hash(self):
+        with mock.patch.object(MistDownloader, "file_digest") as digest:
+            record = self.record()
+        digest.assert_not_called()
+        self.assertNotIn("sha256", record)
+        self.assertEqual(record["size"], len(b"installer 1"))
+        shutil.rmtree(self.recipe_cache)
+        os.makedirs(self.recipe_cache)
+        self.assertIn("sha256", self.record(verify_hash=True))
+
+
+@support.requires_autopkg
+class DiskSpaceTest(unittest.TestCase):
+    def space(self, free):
+        space = MistDownloader.DiskSpace("/")
+        space.available = lambda: free - space.reserved
+        return space
+
+    def test_too_big_with_nothing_running(self):
+        with self.assertRaises(ProcessorError):
+            with self.space(10).reserve(11, "big"):
+                pass
+
+    def test_released_on_errors(self):
+        space = self.space(10)
+        with self.assertRaises(OSError):
+            with space.reserve(8, "first"):
+                self.assertEqual((space.reserved, space.running), (8, 1))
+                raise OSError("disk full")
+        self.assertEqual((space.reserved, space.running), (0, 0))
+
+    def test_waits_for_running_jobs(self):
+        space = self.space(10)
+        waiting = threading.Event()
+        output = mock.Mock(side_effect=lambda message: waiting.set())
+        order = []
+
+        def second():
+            with space.reserve(6, "second", output):
+                order.append("second")
+
+        with space.reserve(6, "first"):
+            thread = threading.Thread(target=second)
+            thread.start()
+            # the second job waits while the first one holds the space
+            self.assertTrue(waiting.wait(5))
+            order.append("first")
+        thread.join(5)
+        self.assertEqual(order, ["first", "second"])
+        output.assert_called_once_with("Waiting for 0.0GB free for second")
+
+
+@support.requires_autopkg
+class FetchAllTest(MistTestCase):
+    def download(self, mist_type, macos, mist_format, compat_only,
+                 installer_path, temporary_dir=None):
+        if mist_format == "image":
+            raise OSError("No space left on device")
+        if mist_format == "iso":
+            raise subprocess.CalledProcessError(1, ["hdiutil"])
+        super().download(mist_type, macos, mist_format, compat_only,
+                         installer_path, temporary_dir)
+
+    def test_errors_are_reported_per_target(self):
+        spaces = []
+        real_disk_space = MistDownloader.DiskSpace
+
+        def disk_space(path):
+            spaces.append(real_disk_space(path))
+            return spaces[-1]
+
+        targets = [{"macOS": "macOS Ventura", "format": fmt}
+                   for fmt in ("image", "package", "iso")]
+        with mock.patch.object(MistDownloader, "DiskSpace", disk_space), \
+                self.assertRaises(ProcessorError) as raised:
+            self.run_processor(targets=targets)
+        message = str(raised.exception)
+        self.assertIn("2 of 3", message)
+        self.assertIn("macOS Ventura image: No space left on device", message)
+        self.assertIn("macOS Ventura iso: Command '['hdiutil']'", message)
+        self.assertEqual(len(self.downloads), 1)
+        self.assertEqual((spaces[0].reserved, spaces[0].running), (0, 0))
+
+
+    def test_listing_errors_fail_only_their_targets(self):
+        def check_output(command):
+            if "macOS Sonoma" in command:
+                raise subprocess.CalledProcessError(1, command[:2])
+            return json.dumps([RELEASE])
+
+        targets = [{"macOS": macos, "format": fmt}
+                   for macos in ("macOS Sonoma", "macOS Ventura")
+                   for fmt in ("package", "application")]
+        processor = self.processor(targets=targets)
+        with mock.patch.object(MistDownloader.subprocess, "check_output",
+                               check_output), \
+                self.assertRaises(ProcessorError) as raised:
+            processor.main()
+        message = str(raised.exception)
+        self.assertIn("2 of 4", message)
+        self.assertIn("macOS Sonoma package: mist could not list", message)
+        self.assertIn("macOS Sonoma application: mist could not list", message)
+        self.assertEqual(sorted(map(os.path.basename, self.downloads)),
+                         ["Install macOS Ventura 13.6.4-22G513.app",
+                          "Install macOS Ventura 13.6.4-22G513.pkg"])
+
+
+if __name__ == "__main__":
+    unittest.main()
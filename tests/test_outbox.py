@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import support  # noqa: F401
+
+from TitleEditorLib.client import TitleEditorError
+from TitleEditorLib.outbox import BACKOFF_BASE, Outbox, backoff
+
+
+class FakeClient:
+    def __init__(self, errors=None, current="1.0"):
+        self.errors = dict(errors or {})
+        self.current = current
+        self.sent = []
+        self.messages = []
+
+    def log(self, message):
+        self.messages.append(message)
+
+    def title_state(self, title_id):
+        return None
+
+    def update_title(self, title_id, patch, current, version, state, name):
+        if version in self.errors:
+            raise self.errors[version]
+        self.sent.append((title_id, version))
+        return version != self.current
+
+
+class OutboxTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.outbox = Outbox(os.path.join(self.tmp, "outbox.sqlite"))
+        self.addCleanup(self.outbox.close)
+
+    def enqueue(self, title_id, version):
+        return self.outbox.enqueue(title_id, version, "patch %s" % version,
+                                   "current %s" % version)
+
+    def statuses(self):
+        return [(update.title_id, update.version, update.status)
+                for update in self.outbox.updates()]
+
+
+class EnqueueTest(OutboxTestCase):
+    def test_same_update_is_queued_once(self):
+        self.assertTrue(self.enqueue("7", "2.0"))
+        self.assertFalse(self.enqueue("7", "2.0"))
+        self.assertEqual(len(self.outbox.updates()), 1)
+
+
+class CoalesceTest(OutboxTestCase):
+    def test_only_newest_pending_version_is_kept(self):
+        for version in ("1.10", "1.9", "1.9.1"):
+            self.enqueue("7", version)
+        self.enqueue("8", "3.0")
+        self.assertEqual(self.outbox.coalesce(), 2)
+        self.assertEqual(self.statuses(),
+                         [("7", "1.10", "pending"), ("7", "1.9", "superseded"),
+                          ("7", "1.9.1", "superseded"), ("8", "3.0", "pending")])
+
+    def test_versions_older_than_delivered_are_superseded(self):
+        self.enqueue("7", "2.0")
+        self.outbox.delivered(self.outbox.updates()[0])
+        self.enqueue("7", "1.9")
+        self.outbox.coalesce()
+        self.assertEqual(self.statuses(), [("7", "2.0", "delivered"),
+                                           ("7", "1.9", "superseded")])
+
+
+class BackoffTest(OutboxTestCase):
+    def test_backoff_is_capped_and_jittered(self):
+        with mock.patch("random.uniform", side_effect=lambda a, b: b):
+            self.assertEqual(backoff(0), BACKOFF_BASE)
+            self.assertEqual(backoff(3), BACKOFF_BASE * 8)
+            self.assertEqual(backoff(30, maximum=100), 100)
+
+    def test_failed_update_waits_for_backoff(self):
+        self.enqueue("7", "2.0")
+        update = self.outbox.updates()[0]
+        with mock.patch("TitleEditorLib.outbox.backoff", return_value=60):
+            self.assertEqual(self.outbox.failed(update, "busy", True),
+                             "pending")
+        self.assertEqual(self.outbox.due(), [])
+        due = self.outbox.due(now=time.time() + 61)
+        self.assertEqual([(u.attempts, u.last_error) for u in due],
+                         [(1, "busy")])
+
+    def test_out_of_attempts_fails(self):
+        self.enqueue("7", "2.0")
+        update = self.outbox.updates()[0]._replace(attempts=2)
+        self.assertEqual(self.outbox.failed(update, "busy", True, 3),
+                         "failed")
+        self.assertEqual(self.outbox.retry(), 1)
+        self.assertEqual(self.outbox.due()[0].attempts, 0)
+
+
+class FlushTest(OutboxTestCase):
+    def test_flush_reports_whether_the_title_changed(self):
+        self.enqueue("7", "2.0")
+        self.enqueue("8", "1.0")
+        client = FakeClient()
+        results = self.outbox.flush(client, workers=2)
+        self.assertEqual([(r.update.title_id, r.status, r.updated)
+                          for r in results],
+                         [("7", "delivered", True), ("8", "delivered", False)])
+        self.assertEqual(self.outbox.due(), [])
+
+    def test_flush_sends_only_the_newest_version(self):
+        self.enqueue("7", "1.9")
+        self.enqueue("7", "2.0")
+        client = FakeClient()
+        self.outbox.flush(client)
+        self.assertEqual(client.sent, [("7", "2.0")])
+
+    def test_retryable_errors_stay_pending(self):
+        self.enqueue("7", "2.0")
+        self.enqueue("8", "3.0")
+        client = FakeClient({"2.0": TitleEditorError("busy", 503),
+                             "3.0": TitleEditorError("no title", 404)})
+        results = self.outbox.flush(client)
+        self.assertEqual([(r.status, r.detail, r.updated) for r in results],
+                         [("pending", "busy", False),
+                          ("failed", "no title", False)])
+        # the pending one is not due again within the same flush
+        self.assertEqual(self.outbox.updates("pending")[0].attempts, 1)
+
+    def test_second_flusher_returns_at_once(self):
+        self.enqueue("7", "2.0")
+        client = FakeClient()
+        with mock.patch("fcntl.flock", side_effect=BlockingIOError):
+            self.assertEqual(self.outbox.flush(client), [])
+        self.assertEqual(client.messages, ["Another flusher is running"])
+        self.assertEqual(client.sent, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import unittest
+from unittest import mock
+
+import support  # noqa: F401
+
+from SharedLib.paths import (
+    autopkg_settings,
+    jamf_patch_cache_root,
+    title_editor_cache_root,
+)
+
+
+class CacheRootTest(unittest.TestCase):
+    def test_folders_in_cache_dir(self):
+        env = {"CACHE_DIR": "/tmp/autopkg"}
+        self.assertEqual(title_editor_cache_root(env),
+                         "/tmp/autopkg/TitleEditor")
+        self.assertEqual(jamf_patch_cache_root(env), "/tmp/autopkg/JamfPatch")
+
+    def test_overrides(self):
+        env = {"CACHE_DIR": "/tmp/autopkg", "TITLE_EDITOR_CACHE_DIR": "~/te",
+               "JAMF_PATCH_CACHE_DIR": "/tmp/jamf"}
+        self.assertEqual(title_editor_cache_root(env),
+                         os.path.expanduser("~/te"))
+        self.assertEqual(jamf_patch_cache_root(env), "/tmp/jamf")
+
+    def test_default(self):
+        self.assertEqual(jamf_patch_cache_root({}), os.path.expanduser(
+            "~/Library/AutoPkg/Cache/JamfPatch"))
+
+
+class AutoPkgSettingsTest(unittest.TestCase):
+    def test_environment_wins(self):
+        with mock.patch.dict(os.environ, {"JSS_URL": "https://jamf"}), \
+                mock.patch("SharedLib.paths.AUTOPKG_PREFERENCES",
+                           "/nonexistent.plist"):
+            settings = autopkg_settings()
+        self.assertEqual(settings["JSS_URL"], "https://jamf")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import gzip
+import io
+import unittest
+
+import support  # noqa: F401
+
+import pkgfixtures
+from TitleEditorLib.payload import (
+    PayloadError,
+    find_apps,
+    iter_cpio,
+    open_payload,
+    search_payloads,
+)
+
+
+def newc_header(name, mode, size, mtime=pkgfixtures.MTIME):
+    name = name.encode() + b"\0"
+    header = b"070701" + b"".join(b"%08x" % value for value in (
+        0, mode, 0, 0, 1, mtime, size, 0, 0, 0, 0, len(name), 0)) + name
+    return header + b"\0" * (-len(header) % 4)
+
+
+def newc(entries):
+    data = b""
+    for name, mode, content in entries:
+        data += newc_header(name, mode, len(content)) + content
+        data += b"\0" * (-len(content) % 4)
+    return data + newc_header("TRAILER!!!", 0, 0, 0)
+
+
+def odc(entries):
+    fp = io.BytesIO()
+    pkgfixtures.write_cpio(fp, [(name, mode, len(content), [content])
+                                for name, mode, content in entries])
+    return fp.getvalue()
+
+
+def app_entries(app="Applications/Sample.app", version="1.2.3"):
+    plist = pkgfixtures.info_plist("com.example.sample", version)
+    return [(".", 0o40755, b""),
+            ("./" + app, 0o40755, b""),
+            ("./" + app + "/Contents", 0o40755, b""),
+            ("./" + app + "/Contents/MacOS/Sample", 0o100755, b"\xcf" * 999),
+            ("./" + app + "/Contents/Info.plist", 0o100644, plist)]
+
+
+def pbzx(data, chunk_size=64):
+    src = io.BytesIO(data)
+    dst = io.BytesIO()
+    pkgfixtures.pbzx_compress(src, dst, chunk_size)
+    return dst.getvalue()
+
+
+class CpioTest(unittest.TestCase):
+    def test_odc_entries(self):
+        entries = list(iter_cpio(io.BytesIO(odc(app_entries()))))
+        self.assertEqual([entry.name for entry, _ in entries][:2],
+                         [".", "Applications/Sample.app"])
+        self.assertEqual(entries[3][0].size, 999)
+
+    def test_newc_entries_and_data(self):
+        names = []
+        for entry, member in iter_cpio(io.BytesIO(newc(app_entries()))):
+            names.append(entry.name)
+            if entry.name.endswith("Info.plist"):
+                self.assertIn(b"com.example.sample", member.read())
+        self.assertEqual(names[-1], "Applications/Sample.app/Contents/"
+                                    "Info.plist")
+
+    def test_truncated_archive(self):
+        with self.assertRaises(PayloadError):
+            list(iter_cpio(io.BytesIO(odc(app_entries())[:-200])))
+
+    def test_bad_magic(self):
+        with self.assertRaises(PayloadError):
+            list(iter_cpio(io.BytesIO(b"123456" + b"0" * 200)))
+
+
+class OpenPayloadTest(unittest.TestCase):
+    def assertFindsApp(self, data):
+        pattern, apps = find_apps(io.BytesIO(data))
+        self.assertEqual(pattern, "Applications/*.app")
+        self.assertEqual([app.path for app in apps],
+                         ["Applications/Sample.app"])
+        self.assertIn(b"<string>1.2.3</string>", apps[0].info_plist)
+        self.assertEqual(apps[0].mtime, pkgfixtures.MTIME)
+
+    def test_plain_cpio(self):
+        self.assertFindsApp(odc(app_entries()))
+        self.assertFindsApp(newc(app_entries()))
+
+    def test_gzip(self):
+        self.assertFindsApp(gzip.compress(odc(app_entries())))
+
+    def test_pbzx(self):
+        # small chunks, so the archive spans several xz chunks
+        self.assertFindsApp(pbzx(odc(app_entries())))
+
+    def test_unknown_format(self):
+        with self.assertRaises(PayloadError):
+            open_payload(io.BytesIO(b"PK\x03\x04 not a payload"))
+
+    def test_app_at_root(self):
+        pattern, apps = find_apps(io.BytesIO(odc(app_entries("Sample.app"))))
+        self.assertEqual(pattern, "*.app")
+        self.assertEqual([app.path for app in apps], ["Sample.app"])
+
+    def test_nested_apps_are_ignored(self):
+        entries = app_entries() + [
+            ("./Applications/Sample.app/Contents/Helpers/Helper.app/Contents"
+             "/Info.plist", 0o100644, b"<plist/>")]
+        self.assertEqual(len(find_apps(io.BytesIO(odc(entries)))[1]), 1)
+
+
+class SearchPayloadsTest(unittest.TestCase):
+    def test_first_match_in_order(self):
+        payloads = [odc(app_entries("Library/Other/None")),
+                    b"broken payload",
+                    gzip.compress(odc(app_entries())),
+                    odc(app_entries(version="9.9"))]
+        index, pattern, apps, errors = search_payloads(
+            [lambda data=data: io.BytesIO(data) for data in payloads],
+            workers=2)
+        self.assertEqual(index, 2)
+        self.assertEqual(apps[0].path, "Applications/Sample.app")
+        self.assertIn(1, errors)
+
+    def test_no_match(self):
+        index, pattern, apps, errors = search_payloads(
+            [lambda: io.BytesIO(odc(app_entries("Library/None")))])
+        self.assertIsNone(index)
+        self.assertEqual(apps, [])
+        self.assertEqual(errors, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import support  # noqa: F401
+
+import pkgfixtures
+from TitleEditorLib.bom import BOM_TYPE_DIR, BOM_TYPE_FILE, BomError, read_bom
+from TitleEditorLib.extract import extract_app
+from TitleEditorLib.pkginfo import (
+    PackageInfoError,
+    find_package_apps,
+    lists_app,
+    sort_payloads,
+)
+from TitleEditorLib.xar import XarArchive, XarError
+
+
+class PackageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def make_package(self, shape="flat", **kwargs):
+        return pkgfixtures.make_package(
+            os.path.join(self.tmp, shape + ".pkg"), shape, size=4096,
+            **kwargs)
+
+
+class BomTest(unittest.TestCase):
+    def test_paths(self):
+        entries = read_bom(pkgfixtures.bom([
+            (".", 0o40755, 0),
+            ("./Applications", 0o40755, 0),
+            ("./Applications/Sample.app", 0o40755, 0),
+            ("./Applications/Sample.app/Contents", 0o40755, 0),
+            ("./Applications/Sample.app/Contents/Info.plist", 0o100644,
+             321)]))
+        app = entries["Applications/Sample.app"]
+        self.assertEqual(app.type, BOM_TYPE_DIR)
+        self.assertEqual(app.mtime, pkgfixtures.MTIME)
+        plist = entries["Applications/Sample.app/Contents/Info.plist"]
+        self.assertEqual((plist.type, plist.mode, plist.size),
+                         (BOM_TYPE_FILE, 0o100644, 321))
+
+    def test_not_a_bom(self):
+        with self.assertRaises(BomError):
+            read_bom(b"not a bom at all")
+
+    def test_truncated(self):
+        data = pkgfixtures.bom([(".", 0o40755, 0)])
+        with self.assertRaises(BomError):
+            read_bom(data[:40])
+
+
+class XarTest(PackageTestCase):
+    def test_members(self):
+        archive = XarArchive(self.make_package())
+        self.assertEqual(sorted(archive.names()),
+                         ["Bom", "PackageInfo", "Payload"])
+        self.assertIn(b"com.example.sample", archive.read("PackageInfo"))
+        # stored members stream as they are
+        with archive.open("Payload") as fp:
+            self.assertEqual(fp.read(2), b"\x1f\x8b")
+
+    def test_nested_members(self):
+        archive = XarArchive(self.make_package("nested", components=2))
+        self.assertIn("Sample1.pkg/PackageInfo", archive)
+        with self.assertRaises(XarError):
+            archive.read("Sample9.pkg/PackageInfo")
+
+    def test_not_a_package(self):
+        path = os.path.join(self.tmp, "plain.pkg")
+        with open(path, "wb") as fp:
+            fp.write(b"PK\x03\x04" + b"\0" * 100)
+        with self.assertRaises(XarError):
+            XarArchive(path)
+
+
+class PackageInfoTest(PackageTestCase):
+    def test_flat_package(self):
+        pattern, apps = find_package_apps(self.make_package(version="4.5"))
+        self.assertEqual(pattern, "Applications/*.app")
+        self.assertEqual(len(apps), 1)
+        self.assertEqual(apps[0].path, "Applications/Sample.app")
+        self.assertEqual(apps[0].info_plist, {
+            "CFBundleIdentifier": "com.example.sample",
+            "CFBundleShortVersionString": "4.5", "CFBundleVersion": "45"})
+        self.assertEqual(apps[0].mtime, pkgfixtures.MTIME)
+
+    def test_app_at_root(self):
+        pattern, apps = find_package_apps(self.make_package("root-app"))
+        self.assertEqual((pattern, apps[0].path), ("*.app", "Sample.app"))
+
+    def test_product_package(self):
+        path = self.make_package("nested", components=3)
+        pattern, apps = find_package_apps(path)
+        self.assertEqual([app.path for app in apps],
+                         ["Applications/Sample.app"])
+        self.assertEqual(apps[0].component, "Sample2.pkg/")
+        # the minimum OS comes from the Distribution
+        self.assertEqual(apps[0].info_plist["LSMinimumSystemVersion"],
+                         "12.0")
+
+        pattern, apps = find_package_apps(path, all_components=True)
+        self.assertEqual([app.component for app in apps], ["Sample2.pkg/"])
+
+    def test_unreadable_package(self):
+        path = os.path.join(self.tmp, "empty.pkg")
+        open(path, "wb").close()
+        with self.assertRaises(PackageInfoError):
+            find_package_apps(path)
+
+    def test_lists_app(self):
+        self.assertTrue(lists_app(pkgfixtures.package_info(
+            "a.pkg", "1", [("com.a", "1", "Applications/A.app")])))
+        self.assertFalse(lists_app(pkgfixtures.package_info(
+            "a.pkg", "1", [("com.a", "1", "Library/A.plugin")])))
+        self.assertFalse(lists_app(b"<pkg-info"))
+
+
+class SortPayloadsTest(unittest.TestCase):
+    def test_order(self):
+        infos = {"a.pkg/Payload": pkgfixtures.package_info(
+                     "a", "1", [("com.a", "1", "Library/A.bundle")]),
+                 "b.pkg/Payload": pkgfixtures.package_info(
+                     "b", "1", [("com.b", "1", "Applications/B.app")]),
+                 "c.pkg/Payload": None,
+                 "d.pkg/Payload": pkgfixtures.package_info(
+                     "d", "1", [("com.d", "1", "Applications/D.app")])}
+        sizes = {"a.pkg/Payload": 30, "b.pkg/Payload": 10,
+                 "c.pkg/Payload": 50, "d.pkg/Payload": 20}
+        calls = []
+
+        def package_info(name):
+            calls.append(name)
+            return infos[name]
+        names, likely = sort_payloads(sorted(infos), package_info, sizes.get)
+        self.assertEqual(names, ["d.pkg/Payload", "b.pkg/Payload",
+                                 "c.pkg/Payload", "a.pkg/Payload"])
+        self.assertEqual(likely, 2)
+        # each PackageInfo is read once
+        self.assertEqual(sorted(calls), sorted(infos))
+
+
+class ExtractAppTest(PackageTestCase):
+    def test_nested_payloads(self):
+        app = extract_app(self.make_package("nested", components=3,
+                                            version="3.1"))
+        self.assertEqual(app.path, "Applications/Sample.app")
+        self.assertEqual(app.info_plist["CFBundleShortVersionString"],
+                         "3.1")
+
+    def test_pbzx_payload(self):
+        app = extract_app(self.make_package("pbzx"))
+        self.assertEqual(app.info_plist["CFBundleIdentifier"],
+                         "com.example.sample")
+
+
+if __name__ == "__main__":
+    unittest.main()
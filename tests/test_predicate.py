@@ -0,0 +1,102 @@
+import unittest
+
+import support  # noqa: F401
+
+from SleepIfLib.predicate import (
+    PredicateError,
+    compile_predicate,
+    evaluate,
+    lookup,
+)
+
+ENV = {
+    "NAME": "Firefox",
+    "version": "124.0.1",
+    "count": 3,
+    "download_changed": True,
+    "pkg_path": "/Users/autopkg/Library/AutoPkg/Cache/Firefox-124.0.1.pkg",
+    "tags": ["beta", "stable"],
+    "jamf": {"patch": {"latest": "124.0"}},
+    "in": "keyword key",
+    "empty": "",
+}
+
+
+class EvaluateTest(unittest.TestCase):
+    def check(self, cases):
+        for predicate, expected in cases:
+            with self.subTest(predicate=predicate):
+                self.assertIs(evaluate(predicate, ENV), expected)
+
+    def test_comparisons(self):
+        self.check([
+            ('NAME == "Firefox"', True),
+            ("NAME = 'Firefox'", True),
+            ('NAME != "Firefox"', False),
+            ('NAME <> "Chrome"', True),
+            ("count > 2", True),
+            ("count <= 2", False),
+            ("count >= 3 && count < 4", True),
+            ('count == "3"', True),
+            ("count > missing", False),
+            ("missing == nil", True),
+            ("missing == NULL", True),
+            ("download_changed == TRUE", True),
+            ("download_changed == NO", False),
+            ("jamf.patch.latest == '124.0'", True),
+            ("jamf.missing.latest == nil", True),
+            ('#in == "keyword key"', True),
+        ])
+
+    def test_string_operators(self):
+        self.check([
+            ('pkg_path ENDSWITH ".pkg"', True),
+            ('pkg_path BEGINSWITH "/Users"', True),
+            ('NAME CONTAINS "fox"', True),
+            ('NAME CONTAINS "FOX"', False),
+            ('NAME CONTAINS[c] "FOX"', True),
+            ('NAME LIKE "Fire*"', True),
+            ('NAME LIKE "Fire?ox"', True),
+            ('NAME LIKE[c] "fire*"', True),
+            ('version MATCHES "[0-9.]+"', True),
+            ('version MATCHES "[0-9]+"', False),
+            ('"Crème" ==[cd] "creme"', True),
+            ('"beta" IN tags', True),
+            ('NAME IN {"Firefox", "Chrome"}', True),
+            ('NAME IN {"Chrome", version}', False),
+            ('tags CONTAINS "stable"', True),
+        ])
+
+    def test_logic(self):
+        self.check([
+            ("TRUEPREDICATE", True),
+            ("FALSEPREDICATE", False),
+            ('NOT NAME == "Chrome"', True),
+            ('!(count == 3)', False),
+            ('count == 1 OR count == 3', True),
+            ('count == 1 || (count == 3 and NAME == "Firefox")', True),
+            ('empty == "" AND missing != nil', False),
+        ])
+
+    def test_errors(self):
+        for predicate in ("", "NAME", "NAME ==", "(count == 3",
+                          "NAME == $VAR", 'NAME IN {"a"', "count ~ 3",
+                          "count == 3 count"):
+            with self.subTest(predicate=predicate), \
+                    self.assertRaises(PredicateError):
+                evaluate(predicate, ENV)
+
+    def test_compiled_once(self):
+        self.assertIs(compile_predicate("count > 2"),
+                      compile_predicate("count > 2"))
+
+
+class LookupTest(unittest.TestCase):
+    def test_paths(self):
+        self.assertEqual(lookup(ENV, "jamf.patch.latest"), "124.0")
+        self.assertIsNone(lookup(ENV, "jamf.nothing"))
+        self.assertIsNone(lookup(ENV, "NAME.length"))
+
+
+if __name__ == "__main__":
+    unittest.main()
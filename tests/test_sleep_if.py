@@ -0,0 +1,204 @@
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import support
+
+if support.have_module("autopkglib"):
+    import SleepIf
+    from autopkglib import ProcessorError
+    from JamfPatchLib.title_cache import TitleFetchError, TitleResponse
+    from TitleEditorLib.client import TitleEditorError
+
+TITLE = (b"<patch_software_title><id>3</id><versions><version>"
+         b"<software_version>2.0</software_version></version></versions>"
+         b"</patch_software_title>")
+
+
+class FakePredicate:
+    def __init__(self, result):
+        self.result = result
+
+    def evaluateWithObject_(self, env):
+        return self.result
+
+
+@support.requires_autopkg
+class PredicateEngineTest(unittest.TestCase):
+    def processor(self, engine=None):
+        processor = SleepIf.SleepIf()
+        processor.env = {"count": 3}
+        if engine:
+            processor.env["predicate_engine"] = engine
+        processor.output = mock.Mock()
+        return processor
+
+    def evaluate(self, engine, predicate="count == 3"):
+        with mock.patch.object(SleepIf, "nspredicate",
+                               return_value=FakePredicate(False)) as ns:
+            result = self.processor(engine).predicate_evaluates_as_true(
+                predicate)
+        return result, ns.called
+
+    def test_auto_uses_the_evaluator(self):
+        self.assertEqual(self.evaluate(None), (True, False))
+        self.assertEqual(self.evaluate("auto"), (True, False))
+
+    def test_auto_falls_back_to_nspredicate(self):
+        # SUBQUERY is not known to the built-in evaluator
+        self.assertEqual(self.evaluate("auto", "SUBQUERY(x, $x, $x > 1)"),
+                         (False, True))
+
+    def test_explicit_engines(self):
+        self.assertEqual(self.evaluate("python"), (True, False))
+        self.assertEqual(self.evaluate("nspredicate"), (False, True))
+
+    def test_python_engine_errors(self):
+        with self.assertRaises(ProcessorError):
+            self.evaluate("python", "count ~ 3")
+
+    def test_nspredicate_errors(self):
+        processor = self.processor()
+        with mock.patch.object(SleepIf, "nspredicate",
+                               side_effect=ValueError("bad format")), \
+                self.assertRaises(ProcessorError) as raised:
+            processor.predicate_evaluates_as_true("count ~ 3")
+        self.assertIn("bad format", str(raised.exception))
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ProcessorError):
+            self.evaluate("javascript")
+
+
+class FakeClock:
+    """Stands in for monotonic() and sleep(), without jitter"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def patch(self, test):
+        for name, value in (("monotonic", self.monotonic),
+                            ("sleep", self.sleep)):
+            patcher = mock.patch.object(SleepIf, name, value)
+            patcher.start()
+            test.addCleanup(patcher.stop)
+        patcher = mock.patch.object(SleepIf.random, "uniform",
+                                    lambda low, high: high)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+
+
+@support.requires_autopkg
+class WaitUntilTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.clock.patch(self)
+
+    def test_backoff_is_capped(self):
+        ready, waited = SleepIf.wait_until(lambda: False, 100, 5, 20)
+        self.assertFalse(ready)
+        self.assertEqual(waited, 100)
+        self.assertEqual(self.clock.sleeps, [5, 10, 20, 20, 20, 20, 5])
+
+    def test_ready(self):
+        answers = iter([False, False, True])
+        self.assertEqual(SleepIf.wait_until(lambda: next(answers), 100, 5,
+                                            20), (True, 15))
+
+    def test_jitter(self):
+        with mock.patch.object(SleepIf.random, "uniform",
+                               return_value=3) as uniform:
+            SleepIf.wait_until(lambda: False, 10, 4, 60)
+        self.assertEqual(uniform.call_args_list[:2],
+                         [mock.call(2, 4), mock.call(4, 8)])
+
+
+@support.requires_autopkg
+class WaitForVersionTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.clock.patch(self)
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def processor(self, **env):
+        processor = SleepIf.SleepIf()
+        processor.env = dict({"wait_timeout": "30", "wait_interval": "5",
+                              "wait_max_interval": "10",
+                              "CACHE_DIR": self.tmp}, **env)
+        processor.output = mock.Mock()
+        return processor
+
+    def wait(self, versions, version="2.0", mode="title_editor"):
+        """Waits for version while the server answers versions, one per
+        poll; exceptions are raised"""
+        processor = self.processor()
+        answers = iter(versions)
+
+        def probe():
+            answer = next(answers)
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+
+        with mock.patch.object(processor, "title_editor_probe",
+                               return_value=probe):
+            return processor.wait_for_version(mode, version)
+
+    def test_version_reached(self):
+        self.assertEqual(self.wait(["1.0", None, "2.0"]), 15)
+
+    def test_newer_version_counts(self):
+        self.assertEqual(self.wait(["10.0"], "9.0"), 0)
+        self.assertEqual(self.wait(["2.0.1"]), 0)
+
+    def test_fetch_errors_count_as_not_ready(self):
+        self.assertEqual(self.wait([TitleFetchError("HTTP 500", 500),
+                                    TitleEditorError("offline"), "2.0"]),
+                         15)
+
+    def test_timeout(self):
+        with self.assertRaises(ProcessorError) as raised:
+            self.wait(["1.0"] * 10)
+        self.assertEqual(str(raised.exception),
+                         "Server didn't report version 2.0 within 30 "
+                         "seconds")
+
+    def test_401_gets_a_fresh_token(self):
+        processor = self.processor(JSS_URL="https://jamf.example.com",
+                                   patch_softwaretitle="Firefox",
+                                   API_USERNAME="api", API_PASSWORD="secret")
+        tokens = iter(["revoked", "fresh"])
+        used = []
+
+        def title_fetcher(jamf_url, token):
+            def fetch(title_id, headers):
+                used.append(token)
+                if token == "revoked":
+                    return TitleResponse(401, {}, b"")
+                return TitleResponse(200, {}, TITLE)
+            return fetch
+
+        with mock.patch.object(SleepIf, "get_token",
+                               side_effect=lambda *args: next(tokens)) \
+                as get_token, \
+                mock.patch.object(SleepIf, "list_patch_titles",
+                                  return_value={"Firefox": 3}), \
+                mock.patch.object(SleepIf, "title_fetcher", title_fetcher):
+            self.assertEqual(processor.wait_for_version("jamf_patch", "2.0"),
+                             5)
+        self.assertEqual(get_token.call_count, 2)
+        self.assertEqual(used, ["revoked", "fresh"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+import support  # noqa: F401
+
+from TitleEditorLib.throttle import AdaptiveThrottle
+
+
+class AdaptiveThrottleTest(unittest.TestCase):
+    def test_additive_increase(self):
+        throttle = AdaptiveThrottle(max_concurrency=8)
+        throttle.limit = 2.0
+        for _ in range(2):
+            throttle.acquire()
+            self.assertEqual(throttle.release(200), 0)
+        # +1/limit per success
+        self.assertAlmostEqual(throttle.limit, 2.5 + 1 / 2.5)
+        throttle.limit = 7.95
+        throttle.acquire()
+        throttle.release(201)
+        self.assertEqual(throttle.limit, 8)
+
+    def test_multiplicative_decrease(self):
+        throttle = AdaptiveThrottle(max_concurrency=8, min_concurrency=2,
+                                    base_delay=0.5)
+        with mock.patch("random.uniform", lambda low, high: high):
+            throttle.acquire()
+            delay = throttle.release(503, attempt=2)
+        self.assertEqual(throttle.limit, 4)
+        self.assertEqual(delay, 2.0)
+        self.assertGreater(throttle.resume_at, time.monotonic() + 1.5)
+        for _ in range(3):
+            throttle.resume_at = 0
+            throttle.acquire()
+            throttle.release(429)
+        # never below min_concurrency
+        self.assertEqual((throttle.limit, throttle.active), (2, 0))
+
+    def test_retry_after(self):
+        throttle = AdaptiveThrottle(max_delay=10)
+        self.assertEqual(throttle.backoff_delay(0, "3"), 3)
+        self.assertEqual(throttle.backoff_delay(0, "120"), 10)
+        self.assertLessEqual(throttle.backoff_delay(1, "soon"), 2)
+
+    def test_transport_error_keeps_limit(self):
+        throttle = AdaptiveThrottle(max_concurrency=4)
+        throttle.acquire()
+        throttle.release(None)
+        self.assertEqual((throttle.limit, throttle.active), (4, 0))
+
+    def test_limits_concurrency(self):
+        throttle = AdaptiveThrottle(max_concurrency=2)
+        throttle.acquire()
+        throttle.acquire()
+        acquired = threading.Event()
+
+        def third():
+            throttle.acquire()
+            acquired.set()
+        thread = threading.Thread(target=third)
+        thread.start()
+        self.assertFalse(acquired.wait(0.1))
+        throttle.release(200)
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,206 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import support  # noqa: F401
+
+from JamfPatchLib.title_cache import (
+    PatchTitleIndex,
+    TitleFetchError,
+    TitleResponse,
+    VersionCache,
+    fetch_latest_version,
+    latest_version,
+    parse_latest_version,
+    read_latest_version,
+    title_url,
+)
+
+TITLE = (b"<patch_software_title><id>3</id><versions>"
+         b"<version><software_version>2.0</software_version></version>"
+         b"<version><software_version>1.0</software_version></version>"
+         b"</versions></patch_software_title>")
+
+
+class FakeServer:
+    """fetch function answering like Jamf Pro with an ETag"""
+
+    def __init__(self, document=TITLE, etag='"v2"'):
+        self.document = document
+        self.etag = etag
+        self.requests = []
+
+    def fetch(self, title_id, headers):
+        self.requests.append((title_id, headers))
+        if title_id == "404":
+            return TitleResponse(404, {}, b"")
+        if headers.get("If-None-Match") == self.etag:
+            return TitleResponse(304, {"ETag": self.etag}, None)
+        return TitleResponse(200, {"etag": self.etag,
+                                   "Last-Modified": "Mon, 1 Jan 2024"},
+                             self.document)
+
+
+class CountingReader(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+class ReadLatestVersionTest(unittest.TestCase):
+    def test_first_version(self):
+        self.assertEqual(parse_latest_version(TITLE), "2.0")
+
+    def test_stops_reading_at_the_first_version(self):
+        history = b"".join(
+            b"<version><software_version>1.%d</software_version></version>"
+            % minor for minor in range(2000))
+        reader = CountingReader(TITLE.replace(b"</versions>",
+                                              history + b"</versions>"))
+        self.assertEqual(read_latest_version(reader, chunk_size=256), "2.0")
+        self.assertLess(reader.bytes_read, 512)
+
+    def test_one_byte_chunks(self):
+        self.assertEqual(read_latest_version(io.BytesIO(TITLE), 1), "2.0")
+
+    def test_software_version_elsewhere_is_ignored(self):
+        document = (b"<patch_software_title><software_version>9"
+                    b"</software_version><versions><version><components>"
+                    b"<software_version>8</software_version></components>"
+                    b"<software_version> 2.0\n</software_version></version>"
+                    b"</versions></patch_software_title>")
+        self.assertEqual(parse_latest_version(document), "2.0")
+
+    def test_no_versions(self):
+        self.assertIsNone(parse_latest_version(
+            b"<patch_software_title><versions/></patch_software_title>"))
+        self.assertIsNone(parse_latest_version(
+            b"<patch_software_title><versions><version><software_version/>"
+            b"</version></versions></patch_software_title>"))
+
+    def test_broken_document(self):
+        with self.assertRaises(TitleFetchError):
+            parse_latest_version(b"<patch_software_title><versions>")
+        with self.assertRaises(TitleFetchError):
+            parse_latest_version(b"<a></b>")
+
+
+class TitleIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.listings = 0
+
+    def index(self, ttl=60):
+        return PatchTitleIndex(os.path.join(self.tmp, "index.json"), ttl)
+
+    def list_titles(self):
+        self.listings += 1
+        return {"Firefox": 3, "Zoom": 4}
+
+    def test_fresh_index_is_listed_once(self):
+        self.assertEqual(self.index().resolve("Firefox", self.list_titles),
+                         "3")
+        self.assertEqual(self.index().resolve("Zoom", self.list_titles),
+                         "4")
+        self.assertEqual(self.listings, 1)
+
+    def test_stale_index_is_listed_again(self):
+        self.index().resolve("Firefox", self.list_titles)
+        with mock.patch("time.time", return_value=time.time() + 61):
+            self.index().resolve("Firefox", self.list_titles)
+        self.assertEqual(self.listings, 2)
+
+    def test_unknown_name_refreshes_the_index(self):
+        self.index().resolve("Firefox", self.list_titles)
+        self.assertIsNone(self.index().resolve("Slack", self.list_titles))
+        self.assertEqual(self.listings, 2)
+
+    def test_resolve_all_lists_at_most_once(self):
+        ids = self.index().resolve_all(["Firefox", "Zoom", "Slack"],
+                                       self.list_titles)
+        self.assertEqual(ids, {"Firefox": "3", "Zoom": "4", "Slack": None})
+        self.assertEqual(self.listings, 1)
+
+    def test_forget_lists_again(self):
+        self.index().resolve("Firefox", self.list_titles)
+        self.index().forget("Firefox")
+        self.index().resolve("Zoom", self.list_titles)
+        self.assertEqual(self.listings, 2)
+
+
+class FetchLatestVersionTest(unittest.TestCase):
+    def test_title_url(self):
+        self.assertEqual(
+            title_url("https://jamf/JSSResource/patchsoftwaretitles/", 3),
+            "https://jamf/JSSResource/patchsoftwaretitles/id/3")
+
+    def test_first_fetch_keeps_validators(self):
+        entry, changed = fetch_latest_version(FakeServer().fetch, "3")
+        self.assertTrue(changed)
+        self.assertEqual((entry["version"], entry["etag"],
+                          entry["last_modified"]),
+                         ("2.0", '"v2"', "Mon, 1 Jan 2024"))
+
+    def test_cached_entry_is_revalidated(self):
+        server = FakeServer()
+        entry, _ = fetch_latest_version(server.fetch, "3")
+        again, changed = fetch_latest_version(server.fetch, "3", entry)
+        self.assertFalse(changed)
+        self.assertEqual(again["version"], "2.0")
+        self.assertEqual(server.requests[1][1],
+                         {"If-None-Match": '"v2"',
+                          "If-Modified-Since": "Mon, 1 Jan 2024"})
+
+    def test_file_body_is_closed(self):
+        body = mock.Mock(wraps=io.BytesIO(TITLE))
+        fetch_latest_version(lambda *args: TitleResponse(200, {}, body), "3")
+        body.close.assert_called_once_with()
+
+    def test_error_status(self):
+        with self.assertRaises(TitleFetchError) as raised:
+            fetch_latest_version(FakeServer().fetch, "404")
+        self.assertEqual(raised.exception.status, 404)
+
+
+class LatestVersionTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.cache = VersionCache(self.tmp)
+        self.server = FakeServer()
+
+    def test_sources(self):
+        self.assertEqual(latest_version(self.server.fetch, "3", self.cache),
+                         ("2.0", "fetched"))
+        self.assertEqual(latest_version(self.server.fetch, "3", self.cache),
+                         ("2.0", "unchanged"))
+        self.assertEqual(latest_version(self.server.fetch, "3", self.cache,
+                                        max_age=60), ("2.0", "stored"))
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_changed_title_is_fetched(self):
+        latest_version(self.server.fetch, "3", self.cache)
+        self.server.document = TITLE.replace(b"2.0", b"3.0")
+        self.server.etag = '"v3"'
+        self.assertEqual(latest_version(self.server.fetch, "3", self.cache),
+                         ("3.0", "fetched"))
+
+    def test_title_without_versions(self):
+        server = FakeServer(b"<patch_software_title><versions/>"
+                            b"</patch_software_title>")
+        with self.assertRaises(TitleFetchError):
+            latest_version(server.fetch, "3", self.cache)
+
+
+if __name__ == "__main__":
+    unittest.main()
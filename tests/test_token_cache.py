@@ -0,0 +1,122 @@
+import json
+import os
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import support  # noqa: F401
+
+from SharedLib.token_cache import TokenCache, parse_expiry
+from TitleEditorLib import api
+from TitleEditorLib.client import TitleEditorClient, TitleEditorError
+
+URL = "https://title.example.com"
+
+
+class ParseExpiryTest(unittest.TestCase):
+    def test_formats(self):
+        self.assertEqual(parse_expiry("2024-01-02T03:04:05Z"), 1704164645.0)
+        self.assertEqual(parse_expiry("2024-01-02T03:04:05.123456789Z"),
+                         1704164645.123456)
+        self.assertEqual(parse_expiry("2024-01-02T04:04:05+01:00"),
+                         1704164645.0)
+        self.assertEqual(parse_expiry(1704164645), 1704164645.0)
+        self.assertEqual(parse_expiry(1704164645123), 1704164645.123)
+        self.assertIsNone(parse_expiry("tomorrow"))
+
+
+class TokenCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.path = os.path.join(self.tmp, "cache", "tokens.json")
+        self.cache = TokenCache(self.path, refresh_margin=300)
+
+    def test_reused_until_refresh_margin(self):
+        self.cache.put(URL, "user", "abc", time.time() + 3600)
+        self.assertEqual(self.cache.get(URL, "user"), "abc")
+        self.assertIsNone(self.cache.get(URL, "other"))
+        self.cache.put(URL, "user", "abc", time.time() + 200)
+        self.assertIsNone(self.cache.get(URL, "user"))
+
+    def test_owner_only(self):
+        self.cache.put(URL, "user", "abc", time.time() + 3600)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+    def test_unknown_expiry_is_not_cached(self):
+        self.cache.put(URL, "user", "abc", "whenever")
+        self.assertIsNone(self.cache.get(URL, "user"))
+
+    def test_expired_tokens_are_dropped(self):
+        self.cache.put(URL, "old", "abc", time.time() - 1)
+        self.cache.put(URL, "user", "def", time.time() + 3600)
+        with open(self.path) as fp:
+            self.assertEqual(len(json.load(fp)), 1)
+
+    def test_invalidate(self):
+        self.cache.put(URL, "user", "abc", time.time() + 3600)
+        self.cache.invalidate(URL, "user")
+        self.assertIsNone(self.cache.get(URL, "user"))
+
+
+class FakeTitleEditor:
+    """Answers api.request() like Title Editor, accepting one token"""
+
+    def __init__(self):
+        self.valid_token = "fresh"
+        self.accepted = None
+        self.requests = []
+
+    def __call__(self, method, url, headers=None, data=None):
+        self.requests.append((method, url, headers.get("Authorization")))
+        if url.endswith("/v2/auth/tokens"):
+            return api.Response(200, {}, {
+                "token": self.valid_token,
+                "expires": "2099-01-01T00:00:00Z"})
+        if headers.get("Authorization") != \
+                "Bearer " + (self.accepted or self.valid_token):
+            return api.Response(401, {}, None)
+        return api.Response(200, {}, [])
+
+
+class ClientTokenTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.cache = TokenCache(os.path.join(tmp, "tokens.json"))
+        self.server = FakeTitleEditor()
+        patcher = mock.patch("TitleEditorLib.client.api.request",
+                             self.server)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def client(self):
+        return TitleEditorClient(URL, "user", "pass", token_cache=self.cache)
+
+    def test_token_is_shared_between_clients(self):
+        self.client().current_versions()
+        self.client().current_versions()
+        self.assertEqual([url for _, url, _ in self.server.requests].count(
+            URL + "/v2/auth/tokens"), 1)
+
+    def test_rejected_token_is_refreshed_once(self):
+        self.cache.put(URL, "user", "revoked", "2099-01-01T00:00:00Z")
+        self.assertEqual(self.client().current_versions(), {})
+        self.assertEqual([auth for _, _, auth in self.server.requests], [
+            "Bearer revoked", "Basic dXNlcjpwYXNz", "Bearer fresh"])
+        self.assertEqual(self.cache.get(URL, "user"), "fresh")
+
+    def test_still_rejected_after_refresh(self):
+        self.server.accepted = "nobody's"
+        with self.assertRaises(TitleEditorError) as context:
+            self.client().current_versions()
+        self.assertEqual(context.exception.status, 401)
+        # one new token, no loop
+        self.assertEqual([url for _, url, _ in self.server.requests].count(
+            URL + "/v2/auth/tokens"), 2)
+
+if __name__ == "__main__":
+    unittest.main()
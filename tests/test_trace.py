@@ -0,0 +1,206 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import support  # noqa: F401
+
+from TitleEditorLib import trace
+from TitleEditorLib.__main__ import main
+from TitleEditorLib.trace import (Tracer, aggregate, format_rows,
+                                  percentile, read_spans)
+
+
+def make_span(phase, seconds, **attrs):
+    return dict({"run": "r", "phase": phase, "start": 1000.0,
+                 "seconds": seconds}, **attrs)
+
+
+class AggregateTest(unittest.TestCase):
+    def test_nearest_rank_percentile(self):
+        values = list(range(1, 21))
+        self.assertEqual(percentile(values, 0.50), 10)
+        self.assertEqual(percentile(values, 0.95), 19)
+        self.assertEqual(percentile(values, 1.0), 20)
+        self.assertEqual(percentile([7], 0.95), 7)
+
+    def test_row_per_phase(self):
+        spans = [make_span("http", seconds, bytes=100) for seconds in
+                 (0.4, 0.1, 0.3, 0.2)]
+        spans += [make_span("http", 0.5, status=404),
+                  make_span("cleanup", 1.0, error="OSError")]
+        cleanup, http = aggregate(spans)
+        self.assertEqual(cleanup["key"], ("cleanup",))
+        self.assertEqual((cleanup["count"], cleanup["errors"]), (1, 1))
+        self.assertEqual(http["key"], ("http",))
+        self.assertEqual((http["count"], http["p50"], http["p95"],
+                          http["max"], http["bytes"], http["errors"]),
+                         (5, 0.3, 0.5, 0.5, 400, 1))
+        self.assertAlmostEqual(http["total"], 1.5)
+
+    def test_group_by(self):
+        spans = [make_span("http", 0.1, host="a"),
+                 make_span("http", 0.2, host="b"),
+                 make_span("http", 0.3, host="a"), make_span("http", 0.4)]
+        rows = aggregate(spans, ("phase", "host"))
+        self.assertEqual([(row["key"], row["count"]) for row in rows],
+                         [(("http", "-"), 1), (("http", "a"), 2),
+                          (("http", "b"), 1)])
+
+    def test_format_rows(self):
+        group_by = ("phase", "host")
+        rows = aggregate([make_span("http", 0.25, host="a", bytes=3 << 20)],
+                         group_by)
+        header, row = format_rows(rows, group_by).splitlines()
+        self.assertEqual(header.split(), ["PHASE", "HOST", "COUNT", "P50",
+                                          "P95", "MAX", "TOTAL", "MB",
+                                          "ERRORS"])
+        self.assertEqual(row.split(), ["http", "a", "1", "0.250", "0.250",
+                                       "0.250", "0.2", "3.0", "0"])
+
+
+class TracerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.path = os.path.join(self.tmp, "trace", "trace.jsonl")
+
+    def tracer(self, phases=("http",)):
+        tracer = Tracer(self.path, host="a", title_id=None)
+        for phase in phases:
+            tracer.record(phase, 0.5, status=200)
+        return tracer
+
+    def lines(self, path=None):
+        with open(path or self.path) as fp:
+            return [json.loads(line) for line in fp]
+
+    def test_span_records_errors(self):
+        tracer = Tracer()
+        with self.assertRaises(OSError):
+            with tracer.span("cleanup", bytes=10) as attrs:
+                attrs["status"] = 500
+                raise OSError("busy")
+        (recorded,) = tracer.spans
+        self.assertEqual((recorded["phase"], recorded["bytes"],
+                          recorded["status"], recorded["error"]),
+                         ("cleanup", 10, 500, "OSError"))
+
+    def test_write_appends_the_spans_once(self):
+        tracer = self.tracer(("http", "cleanup"))
+        self.assertEqual(tracer.write(), 2)
+        self.assertEqual(tracer.write(), 0)
+        self.tracer().write()
+        spans = self.lines()
+        self.assertEqual([span["phase"] for span in spans],
+                         ["http", "cleanup", "http"])
+        self.assertEqual(spans[0]["host"], "a")
+        self.assertNotIn("title_id", spans[0])
+
+    def test_rotated_at_the_size_limit(self):
+        self.tracer().write()
+        size = os.path.getsize(self.path)
+        with mock.patch.object(trace, "MAX_TRACE_BYTES", size):
+            self.tracer().write()
+            self.assertEqual(len(self.lines()), 2)
+            self.tracer(("cleanup",)).write()
+        self.assertEqual([span["phase"] for span in self.lines()],
+                         ["cleanup"])
+        self.assertEqual(len(self.lines(self.path + ".1")), 2)
+
+    def test_rotated_while_waiting_for_the_lock(self):
+        self.tracer(("http", "http")).write()
+        size = os.path.getsize(self.path)
+        waiting = threading.Event()
+        flock = trace.fcntl.flock
+
+        def locking(fd, operation):
+            waiting.set()
+            flock(fd, operation)
+
+        holder = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        flock(holder, trace.fcntl.LOCK_EX)
+        with mock.patch.object(trace, "MAX_TRACE_BYTES", size - 1), \
+                mock.patch.object(trace.fcntl, "flock", locking):
+            writer = threading.Thread(target=self.tracer(("late",)).write)
+            writer.start()
+            self.assertTrue(waiting.wait(5))
+            # another run rotates the file while this one waits
+            os.replace(self.path, self.path + ".1")
+            self.tracer(("other",)).write()
+            os.close(holder)
+            writer.join(5)
+        self.assertEqual([span["phase"] for span in
+                          self.lines(self.path + ".1")], ["http", "http"])
+        self.assertEqual([span["phase"] for span in self.lines()],
+                         ["other", "late"])
+
+    def test_concurrent_writers_keep_whole_lines(self):
+        def write():
+            for _ in range(20):
+                self.tracer(["http"] * 50).write()
+
+        writers = [threading.Thread(target=write) for _ in range(4)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join(30)
+        self.assertEqual(len(self.lines()), 4 * 20 * 50)
+
+    def test_read_spans_skips_broken_lines(self):
+        self.tracer().write()
+        with open(self.path, "a") as fp:
+            fp.write("{broken\n")
+            fp.write(json.dumps(make_span("old", 1.0, start=10.0)) + "\n")
+        spans = list(read_spans([self.path + ".1", self.path]))
+        self.assertEqual([span["phase"] for span in spans], ["http", "old"])
+        self.assertEqual([span["phase"] for span in
+                          read_spans([self.path], since=100.0)], ["http"])
+
+
+class TraceSummaryCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        tracer = Tracer(os.path.join(self.tmp, "trace.jsonl"))
+        for host, title_id in (("a", "7"), ("a", "8"), ("b", "7")):
+            tracer.record("http", 0.5, host=host, title_id=title_id)
+        tracer.write()
+
+    def summary(self, *args):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            status = main(["--cache-dir", self.tmp, "trace-summary"] +
+                          list(args))
+        return status, [line.split() for line in
+                        output.getvalue().splitlines()]
+
+    def test_by_phase(self):
+        status, (header, row) = self.summary()
+        self.assertEqual(status, 0)
+        self.assertEqual(header[:2], ["PHASE", "COUNT"])
+        self.assertEqual(row[:2], ["http", "3"])
+
+    def test_group_by(self):
+        status, table = self.summary("--by", "phase,host")
+        self.assertEqual([row[:3] for row in table],
+                         [["PHASE", "HOST", "COUNT"], ["http", "a", "2"],
+                          ["http", "b", "1"]])
+        status, table = self.summary("--by", "title_id")
+        self.assertEqual([row[:2] for row in table[1:]],
+                         [["7", "2"], ["8", "1"]])
+
+    def test_no_spans(self):
+        status, (line,) = self.summary("--since", "0.001",
+                                       os.path.join(self.tmp, "missing"))
+        self.assertEqual(status, 1)
+        self.assertEqual(line[:3], ["No", "spans", "in"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,212 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import support
+
+import pkgfixtures
+
+if support.have_module("autopkglib"):
+    from UpdateTitleEditor import UpdateTitleEditor
+    from TitleEditorLib.client import TitleEditorError
+    from TitleEditorLib.payload import PayloadApp, PayloadError
+
+
+class ProcessorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.pkg_path = pkgfixtures.make_package(
+            os.path.join(self.tmp, "Sample.pkg"), size=4096, version="2.0")
+
+    def processor(self, **env):
+        processor = UpdateTitleEditor()
+        processor.env = dict({"pkg_path": self.pkg_path, "title_id": "7",
+                              "version": "2.0", "CACHE_DIR": self.tmp,
+                              "trace_file": "none"}, **env)
+        processor.output = mock.Mock()
+        processor.notifyServer = mock.Mock()
+        return processor
+
+
+@support.requires_autopkg
+class UpdateTitleTest(ProcessorTestCase):
+    def sent_version(self, processor):
+        (title_id, patch, current), _ = processor.notifyServer.call_args
+        self.assertEqual(title_id, "7")
+        return current
+
+    def test_fast_path_reads_neither_payload_nor_whole_package(self):
+        processor = self.processor(package_info_fast_path=True)
+        with mock.patch.object(processor, "unpack_package",
+                               side_effect=AssertionError("unpacked")), \
+                mock.patch.object(processor, "package_key",
+                                  side_effect=AssertionError("hashed")):
+            processor.update_title()
+        self.assertIn('"2.0"', self.sent_version(processor))
+
+    def test_slow_path_uses_metadata_cache(self):
+        app = PayloadApp("Applications/Sample.app",
+                         pkgfixtures.info_plist("com.example.sample", "2.0"),
+                         pkgfixtures.MTIME)
+        processor = self.processor()
+        with mock.patch.object(processor, "unpack", return_value=app):
+            processor.update_title()
+
+        processor = self.processor()
+        with mock.patch.object(processor, "unpack",
+                               side_effect=AssertionError("unpacked")):
+            processor.update_title()
+        self.assertIn('"2.0"', self.sent_version(processor))
+        processor.output.assert_any_call(
+            "Using cached metadata for Applications/Sample.app")
+
+    def test_fast_path_falls_back_to_cache(self):
+        # pkg_vers_key names a key PackageInfo doesn't have
+        app = PayloadApp("Applications/Sample.app",
+                         pkgfixtures.info_plist("com.example.sample", "2.0"),
+                         pkgfixtures.MTIME)
+        env = {"package_info_fast_path": True,
+               "pkg_vers_key": "CFBundleName"}
+        processor = self.processor(**env)
+        with mock.patch.object(processor, "unpack", return_value=app):
+            processor.update_title()
+        processor = self.processor(**env)
+        with mock.patch.object(processor, "unpack",
+                               side_effect=AssertionError("unpacked")):
+            processor.update_title()
+        self.assertIn('"sample"', self.sent_version(processor))
+
+
+@support.requires_autopkg
+class UnpackAppTest(ProcessorTestCase):
+    def test_each_payload_is_unpacked_apart(self):
+        processor = self.processor()
+        destinations = []
+
+        def unpack_pkg_payload():
+            destination = processor.env["destination_path"]
+            if not destinations:
+                # only the first Payload installs an App
+                os.makedirs(os.path.join(destination, "Applications",
+                                         "First.app"))
+            destinations.append(destination)
+        processor.unpack_pkg_payload = unpack_pkg_payload
+        try:
+            first, _ = processor.unpack_app()
+            second, _ = processor.unpack_app()
+        finally:
+            processor.workspace().release(background=False)
+        self.assertEqual([os.path.basename(path) for path in first],
+                         ["First.app"])
+        self.assertEqual(second, [])
+        self.assertNotEqual(*destinations)
+
+
+@support.requires_autopkg
+class PrefetchTest(ProcessorTestCase):
+    def test_workers_log_through_the_main_thread(self):
+        processor = self.processor()
+        threads = []
+        processor.output.side_effect = \
+            lambda message: threads.append(threading.current_thread())
+        release = threading.Event()
+
+        def title_state(title_id):
+            release.wait(5)
+            processor.log("Reading title %s" % title_id)
+            raise TitleEditorError("offline")
+
+        processor.client = mock.Mock()
+        processor.client.get_token.side_effect = \
+            lambda: processor.log("Fetched token")
+        processor.client.title_state.side_effect = title_state
+        processor.prefetch_title_states(["7", "8"])
+        processor.output.assert_not_called()
+        release.set()
+
+        self.assertIsNone(processor.title_state("7"))
+        processor.join_prefetch()
+        self.assertEqual(
+            [call.args[0] for call in processor.output.call_args_list],
+            ["Fetched token", "Reading title 7",
+             "Can't read title 7, skipping pre-flight: offline",
+             "Reading title 8",
+             "Can't read title 8, skipping pre-flight: offline"])
+        self.assertEqual(set(threads), {threading.main_thread()})
+        self.assertFalse(any(thread.name.startswith("title-editor")
+                             for thread in threading.enumerate()))
+
+
+@support.requires_autopkg
+class FlushOutboxTest(ProcessorTestCase):
+    def flush(self, updated):
+        processor = self.processor()
+        processor.client = mock.Mock()
+        processor.client.title_state.return_value = None
+        processor.client.update_title.return_value = updated
+        outbox = processor.outbox()
+        outbox.enqueue("7", "2.0", "patch", "current")
+        outbox.close()
+        processor.flush_outbox()
+        return processor.env.get("title_updated", False)
+
+    def test_title_already_at_version_is_not_updated(self):
+        self.assertFalse(self.flush(False))
+
+    def test_changed_title_is_updated(self):
+        self.assertTrue(self.flush(True))
+
+
+@support.requires_autopkg
+class StreamPackageTest(ProcessorTestCase):
+    def processor(self, **env):
+        processor = super().processor(**env)
+        processor.unpack_flat_pkg = mock.Mock(
+            side_effect=AssertionError("expanded"))
+        self.addCleanup(lambda: processor.workspace().release(
+            background=False))
+        return processor
+
+    def test_payload_is_streamed_from_the_package(self):
+        app = self.processor().unpack()
+        self.assertEqual(app.path, "Applications/Sample.app")
+
+    def test_component_payloads_are_streamed_from_the_package(self):
+        pkgfixtures.make_package(self.pkg_path, shape="nested", size=4096,
+                                 components=3)
+        self.assertEqual(self.processor().unpack().path,
+                         "Applications/Sample.app")
+        apps = self.processor().unpack_apps(["com.example.sample"])
+        self.assertEqual(apps["com.example.sample"].path,
+                         "Applications/Sample.app")
+
+    def test_other_packages_are_expanded(self):
+        with open(self.pkg_path, "wb") as fp:
+            fp.write(b"not a xar archive")
+        with self.assertRaises(AssertionError):
+            self.processor().unpack()
+
+    def test_unstreamable_payload_is_unpacked_from_the_expanded_package(self):
+        processor = self.processor()
+        expanded = os.path.join(self.tmp, "expanded")
+
+        def unpack_package():
+            processor.env["destination_path"] = expanded
+        processor.unpack_package = mock.Mock(side_effect=unpack_package)
+        processor.unpack_app = mock.Mock(return_value=(
+            [os.path.join(self.tmp, "Sample.app")], "*.app"))
+        with mock.patch("TitleEditorLib.payload.find_apps",
+                        side_effect=PayloadError("unsupported")):
+            self.assertEqual(processor.unpack(),
+                             os.path.join(self.tmp, "Sample.app"))
+        self.assertEqual(processor.env["pkg_payload_path"],
+                         os.path.join(expanded, "Payload"))
+        processor.unpack_package.assert_called_once_with()
+
+
+if __name__ == "__main__":
+    unittest.main()
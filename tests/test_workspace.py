@@ -0,0 +1,157 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import support  # noqa: F401
+
+from TitleEditorLib import workspace
+from TitleEditorLib.__main__ import main
+from TitleEditorLib.workspace import (OWNER_FILE, WorkspaceError,
+                                      WorkspaceManager)
+
+DEAD_PID = 99999
+
+
+def alive(pid):
+    return pid != DEAD_PID
+
+
+class WorkspaceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.root = os.path.join(self.tmp, "scratch")
+        patcher = mock.patch.object(workspace, "_alive", alive)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def leftover(self, name, pid, host=None, created=None):
+        """Writes a directory as another run would have left it"""
+        path = os.path.join(self.root, name)
+        os.makedirs(path)
+        with open(os.path.join(path, OWNER_FILE), "w") as fp:
+            json.dump({"pid": pid, "host": host or socket.gethostname(),
+                       "created": created or time.time()}, fp)
+        with open(os.path.join(path, "Payload"), "wb") as fp:
+            fp.write(b"x" * 1024)
+        return path
+
+
+class QuotaTest(WorkspaceTestCase):
+    def test_needed_over_quota(self):
+        manager = WorkspaceManager(self.root, quota=1000)
+        with self.assertRaises(WorkspaceError):
+            manager.create(needed=1001)
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_used_and_needed_over_quota(self):
+        self.leftover("run-1-live", os.getpid())
+        manager = WorkspaceManager(self.root, quota=2048)
+        with self.assertRaises(WorkspaceError) as raised:
+            manager.create(needed=1500)
+        self.assertIn("Scratch quota exceeded", str(raised.exception))
+        self.assertTrue(manager.create(needed=500))
+
+    def test_workspace_is_created_on_first_use(self):
+        manager = WorkspaceManager(self.root)
+        with manager.workspace() as scratch:
+            self.assertFalse(os.path.exists(self.root))
+            path = scratch.join("UnpackedPackage")
+            self.assertEqual(os.path.dirname(path), scratch.path)
+            with open(os.path.join(scratch.path, OWNER_FILE)) as fp:
+                self.assertEqual(json.load(fp)["pid"], os.getpid())
+        manager.wait()
+        self.assertEqual(os.listdir(self.root), [])
+
+
+class ReleaseTest(WorkspaceTestCase):
+    def test_renamed_to_trash_and_deleted_in_the_background(self):
+        manager = WorkspaceManager(self.root)
+        path = manager.create()
+        deleting = threading.Event()
+        finish = threading.Event()
+        rmtree = shutil.rmtree
+
+        def slow_rmtree(path, ignore_errors=False):
+            deleting.set()
+            finish.wait(5)
+            rmtree(path, ignore_errors=ignore_errors)
+
+        with mock.patch.object(workspace.shutil, "rmtree", slow_rmtree):
+            manager.release(path)
+            self.assertTrue(deleting.wait(5))
+            self.assertFalse(os.path.exists(path))
+            (trash,) = os.listdir(self.root)
+            self.assertTrue(trash.startswith("trash-%d-" % os.getpid()))
+            # trash of this process is not swept while it is deleted
+            self.assertEqual(manager.sweep(), 0)
+            self.assertFalse(manager.wait(timeout=0.1))
+            finish.set()
+            self.assertTrue(manager.wait(timeout=5))
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_release_in_the_foreground(self):
+        manager = WorkspaceManager(self.root)
+        manager.release(manager.create(), background=False)
+        self.assertEqual(os.listdir(self.root), [])
+
+
+class SweepTest(WorkspaceTestCase):
+    def test_dead_runs_are_removed(self):
+        dead = self.leftover("run-99999-dead", DEAD_PID)
+        live = self.leftover("run-1-live", os.getpid())
+        other_host = self.leftover("run-99999-other", DEAD_PID,
+                                   host="elsewhere")
+        size = workspace.tree_size(dead)
+        self.assertEqual(WorkspaceManager(self.root).sweep(), size)
+        self.assertEqual(sorted(os.listdir(self.root)),
+                         sorted(map(os.path.basename, [live, other_host])))
+
+    def test_old_runs_are_removed(self):
+        self.leftover("run-1-old", os.getpid(),
+                      created=time.time() - workspace.MAX_AGE - 1)
+        self.assertTrue(WorkspaceManager(self.root).sweep())
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_trash_of_live_runs_is_kept(self):
+        self.leftover("trash-99999-dead", DEAD_PID)
+        self.leftover("trash-1-live", os.getpid())
+        WorkspaceManager(self.root).sweep()
+        self.assertEqual(os.listdir(self.root), ["trash-1-live"])
+
+
+class ScratchCommandTest(WorkspaceTestCase):
+    def scratch(self, *args):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            status = main(["--cache-dir", self.tmp, "scratch"] + list(args))
+        self.assertEqual(status, 0)
+        return output.getvalue().splitlines()
+
+    def test_sweep(self):
+        dead = self.leftover("run-99999-dead", DEAD_PID)
+        self.leftover("run-1-live", os.getpid())
+        self.assertEqual(self.scratch("sweep"),
+                         ["Removing orphaned scratch dir %s" % dead,
+                          "Freed 0 MB"])
+        self.assertEqual(os.listdir(self.root), ["run-1-live"])
+        self.scratch("sweep", "--max-age", "0")
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_list(self):
+        self.leftover("run-1-live", os.getpid())
+        (line,) = self.scratch()
+        self.assertIn("run-1-live", line)
+        self.assertIn("pid %d" % os.getpid(), line)
+
+
+if __name__ == "__main__":
+    unittest.main()